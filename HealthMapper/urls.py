@@ -17,9 +17,11 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.views.generic import RedirectView
+from maps.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('maps/', include('maps.urls')),
+    path('metrics', metrics_view, name='metrics'),
     path('', RedirectView.as_view(url='/maps/map/', permanent=False)),
 ]
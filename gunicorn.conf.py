@@ -0,0 +1,49 @@
+"""Gunicorn configuration for HealthMapper.
+
+Bind address and timeout are passed on the command line by start.sh; this file
+holds the worker class and the server hooks.
+"""
+import os
+import shutil
+import time
+
+
+# Workers write Prometheus samples here so /metrics can aggregate across processes.
+# Must be set before any worker imports prometheus_client.
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/healthmapper-metrics')
+
+# ASGI workers: async views are served concurrently on each worker's event loop,
+# and the blocking analysis views run on its analysis thread pool (maps.offload).
+worker_class = 'uvicorn_worker.UvicornWorker'
+
+# GUNICORN_PRELOAD=1 loads the app and warms its read-only caches (maps.preload)
+# in the master, so workers fork with them in shared memory instead of each
+# importing and building them on boot.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '0') == '1'
+
+
+def on_starting(server):
+    # Start each server run with empty metric files
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def when_ready(server):
+    if preload_app:
+        from maps import preload
+        preload.warm()
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+
+
+def post_worker_init(worker):
+    from maps import preload
+    preload.worker_ready(worker.forked_at)
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of workers that exited or were recycled
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
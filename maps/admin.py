@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib import admin
-from .models import HealthCareFacility
+from .models import FacilityCategory, HealthCareFacility
 from leaflet.admin import LeafletGeoAdmin
 from django.contrib.gis.geos import Point
 from .forms import HealthCareFacilityForm
@@ -8,10 +8,17 @@ from .forms import HealthCareFacilityForm
 @admin.register(HealthCareFacility)
 class HealthcareFacilityAdmin(LeafletGeoAdmin):
     form = HealthCareFacilityForm
-    list_display = ('name', 'facility_type', 'capacity', 'latitude', 'longitude')
+    list_display = ('name', 'facility_type', 'category', 'capacity', 'latitude', 'longitude')
+    list_filter = ('category',)
     search_fields = ('name', 'facility_type')
 
     def get_fields(self, request, obj=None):
         fields = ['name', 'facility_type', 'capacity', 'latitude', 'longitude']
         return fields
-    
+
+
+@admin.register(FacilityCategory)
+class FacilityCategoryAdmin(admin.ModelAdmin):
+    list_display = ('name', 'is_served_type', 'service_radius_km', 'expected_population', 'min_spacing_km')
+    list_editable = ('is_served_type', 'service_radius_km', 'expected_population', 'min_spacing_km')
+    search_fields = ('name',)
@@ -0,0 +1,193 @@
+"""Admission control and single-flight coalescing for the heavy analysis views.
+
+Every ``offload``-ed view passes through here; the cheap views (map layers,
+snapshots, metrics) are not offloaded and are never limited.
+
+Admission: an analysis needs a slot of this process (MAPS_ADMISSION_SLOTS)
+and one of the host (MAPS_ADMISSION_HOST_SLOTS, shared by every worker
+through lock files in MAPS_ADMISSION_LOCK_DIR). Up to MAPS_ADMISSION_QUEUE
+requests per process wait for a slot, each for at most
+MAPS_ADMISSION_TIMEOUT seconds; beyond that the request fails fast with
+``Saturated``, which the views answer with 503 and a Retry-After header::
+
+    async with admission.admitted():
+        ...
+
+A host slot is an ``flock`` on a file, so a worker that dies releases its
+slots with its file descriptors. Without fcntl (Windows) only the per-process
+limit applies.
+
+Single flight: identical requests that arrive while one is being computed
+wait for it instead of computing again::
+
+    result, shared = await admission.single_flight(key, compute)
+
+Waiters take neither a slot nor a queue place. They get the same result, or
+the same exception.
+"""
+import asyncio
+import concurrent.futures
+import os
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+
+from .instrumentation import phase
+
+try:
+    import fcntl
+except ImportError:  # no flock on Windows; the host-wide limit is skipped
+    fcntl = None
+
+
+# Seconds between attempts to take a slot while waiting
+POLL_INTERVAL = 0.05
+
+
+class Saturated(Exception):
+    """Every slot is taken and the queue is full, or waiting for a slot timed out"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class Slots:
+    """The process's analysis slots, each also holding one of the host's"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.waiting = 0
+        self._next_host_slot = 0
+
+    def _host_slot(self):
+        """An open, flock-ed slot file, or None if every host slot is taken"""
+        count = _setting('MAPS_ADMISSION_HOST_SLOTS', os.cpu_count() or 1)
+        if fcntl is None or not count:
+            return True
+        lock_dir = _setting('MAPS_ADMISSION_LOCK_DIR', os.path.join(tempfile.gettempdir(), 'maps-admission'))
+        os.makedirs(lock_dir, exist_ok=True)
+        # Start where the last search stopped, so the processes don't all contend for slot 0
+        start = self._next_host_slot
+        for offset in range(count):
+            index = (start + offset) % count
+            file = open(os.path.join(lock_dir, f'slot-{index}.lock'), 'a')
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                file.close()
+                continue
+            self._next_host_slot = index + 1
+            return file
+        return None
+
+    def try_acquire(self):
+        """A slot token, or None if the process or the host has none free"""
+        with self.lock:
+            if self.running >= _setting('MAPS_ADMISSION_SLOTS', _setting('MAPS_ANALYSIS_THREADS', 4)):
+                return None
+            host_slot = self._host_slot()
+            if host_slot is None:
+                return None
+            self.running += 1
+            return host_slot
+
+    def release(self, token):
+        with self.lock:
+            self.running -= 1
+        if token is not True:
+            # Closing the file drops its lock
+            token.close()
+
+    def enqueue(self):
+        """Take a place in the queue, or raise Saturated if it's full"""
+        with self.lock:
+            if self.waiting >= _setting('MAPS_ADMISSION_QUEUE', 8):
+                raise Saturated('Too many analyses queued', _setting('MAPS_ADMISSION_RETRY_AFTER', 5))
+            self.waiting += 1
+
+    def dequeue(self):
+        with self.lock:
+            self.waiting -= 1
+
+
+slots = Slots()
+
+
+async def acquire():
+    """Take an analysis slot, waiting in the queue for one if need be; the token is for ``slots.release``"""
+    token = slots.try_acquire()
+    if token is None:
+        slots.enqueue()
+        try:
+            with phase('admission'):
+                deadline = time.monotonic() + _setting('MAPS_ADMISSION_TIMEOUT', 30.0)
+                while (token := slots.try_acquire()) is None:
+                    if time.monotonic() >= deadline:
+                        raise Saturated('Timed out waiting for an analysis slot',
+                                        _setting('MAPS_ADMISSION_RETRY_AFTER', 5))
+                    await asyncio.sleep(POLL_INTERVAL)
+        finally:
+            slots.dequeue()
+    return token
+
+
+@asynccontextmanager
+async def admitted():
+    """Hold an analysis slot for the duration of the block, waiting in the queue for one if need be"""
+    token = await acquire()
+    try:
+        yield
+    finally:
+        slots.release(token)
+
+
+# {key: concurrent future of the computation in flight}, shared by every event loop of the process
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+class _Abandoned(Exception):
+    """The request computing a flight went away (the client disconnected) before it finished"""
+
+
+async def single_flight(key, compute):
+    """Await `compute()`, or the computation already in flight for `key`
+
+    Returns (result, shared): `shared` is True if the result came from
+    another request's computation.
+    """
+    while True:
+        with _flights_lock:
+            flight = _flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _flights[key] = concurrent.futures.Future()
+        if leader:
+            break
+        try:
+            # A concurrent future, since the leader may be running on another event loop (WSGI)
+            return await asyncio.wrap_future(flight), True
+        except _Abandoned:
+            # Compute it ourselves, or wait for whichever waiter does
+            continue
+
+    try:
+        result = await compute()
+    except BaseException as e:
+        with _flights_lock:
+            del _flights[key]
+        flight.set_exception(_Abandoned() if isinstance(e, asyncio.CancelledError) else e)
+        raise
+    with _flights_lock:
+        del _flights[key]
+    flight.set_result(result)
+    return result, False
@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class MapsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'maps'
+
+    def ready(self):
+        from . import artifacts
+        from .models import (FacilityCategory, HealthCareFacility, KenyaConstituency, KenyaCounty, KenyaWard,
+                             PopulationDensity)
+
+        # Rebuild the derived artifacts when their source data changes
+        for model in [HealthCareFacility, FacilityCategory, PopulationDensity, KenyaWard, KenyaCounty, KenyaConstituency]:
+            for action, signal in [('save', post_save), ('delete', post_delete)]:
+                signal.connect(artifacts.inputs_changed, sender=model,
+                               dispatch_uid=f'maps.artifacts.{action}.{model.__name__}')
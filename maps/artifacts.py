@@ -0,0 +1,447 @@
+"""Dependency graph of the derived artifacts, rebuilt only when stale.
+
+Each node declares what it depends on. Input nodes fingerprint a source: the
+facility table, a boundary table, the population raster file or a policy
+(the facility category table, layer settings). Artifact nodes build something the views
+read: the map layer files, the population grid, coverage layers, footprints,
+density and distance surfaces cached next to the raster, the GeoParquet
+snapshots and, on PostGIS, the subdivided county table. A node's key hashes
+its own fingerprint with the keys of its dependencies, so a change anywhere
+upstream changes every key below it.
+
+``build()`` computes the keys, compares them with the keys recorded at the
+last build (``MAPS_ARTIFACT_ROOT/graph.json``) and rebuilds only the stale
+artifacts. They run in dependency order, in parallel where independent::
+
+    python manage.py build_artifacts            # everything that is stale
+    python manage.py build_artifacts --force layer:wards
+
+Saving or deleting a facility, category, boundary or dataset schedules a rebuild
+(``inputs_changed``). Changes within MAPS_REBUILD_DELAY seconds of each other,
+such as a burst of admin edits, coalesce into a single rebuild.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import cached_property
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+
+try:
+    import fcntl
+except ImportError:  # no cross-process build lock on Windows
+    fcntl = None
+
+from . import (boundaries, categories, coverage, cube, distance, hexbins, kde, layers, population, snapshots,
+               spatial_sql)
+from .models import HealthCareFacility, KenyaConstituency, KenyaWard, PopulationDensity
+
+
+logger = logging.getLogger(__name__)
+
+
+class Node:
+    """A graph node: an input if it has no `build`, an artifact otherwise"""
+
+    def __init__(self, name, deps=(), fingerprint=None, build=None):
+        self.name = name
+        self.deps = tuple(deps)
+        self.fingerprint = fingerprint  # (inputs) -> JSON-serializable value of the node's own inputs
+        self.build = build  # (inputs) -> None
+
+    @property
+    def is_artifact(self):
+        return self.build is not None
+
+
+class Inputs:
+    """Source data of one build, loaded on first use and shared by the nodes"""
+
+    def __init__(self):
+        # {node name: key} of the build, set by build()
+        self.versions = {}
+
+    @cached_property
+    def facilities(self):
+        return list(HealthCareFacility.objects.served())
+
+    @cached_property
+    def wards(self):
+        return list(KenyaWard.objects.in_county('KISUMU'))
+
+    @cached_property
+    def boundary(self):
+        return boundaries.county('KISUMU')
+
+    @cached_property
+    def dataset(self):
+        return PopulationDensity.objects.first()
+
+    @property
+    def raster_path(self):
+        return self.dataset.raster_file.path
+
+    @property
+    def service_radii_km(self):
+        return categories.policy().radii_km(self.facilities)
+
+
+def _digest(values):
+    hasher = hashlib.sha256()
+    for value in values:
+        hasher.update(value if isinstance(value, bytes) else repr(value).encode())
+    return hasher.hexdigest()[:16]
+
+
+# Raster hashes by (path, size, mtime), so an unchanged file isn't re-read
+_file_hashes = {}
+
+
+def file_hash(path):
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if key not in _file_hashes:
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                hasher.update(chunk)
+        _file_hashes[key] = hasher.hexdigest()[:16]
+    return _file_hashes[key]
+
+
+def _facilities_fingerprint(inputs):
+    return _digest((facility.pk, facility.name, facility.facility_type, facility.category_id, facility.capacity,
+                    facility.location.coords)
+                   for facility in inputs.facilities)
+
+
+def _wards_fingerprint(inputs):
+    return _digest(item for ward in inputs.wards
+                   for item in ((ward.pk, ward.ward, ward.subcounty, ward.pop2019), bytes(ward.geom.wkb)))
+
+
+def _county_fingerprint(inputs):
+    return inputs.boundary.wkb if inputs.boundary is not None else None
+
+
+def _constituencies_fingerprint(inputs):
+    return _digest(item for constituency in KenyaConstituency.objects.filter(county_nam__iexact='KISUMU').order_by('pk')
+                   for item in ((constituency.pk, constituency.const_name, constituency.const_no),
+                                bytes(constituency.geom.wkb)))
+
+
+def _counties_fingerprint(inputs):
+    # Every county, as the parts table holds them all; only PostGIS has the table
+    return spatial_sql.counties_fingerprint() if spatial_sql.available() else None
+
+
+def _datasets_fingerprint(inputs):
+    return [(dataset.pk, dataset.year, file_hash(dataset.raster_file.path)) for dataset in cube.datasets()]
+
+
+def _dataset_fingerprint(inputs):
+    if inputs.dataset is None:
+        return None
+    return [inputs.dataset.pk, file_hash(inputs.raster_path)]
+
+
+def _category_policy(inputs):
+    return categories.policy().version
+
+
+def _dashboard_policy(inputs):
+    from .views import DASHBOARD_RADIUS_KM
+    return DASHBOARD_RADIUS_KM
+
+
+def _snapshot_policy(inputs):
+    # Installing pyarrow makes the skipped snapshots stale
+    return [snapshots.GEOPARQUET_VERSION, snapshots.ROW_GROUP_SIZE, snapshots.available()]
+
+
+def _layer_policy(name):
+    def fingerprint(inputs):
+        layer = layers.LAYERS[name]
+        return [layer['fields'], layer['precision'], layer['simplify']]
+    return fingerprint
+
+
+def _build_layer(name):
+    def build(inputs):
+        layers.build_artifact(name)
+    return build
+
+
+def _build_county_parts(inputs):
+    if spatial_sql.available() and spatial_sql.parts_status() != 'current':
+        spatial_sql.build_parts()
+
+
+def _build_population(inputs):
+    if inputs.dataset is None:
+        return
+    population.get(inputs.raster_path)
+
+
+def _build_cube(inputs):
+    cube.get()
+
+
+def _build_coverage(name, radii):
+    def build(inputs):
+        if inputs.dataset is None or inputs.boundary is None:
+            return
+        coverage.get_layer(name, inputs.raster_path, inputs.facilities, radii(inputs), inputs.wards, inputs.boundary)
+    return build
+
+
+def _build_snapshot(name):
+    def build(inputs):
+        if name in ('ward-coverage', 'suitability-candidates') and (inputs.dataset is None or inputs.boundary is None):
+            return
+        snapshots.build(name, inputs.dataset, inputs.versions[f'snapshot:{name}'])
+    return build
+
+
+def _build_hexbins(inputs):
+    if inputs.dataset is None or inputs.boundary is None:
+        return
+    hexbins.get(inputs.raster_path, inputs.facilities, inputs.service_radii_km, inputs.wards, inputs.boundary)
+
+
+def _build_kde(inputs):
+    if inputs.dataset is None:
+        return
+    kde.get(inputs.raster_path, inputs.facilities)
+
+
+def _build_distance(inputs):
+    if inputs.dataset is None or inputs.boundary is None:
+        return
+    distance.get(inputs.raster_path, inputs.facilities, inputs.wards, inputs.boundary)
+
+
+def _build_footprints(inputs):
+    if inputs.dataset is None:
+        return
+    coverage.get_footprints('service-areas', inputs.raster_path, inputs.facilities, inputs.service_radii_km)
+
+
+GRAPH = {node.name: node for node in [
+    # Inputs
+    Node('facilities', fingerprint=_facilities_fingerprint),
+    Node('wards', fingerprint=_wards_fingerprint),
+    Node('county', fingerprint=_county_fingerprint),
+    Node('constituencies', fingerprint=_constituencies_fingerprint),
+    Node('counties', fingerprint=_counties_fingerprint),
+    Node('dataset', fingerprint=_dataset_fingerprint),
+    Node('datasets', fingerprint=_datasets_fingerprint),
+    Node('policy:categories', fingerprint=_category_policy),
+    Node('policy:dashboard-radius', fingerprint=_dashboard_policy),
+    # Map layer files served by /maps/api/layers/<name>/
+    Node('layer:county', ['county'], _layer_policy('county'), _build_layer('county')),
+    Node('layer:constituencies', ['constituencies'], _layer_policy('constituencies'), _build_layer('constituencies')),
+    Node('layer:wards', ['wards'], _layer_policy('wards'), _build_layer('wards')),
+    Node('layer:facilities', ['facilities'], _layer_policy('facilities'), _build_layer('facilities')),
+    # ST_Subdivide parts of the counties, which spatial_sql clips to
+    Node('spatial:county-parts', ['counties'], build=_build_county_parts),
+    # Persons per pixel and pixel area per row, derived from the density raster
+    Node('population:grid', ['dataset'], build=_build_population),
+    # Every year's population resampled onto one grid
+    Node('population:cube', ['datasets'], build=_build_cube),
+    # Population grid with the service areas, wards and county burned in
+    Node('coverage:dashboard', ['population:grid', 'facilities', 'wards', 'county', 'policy:dashboard-radius'],
+         build=_build_coverage('dashboard', lambda inputs: _dashboard_policy(inputs))),
+    Node('coverage:service-areas', ['population:grid', 'facilities', 'wards', 'county', 'policy:categories'],
+         build=_build_coverage('service-areas', lambda inputs: inputs.service_radii_km)),
+    Node('footprints:service-areas', ['dataset', 'facilities', 'policy:categories'],
+         build=_build_footprints),
+    # Population, facilities and coverage aggregated into hexagons
+    Node('hexbins:service-areas', ['coverage:service-areas'], lambda inputs: list(hexbins.RESOLUTIONS_M), _build_hexbins),
+    # Facility and population kernel density surfaces, and their ratio
+    Node('kde:facilities', ['population:grid', 'facilities'], lambda inputs: list(kde.BANDWIDTHS_KM), _build_kde),
+    # Distance to the nearest facility of each type, and population by distance per ward
+    Node('distance:facilities', ['population:grid', 'facilities', 'wards', 'county'], build=_build_distance),
+    # GeoParquet snapshots of the tables, versioned by their node's key
+    Node('snapshot:facilities', ['facilities'], _snapshot_policy, _build_snapshot('facilities')),
+    Node('snapshot:wards', ['wards'], _snapshot_policy, _build_snapshot('wards')),
+    Node('snapshot:constituencies', ['constituencies'], _snapshot_policy, _build_snapshot('constituencies')),
+    Node('snapshot:ward-coverage', ['coverage:service-areas'], _snapshot_policy, _build_snapshot('ward-coverage')),
+    Node('snapshot:suitability-candidates', ['population:grid', 'facilities', 'wards', 'county', 'policy:categories'],
+         _snapshot_policy,
+         _build_snapshot('suitability-candidates')),
+]}
+
+
+def topological_order(names=None):
+    """Node names in dependency order: every node after its dependencies"""
+    order, visiting, done = [], set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f'Dependency cycle at {name}')
+        visiting.add(name)
+        for dep in GRAPH[name].deps:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+        order.append(name)
+
+    for name in names or GRAPH:
+        visit(name)
+    return order
+
+
+def keys(inputs, names=None):
+    """{node name: key} of the nodes `names` and everything they depend on"""
+    result = {}
+    for name in topological_order(names):
+        node = GRAPH[name]
+        own = node.fingerprint(inputs) if node.fingerprint else None
+        result[name] = _digest([name, own] + [result[dep] for dep in node.deps])
+    return result
+
+
+def _manifest_path():
+    return os.path.join(settings.MAPS_ARTIFACT_ROOT, 'graph.json')
+
+
+def built_keys():
+    """{artifact name: key} recorded at the last successful build of each artifact"""
+    try:
+        with open(_manifest_path()) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_keys(built):
+    path = _manifest_path()
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(built, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+class _BuildLock:
+    """Exclusive lock across processes, so two builds never run at once"""
+
+    def __enter__(self):
+        os.makedirs(settings.MAPS_ARTIFACT_ROOT, exist_ok=True)
+        self.file = open(os.path.join(settings.MAPS_ARTIFACT_ROOT, 'graph.lock'), 'w')
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        return False
+
+
+def _run_node(node, inputs):
+    close_old_connections()
+    started = time.perf_counter()
+    try:
+        node.build(inputs)
+        return time.perf_counter() - started
+    finally:
+        connections.close_all()
+
+
+def build(names=None, force=False, jobs=None, inputs=None):
+    """Rebuild the stale artifacts among `names` (default all) and their dependencies
+
+    Returns {artifact name: (status, seconds)} with status 'fresh', 'built',
+    'failed' or 'skipped' (a dependency failed).
+    """
+    jobs = jobs or getattr(settings, 'MAPS_ARTIFACT_JOBS', 2)
+    with _BuildLock():
+        inputs = inputs or Inputs()
+        current = keys(inputs, names)
+        inputs.versions = current
+        built = built_keys()
+        artifacts = [name for name in current if GRAPH[name].is_artifact]
+        stale = {name for name in artifacts if force or built.get(name) != current[name]}
+        report = {name: ('fresh', 0.0) for name in artifacts if name not in stale}
+
+        def blocked(name):
+            # Upstream artifacts still to build, or failed
+            return [dep for dep in topological_order([name])[:-1]
+                    if dep in stale and report.get(dep, ('pending',))[0] != 'built']
+
+        pending = [name for name in artifacts if name in stale]
+        running = {}
+        with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='maps-artifacts') as executor:
+            while pending or running:
+                for name in list(pending):
+                    waiting = blocked(name)
+                    if any(report.get(dep, ('pending',))[0] in ('failed', 'skipped') for dep in waiting):
+                        report[name] = ('skipped', 0.0)
+                        pending.remove(name)
+                    elif not waiting:
+                        logger.info("Building %s", name)
+                        running[executor.submit(_run_node, GRAPH[name], inputs)] = name
+                        pending.remove(name)
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        report[name] = ('built', future.result())
+                        built[name] = current[name]
+                    except Exception as e:
+                        logger.exception("Building %s failed: %s", name, e)
+                        report[name] = ('failed', 0.0)
+
+        _save_keys(built)
+    return report
+
+
+# Debounced rebuilds after changes to the inputs
+_timer = None
+_timer_lock = threading.Lock()
+
+
+def schedule_rebuild(delay=None):
+    """Rebuild the stale artifacts `delay` seconds after the last call, in a background thread"""
+    global _timer
+    delay = getattr(settings, 'MAPS_REBUILD_DELAY', 5.0) if delay is None else delay
+    with _timer_lock:
+        if _timer is not None:
+            _timer.cancel()
+        _timer = threading.Timer(delay, _rebuild)
+        _timer.daemon = True
+        _timer.start()
+
+
+def _rebuild():
+    try:
+        report = build()
+        logger.info("Rebuilt artifacts after a change: %s",
+                    ', '.join(name for name, (status, _) in report.items() if status != 'fresh') or 'none stale')
+    except Exception as e:
+        logger.exception("Rebuilding artifacts failed: %s", e)
+    finally:
+        connections.close_all()
+
+
+def inputs_changed(sender, raw=False, **kwargs):
+    """post_save/post_delete receiver of the models the artifacts are derived from"""
+    # The process's cached boundaries and policy are dropped even when rebuilds are off
+    if sender is KenyaWard or sender.__name__ == 'KenyaCounty':
+        boundaries.clear()
+    if sender.__name__ == 'FacilityCategory':
+        categories.clear()
+    if raw or not getattr(settings, 'MAPS_REBUILD_ON_CHANGE', True):
+        return
+    transaction.on_commit(schedule_rebuild)
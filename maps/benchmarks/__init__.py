@@ -0,0 +1,5 @@
+"""Offline benchmark suite for the map and analysis endpoints.
+
+Run it with ``python manage.py benchmark`` against a local PostGIS (or
+SpatiaLite) database given through ``DATABASE_URL``.
+"""
@@ -0,0 +1,248 @@
+"""Deterministic synthetic Kisumu-scale fixtures for the benchmark suite"""
+import os
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from shapely.geometry import MultiPolygon, Polygon, box
+
+from django.contrib.gis.geos import GEOSGeometry, Point
+from django.db import connection
+
+from .. import boundaries, layers
+from ..models import FacilityCategory, HealthCareFacility, KenyaCounty, KenyaConstituency, KenyaWard, PopulationDensity
+
+
+# Bounding box of the synthetic county (west, south, east, north), roughly Kisumu
+COUNTY_BOUNDS = (34.55, -0.45, 35.35, 0.05)
+COUNTY_NAME = 'KISUMU'
+
+# Urban centres (lon, lat, peak density per km², spread in degrees)
+URBAN_CENTRES = [
+    (34.76, -0.09, 12000.0, 0.035),  # Kisumu city
+    (35.05, -0.33, 3000.0, 0.025),   # Muhoroni
+    (34.95, -0.15, 2500.0, 0.030),   # Ahero
+    (34.62, -0.05, 1500.0, 0.020),   # Maseno
+]
+
+# Facility type mix taken from the Kisumu rows of healthcare_facilities.csv
+FACILITY_TYPES = {
+    'Dispensary': 97,
+    'Medical Clinic': 40,
+    'Health Centre': 31,
+    'Other Hospital': 12,
+    'Sub-District Hospital': 8,
+    'Nursing Home': 6,
+    'District Hospital': 3,
+    'VCT Centre (Stand-Alone)': 2,
+    'Laboratory (Stand-alone)': 1,
+    'Provincial General Hospital': 1,
+    'Health Programme': 1,
+}
+
+# Data scales: facility count, raster resolution (degrees) and administrative grid
+SCALES = {
+    'small': {'facilities': 300, 'resolution': 1 / 600, 'constituencies': 7, 'wards': (5, 7)},
+    'medium': {'facilities': 1200, 'resolution': 1 / 1200, 'constituencies': 7, 'wards': (5, 7)},
+    'large': {'facilities': 4000, 'resolution': 1 / 2400, 'constituencies': 7, 'wards': (8, 10)},
+}
+
+
+def county_polygon(seed=0):
+    """Irregular county outline inscribed in COUNTY_BOUNDS"""
+    rng = np.random.default_rng(seed)
+    west, south, east, north = COUNTY_BOUNDS
+    cx, cy = (west + east) / 2, (south + north) / 2
+    rx, ry = (east - west) / 2, (north - south) / 2
+
+    angles = np.linspace(0, 2 * np.pi, 720, endpoint=False)
+    # Smooth radial noise so the outline has thousands of vertices once densified
+    noise = np.zeros_like(angles)
+    for k in range(2, 12):
+        noise += rng.normal(0, 0.04 / k) * np.cos(k * angles + rng.uniform(0, 2 * np.pi))
+    radius = np.clip(0.9 + noise, 0.6, 1.0)
+
+    outline = Polygon(np.column_stack([cx + rx * radius * np.cos(angles), cy + ry * radius * np.sin(angles)]))
+    return outline.segmentize(0.002)
+
+
+def administrative_units(county, columns, rows=1):
+    """Split the county into a columns x rows grid of multipolygons"""
+    west, south, east, north = county.bounds
+    xs = np.linspace(west, east, columns + 1)
+    ys = np.linspace(south, north, rows + 1)
+
+    units = []
+    for j in range(rows):
+        for i in range(columns):
+            part = county.intersection(box(xs[i], ys[j], xs[i + 1], ys[j + 1]))
+            if part.is_empty:
+                continue
+            units.append(as_multipolygon(part))
+    return units
+
+
+def as_multipolygon(geom):
+    """Coerce a shapely polygonal geometry to a MultiPolygon"""
+    if geom.geom_type == 'Polygon':
+        return MultiPolygon([geom])
+    if geom.geom_type == 'MultiPolygon':
+        return geom
+    return MultiPolygon([g for g in getattr(geom, 'geoms', []) if g.geom_type == 'Polygon'])
+
+
+def density_grid(resolution, seed=0):
+    """Population density (people per km²) on a regular lon/lat grid"""
+    rng = np.random.default_rng(seed)
+    west, south, east, north = COUNTY_BOUNDS
+    width = int(round((east - west) / resolution))
+    height = int(round((north - south) / resolution))
+
+    lons = west + (np.arange(width) + 0.5) * resolution
+    lats = north - (np.arange(height) + 0.5) * resolution
+    lon_grid, lat_grid = np.meshgrid(lons, lats)
+
+    density = np.full((height, width), 80.0)
+    for lon, lat, peak, spread in URBAN_CENTRES:
+        dist2 = (lon_grid - lon) ** 2 + (lat_grid - lat) ** 2
+        density += peak * np.exp(-dist2 / (2 * spread ** 2))
+    density *= rng.lognormal(0, 0.35, size=density.shape)
+
+    transform = from_origin(west, north, resolution, resolution)
+    return density.astype('float32'), transform
+
+
+def write_density_raster(path, resolution, county, seed=0):
+    """Write the synthetic density grid as a GeoTIFF clipped to the county"""
+    from rasterio.features import geometry_mask
+
+    density, transform = density_grid(resolution, seed)
+    outside = geometry_mask([county], out_shape=density.shape, transform=transform, all_touched=True)
+    density[outside] = np.nan
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with rasterio.open(
+        path, 'w', driver='GTiff', height=density.shape[0], width=density.shape[1],
+        count=1, dtype='float32', crs='EPSG:4326', transform=transform,
+        nodata=np.nan, compress='deflate', tiled=True,
+    ) as dst:
+        dst.write(density, 1)
+    return density.shape
+
+
+def facility_points(count, county, seed=0):
+    """Facility locations drawn inside the county, weighted towards urban centres"""
+    from shapely import contains_xy
+
+    rng = np.random.default_rng(seed)
+    west, south, east, north = county.bounds
+    types = list(FACILITY_TYPES)
+    weights = np.array(list(FACILITY_TYPES.values()), dtype=float)
+    weights /= weights.sum()
+
+    lons, lats = [], []
+    while len(lons) < count:
+        batch = count * 2
+        # Half the candidates cluster around towns, the rest are uniform
+        centre = rng.integers(0, len(URBAN_CENTRES), size=batch)
+        clustered = rng.random(batch) < 0.5
+        cx = np.array([URBAN_CENTRES[c][0] for c in centre])
+        cy = np.array([URBAN_CENTRES[c][1] for c in centre])
+        spread = np.array([URBAN_CENTRES[c][3] for c in centre]) * 1.5
+        x = np.where(clustered, rng.normal(cx, spread), rng.uniform(west, east, batch))
+        y = np.where(clustered, rng.normal(cy, spread), rng.uniform(south, north, batch))
+        inside = contains_xy(county, x, y)
+        lons.extend(x[inside])
+        lats.extend(y[inside])
+
+    facility_types = rng.choice(types, size=count, p=weights)
+    capacities = rng.integers(5, 400, size=count)
+    return np.array(lons[:count]), np.array(lats[:count]), facility_types, capacities
+
+
+def create_boundary_tables():
+    """Create the unmanaged Kenya boundary tables in a stand-in database"""
+    existing = set(connection.introspection.table_names())
+    with connection.schema_editor() as editor:
+        for model in (KenyaCounty, KenyaConstituency, KenyaWard):
+            if model._meta.db_table not in existing:
+                editor.create_model(model)
+
+
+def install(scale, media_root, seed=0):
+    """Populate the current database and media_root with fixtures for one scale.
+
+    Returns a summary dict describing what was generated.
+    """
+    params = SCALES[scale]
+    county = county_polygon(seed)
+
+    create_boundary_tables()
+    for model in (HealthCareFacility, KenyaWard, KenyaConstituency, KenyaCounty, PopulationDensity):
+        model.objects.all().delete()
+
+    KenyaCounty.objects.create(county=COUNTY_NAME, geom=GEOSGeometry(as_multipolygon(county).wkb, srid=4326))
+
+    constituencies = administrative_units(county, params['constituencies'])
+    KenyaConstituency.objects.bulk_create([
+        KenyaConstituency(
+            const_no=index + 1,
+            const_name=f'Constituency {index + 1}',
+            county_nam=COUNTY_NAME,
+            geom=GEOSGeometry(geom.wkb, srid=4326),
+        )
+        for index, geom in enumerate(constituencies)
+    ])
+
+    rng = np.random.default_rng(seed)
+    ward_columns, ward_rows = params['wards']
+    wards = administrative_units(county, ward_columns, ward_rows)
+    KenyaWard.objects.bulk_create([
+        KenyaWard(
+            ward=f'Ward {index + 1}',
+            subcounty=f'Constituency {index % params["constituencies"] + 1}',
+            county=COUNTY_NAME,
+            geom=GEOSGeometry(geom.wkb, srid=4326),
+            uid=f'W{index + 1:03d}',
+            pop2009=int(rng.integers(8000, 60000)),
+            pop2019=int(rng.integers(10000, 75000)),
+        )
+        for index, geom in enumerate(wards)
+    ])
+
+    lons, lats, facility_types, capacities = facility_points(params['facilities'], county, seed)
+    # bulk_create skips save(), which would link each facility to its category
+    categories = {category.name: category for category in FacilityCategory.objects.all()}
+    HealthCareFacility.objects.bulk_create([
+        HealthCareFacility(
+            name=f'Facility {index + 1}',
+            facility_type=str(facility_types[index]),
+            category=categories.get(str(facility_types[index])),
+            location=Point(float(lons[index]), float(lats[index]), srid=4326),
+            capacity=int(capacities[index]),
+        )
+        for index in range(len(lons))
+    ], batch_size=1000)
+
+    raster_name = f'population_density/synthetic_{scale}.tif'
+    raster_shape = write_density_raster(os.path.join(media_root, raster_name), params['resolution'], county, seed)
+    PopulationDensity.objects.create(
+        name=f'Synthetic density ({scale})',
+        description='Deterministic benchmark fixture',
+        year=2020,
+        raster_file=raster_name,
+        source='maps.benchmarks.fixtures',
+    )
+
+    # Per-process caches and layer artifacts of the previous fixtures
+    boundaries.clear()
+    for name in layers.LAYERS:
+        layers.build_artifact(name)
+
+    return {
+        'facilities': len(lons),
+        'wards': len(wards),
+        'constituencies': len(constituencies),
+        'raster_shape': list(raster_shape),
+        'county_vertices': len(county.exterior.coords),
+    }
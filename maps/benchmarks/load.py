@@ -0,0 +1,344 @@
+"""Replayable load test of a running server, modelled on the frontend's call patterns.
+
+Virtual users replay the sessions the pages' scripts produce, over their own
+keep-alive HTTP/1.1 connections (a raw asyncio client, so nothing but the
+server is measured):
+
+- map: the map page and its layers, then panning, each pan a population
+  density request with new bounds (population-density.js)
+- service-areas: merged service areas and site suitability, then one
+  population-density-for-area POST per underserved ward, up to
+  BROWSER_CONNECTIONS at a time (service-areas.js)
+- dashboard: the dashboard page, its layers and site suitability (dashboard.js)
+- suitability: site suitability for one facility type (site-suitability.js)
+
+Layers are revalidated with their ETag after the first load, as a browser
+does. Load ramps through stages of increasing concurrency; every request is
+recorded against the stage it started in, and each stage is summarised per
+endpoint: throughput, p50/p95/p99 latency, error rate and 503s (admission
+control) separately::
+
+    results = asyncio.run(load.run('http://127.0.0.1:8000', stages=[1, 4, 16], stage_seconds=30))
+
+The same seed replays the same sessions. ``python manage.py loadtest`` runs
+it, against a given server or against gunicorn serving synthetic fixtures.
+"""
+import asyncio
+import gzip
+import json
+import random
+import time
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+
+
+# (session, weight)
+SESSIONS = (('map', 0.45), ('service-areas', 0.25), ('dashboard', 0.15), ('suitability', 0.15))
+
+MAP_LAYERS = ('county', 'constituencies', 'wards', 'facilities')
+DASHBOARD_LAYERS = ('county', 'wards', 'facilities')
+FACILITY_TYPES = ('Health Centre', 'Medical Clinic', 'Sub-District Hospital', 'District Hospital')
+
+# Concurrent connections a browser opens to one host
+BROWSER_CONNECTIONS = 6
+# Wards checked per service-area session
+MAX_WARD_REQUESTS = 12
+PERCENTILES = (50, 95, 99)
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection"""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None, headers=None):
+        """(status, {lowercase header: value}, body) of one request"""
+        # A kept-alive connection the server has since closed fails on first use; retry it once fresh
+        reused = self.writer is not None
+        try:
+            return await self._request(method, path, body, headers)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            await self.close()
+            if not reused:
+                raise
+        return await self._request(method, path, body, headers)
+
+    async def _request(self, method, path, body, headers):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        headers = {'Host': f'{self.host}:{self.port}', 'Accept-Encoding': 'gzip, br', **(headers or {})}
+        lines = [f'{method} {path} HTTP/1.1'] + [f'{name}: {value}' for name, value in headers.items()]
+        if body is not None:
+            lines.append(f'Content-Length: {len(body)}')
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b''))
+        await self.writer.drain()
+
+        status_line = await self.reader.readuntil(b'\r\n')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while (line := await self.reader.readuntil(b'\r\n')) != b'\r\n':
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            content = b''
+        elif response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while size := int((await self.reader.readuntil(b'\r\n')).split(b';')[0], 16):
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readexactly(2)
+            # Trailers, up to the blank line
+            while await self.reader.readuntil(b'\r\n') != b'\r\n':
+                pass
+            content = b''.join(chunks)
+        elif 'content-length' in response_headers:
+            content = await self.reader.readexactly(int(response_headers['content-length']))
+        else:
+            content = await self.reader.read()
+            response_headers['connection'] = 'close'
+        if response_headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status, response_headers, content
+
+
+def decoded(headers, content):
+    """Response body without its gzip content encoding (brotli isn't requested where it's parsed)"""
+    return gzip.decompress(content) if headers.get('content-encoding') == 'gzip' else content
+
+
+class Recorder:
+    """Samples of every request: (stage, endpoint, status or None, seconds, bytes, error)"""
+
+    def __init__(self):
+        self.samples = []
+        self.stage = None
+
+    def record(self, endpoint, status, seconds, size, error=None):
+        self.samples.append((self.stage, endpoint, status, seconds, size, error))
+
+
+class Site:
+    """What the sessions need to know about the server's data: the county's extent and ward polygons"""
+
+    def __init__(self, extent, wards):
+        self.extent = extent  # (west, south, east, north)
+        self.wards = wards    # GeoJSON features
+
+    @classmethod
+    async def load(cls, host, port, timeout):
+        connection = Connection(host, port)
+        try:
+            status, headers, content = await asyncio.wait_for(
+                connection.request('GET', '/maps/api/layers/wards/', headers={'Accept-Encoding': 'gzip'}), timeout)
+        finally:
+            await connection.close()
+        if status != 200:
+            raise RuntimeError(f'Loading the ward layer failed with status {status}')
+        wards = json.loads(decoded(headers, content))['features']
+        coordinates = np.array([point for ward in wards for polygon in _polygons(ward['geometry'])
+                                for ring in polygon for point in ring])
+        if not len(coordinates):
+            raise RuntimeError('The ward layer is empty')
+        (west, south), (east, north) = coordinates.min(axis=0), coordinates.max(axis=0)
+        return cls((float(west), float(south), float(east), float(north)), wards)
+
+
+def _polygons(geometry):
+    return geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+
+
+class VirtualUser:
+    """A browser replaying sessions, with its own connections, ETag cache and random stream"""
+
+    def __init__(self, host, port, site, recorder, rng, think, timeout):
+        self.host, self.port = host, port
+        self.site = site
+        self.recorder = recorder
+        self.rng = rng
+        self.think_mean = think
+        self.timeout = timeout
+        self.connections = [Connection(host, port) for _ in range(BROWSER_CONNECTIONS)]
+        self.etags = {}
+
+    async def close(self):
+        for connection in self.connections:
+            await connection.close()
+
+    async def think(self):
+        if self.think_mean > 0:
+            await asyncio.sleep(self.rng.expovariate(1 / self.think_mean))
+
+    async def call(self, method, path, body=None, connection=None, headers=None):
+        """Issue and record one request; returns (status, headers, body), or None if it failed"""
+        connection = connection or self.connections[0]
+        endpoint = path.split('?', 1)[0]
+        headers = dict(headers or {})
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        started = time.perf_counter()
+        try:
+            status, response_headers, content = await asyncio.wait_for(
+                connection.request(method, path, body, headers), self.timeout)
+        except asyncio.TimeoutError:
+            await connection.close()
+            self.recorder.record(endpoint, None, time.perf_counter() - started, 0, 'timeout')
+            return None
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError) as e:
+            await connection.close()
+            self.recorder.record(endpoint, None, time.perf_counter() - started, 0, type(e).__name__)
+            return None
+        self.recorder.record(endpoint, status, time.perf_counter() - started, len(content))
+        return status, response_headers, content
+
+    async def fan_out(self, calls):
+        """Issue (method, path, body) calls over the browser's connections, as many at once as it has"""
+        queue = asyncio.Queue()
+        for call in calls:
+            queue.put_nowait(call)
+
+        async def drain(connection):
+            while not queue.empty():
+                method, path, body = queue.get_nowait()
+                await self.call(method, path, body, connection)
+
+        await asyncio.gather(*[drain(connection) for connection in self.connections[:len(calls)]])
+
+    async def layer(self, name, connection):
+        path = f'/maps/api/layers/{name}/'
+        headers = {'If-None-Match': self.etags[name]} if name in self.etags else {}
+        result = await self.call('GET', path, connection=connection, headers=headers)
+        if result and 'etag' in result[1]:
+            self.etags[name] = result[1]['etag']
+
+    async def layers(self, names):
+        await asyncio.gather(*[self.layer(name, connection) for name, connection in zip(names, self.connections)])
+
+    def bounds(self, centre, span):
+        """Map bounds (south,west,north,east) of a `span`-degree wide view around `centre`"""
+        x, y = centre
+        return f'{y - span / 2:.5f},{x - span / 2:.5f},{y + span / 2:.5f},{x + span / 2:.5f}'
+
+    async def browse_map(self):
+        await self.call('GET', '/maps/map/')
+        await self.layers(MAP_LAYERS)
+        west, south, east, north = self.site.extent
+        centre = ((west + east) / 2, (south + north) / 2)
+        span = max(east - west, north - south)
+        for _ in range(self.rng.randint(3, 8)):
+            await self.think()
+            # Pan by up to half the view, and sometimes zoom
+            span = min(max(span * self.rng.choice((0.5, 1, 1, 1, 2)), 0.02), 1.0)
+            centre = (min(max(centre[0] + self.rng.uniform(-0.5, 0.5) * span, west), east),
+                      min(max(centre[1] + self.rng.uniform(-0.5, 0.5) * span, south), north))
+            query = urlencode({'bounds': self.bounds(centre, span)})
+            await self.call('GET', f'/maps/api/population-density/?{query}')
+
+    async def analyse_service_areas(self):
+        await self.call('GET', '/maps/api/merged-service-areas/')
+        await self.think()
+        await self.call('GET', '/maps/api/site-suitability-analysis/')
+        await self.think()
+        wards = self.rng.sample(self.site.wards, min(len(self.site.wards), self.rng.randint(1, MAX_WARD_REQUESTS)))
+        await self.fan_out([('POST', '/maps/api/population-density-for-area/', {'area': ward}) for ward in wards])
+
+    async def open_dashboard(self):
+        await self.call('GET', '/maps/dashboard/')
+        await self.layers(DASHBOARD_LAYERS)
+        await self.think()
+        await self.call('GET', '/maps/api/site-suitability-analysis/')
+
+    async def run_suitability(self):
+        query = urlencode({'facility_type': self.rng.choice(FACILITY_TYPES)})
+        await self.call('GET', f'/maps/api/site-suitability-analysis/?{query}')
+
+    async def session(self):
+        names, weights = zip(*SESSIONS)
+        name = self.rng.choices(names, weights)[0]
+        await {
+            'map': self.browse_map,
+            'service-areas': self.analyse_service_areas,
+            'dashboard': self.open_dashboard,
+            'suitability': self.run_suitability,
+        }[name]()
+        await self.think()
+
+    async def run_until(self, deadline):
+        try:
+            while time.monotonic() < deadline:
+                await self.session()
+        finally:
+            await self.close()
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else None
+
+
+def summarise(samples, seconds):
+    """Per-endpoint (and 'all') statistics of one stage's samples"""
+    by_endpoint = {}
+    for _, endpoint, status, elapsed, size, error in samples:
+        by_endpoint.setdefault(endpoint, []).append((status, elapsed, size, error))
+    by_endpoint['all'] = [(status, elapsed, size, error) for _, _, status, elapsed, size, error in samples]
+
+    summary = {}
+    for endpoint, rows in sorted(by_endpoint.items()):
+        ok = [elapsed for status, elapsed, _, _ in rows if status is not None and status < 400]
+        errors = sum(1 for status, _, _, _ in rows if status is None or (status >= 400 and status != 503))
+        rejected = sum(1 for status, _, _, _ in rows if status == 503)
+        summary[endpoint] = {
+            'requests': len(rows),
+            'throughput': len(rows) / seconds if seconds else 0.0,
+            'errors': errors,
+            'rejected': rejected,
+            'error_rate': (errors + rejected) / len(rows) if rows else 0.0,
+            'latency': {f'p{q}': percentile(ok, q) for q in PERCENTILES},
+            'mean_bytes': sum(size for _, _, size, _ in rows) / len(rows) if rows else 0,
+            'failures': sorted({error for _, _, _, error in rows if error}),
+        }
+    return summary
+
+
+async def run(url, stages, stage_seconds=30.0, think=1.0, seed=0, timeout=120.0, on_stage=None):
+    """Ramp through `stages` (concurrent virtual users), `stage_seconds` each; returns the results"""
+    parts = urlsplit(url)
+    if parts.scheme != 'http':
+        raise ValueError('Only http:// servers can be load tested')
+    host, port = parts.hostname, parts.port or 80
+    site = await Site.load(host, port, timeout)
+    recorder = Recorder()
+
+    results = []
+    for index, users in enumerate(stages):
+        recorder.stage = index
+        started = time.monotonic()
+        deadline = started + stage_seconds
+        # A separate, seeded random stream per stage and user makes a run replayable
+        virtual_users = [VirtualUser(host, port, site, recorder, random.Random(f'{seed}:{index}:{user}'), think,
+                                     timeout)
+                         for user in range(users)]
+        await asyncio.gather(*[virtual_user.run_until(deadline) for virtual_user in virtual_users])
+        # Sessions finish the request in flight at the deadline, so the stage runs a little over
+        elapsed = time.monotonic() - started
+        stage = {
+            'users': users,
+            'seconds': elapsed,
+            'endpoints': summarise([sample for sample in recorder.samples if sample[0] == index], elapsed),
+        }
+        results.append(stage)
+        if on_stage:
+            on_stage(stage)
+    return {'url': url, 'seed': seed, 'think': think, 'stage_seconds': stage_seconds, 'stages': results}
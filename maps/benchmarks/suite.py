@@ -0,0 +1,119 @@
+"""Benchmark cases, measurement and baseline comparison"""
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+
+# A small polygon around Kisumu city, as drawn with the map tools
+SAMPLE_AREA = {
+    'type': 'Feature',
+    'geometry': {
+        'type': 'Polygon',
+        'coordinates': [[[34.70, -0.05], [34.82, -0.05], [34.82, -0.15], [34.70, -0.15], [34.70, -0.05]]],
+    },
+}
+
+# (name, method, path, JSON body)
+CASES = [
+    ('population_density', 'get', '/maps/api/population-density/', None),
+    ('population_density_bounds', 'get', '/maps/api/population-density/?bounds=-0.2,34.65,0.0,34.9', None),
+    ('population_density_for_area', 'post', '/maps/api/population-density-for-area/', {'area': SAMPLE_AREA}),
+    ('site_suitability_analysis', 'get', '/maps/api/site-suitability-analysis/?facility_type=Health%20Centre', None),
+    ('merged_service_areas', 'get', '/maps/api/merged-service-areas/', None),
+    ('healthcare_dashboard', 'get', '/maps/dashboard/', None),
+]
+
+
+def measure(client, method, path, body=None):
+    """Issue one request and return wall time, peak traced memory and query count"""
+    kwargs = {}
+    if body is not None:
+        kwargs = {'data': json.dumps(body), 'content_type': 'application/json'}
+
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(client, method)(path, **kwargs)
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+            elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'status': response.status_code,
+        'wall_time': elapsed,
+        'peak_memory': peak,
+        'queries': len(queries.captured_queries),
+        'response_bytes': len(content),
+    }
+
+
+def run_case(name, method, path, body=None, repeat=3):
+    """Run one case `repeat` times and summarise the samples"""
+    client = Client()
+    samples = [measure(client, method, path, body) for _ in range(repeat)]
+    wall_times = [sample['wall_time'] for sample in samples]
+
+    return {
+        'name': name,
+        'path': path,
+        'status': samples[-1]['status'],
+        'repeat': repeat,
+        'wall_time': {
+            'min': min(wall_times),
+            'median': statistics.median(wall_times),
+            'max': max(wall_times),
+        },
+        'peak_memory': max(sample['peak_memory'] for sample in samples),
+        'queries': samples[-1]['queries'],
+        'response_bytes': samples[-1]['response_bytes'],
+    }
+
+
+def environment():
+    """Describe the machine the numbers were recorded on"""
+    import numpy
+    import shapely
+    import rasterio
+
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'database': connection.vendor,
+        'numpy': numpy.__version__,
+        'shapely': shapely.__version__,
+        'rasterio': rasterio.__version__,
+    }
+
+
+def compare(results, baseline, tolerance=0.25):
+    """Return a list of human-readable regressions of `results` against `baseline`.
+
+    Wall time and peak memory may grow by `tolerance` (a fraction) before they
+    count as a regression; any increase in query count is reported.
+    """
+    regressions = []
+    for scale, cases in results['scales'].items():
+        previous = {case['name']: case for case in baseline.get('scales', {}).get(scale, {}).get('cases', [])}
+        for case in cases['cases']:
+            before = previous.get(case['name'])
+            if not before or before['status'] != case['status']:
+                continue
+
+            label = f'{scale}/{case["name"]}'
+            old_time, new_time = before['wall_time']['median'], case['wall_time']['median']
+            if new_time > old_time * (1 + tolerance):
+                regressions.append(f'{label}: median wall time {old_time:.3f}s -> {new_time:.3f}s')
+            if case['peak_memory'] > before['peak_memory'] * (1 + tolerance):
+                regressions.append(f'{label}: peak memory {before["peak_memory"]} -> {case["peak_memory"]} bytes')
+            if case['queries'] > before['queries']:
+                regressions.append(f'{label}: queries {before["queries"]} -> {case["queries"]}')
+    return regressions
@@ -0,0 +1,49 @@
+"""Administrative boundaries as shapely geometries, cached per process.
+
+A county outline (thousands of vertices) is fetched and converted once per
+process rather than on every request, and reloaded after MAPS_BOUNDARY_TTL
+seconds, so every gunicorn worker picks up edited boundaries within that time
+(the process that saved the edit drops its copy at once through ``clear()``).
+In gunicorn's preload mode the outline is loaded in the master before the
+workers fork, and they all share it until it expires.
+
+The cached geometries are shared between threads: treat them as read-only.
+"""
+import logging
+import time
+
+from django.conf import settings
+
+from . import geometry
+from .metrics import record_cache
+from .models import KenyaCounty
+
+
+logger = logging.getLogger(__name__)
+
+# {upper-case county name: (shapely geometry, monotonic time loaded)}
+_counties = {}
+
+
+def county(name='KISUMU'):
+    """Boundary of county `name` as a shapely geometry, or None if it can't be loaded"""
+    key = name.upper()
+    boundary, loaded_at = _counties.get(key, (None, 0.0))
+    ttl = getattr(settings, 'MAPS_BOUNDARY_TTL', 60.0)
+    if boundary is not None and time.monotonic() - loaded_at >= ttl:
+        boundary = None
+    record_cache('boundaries', boundary is not None)
+    if boundary is None:
+        try:
+            record = KenyaCounty.objects.get(county__iexact=name)
+        except Exception as e:
+            logger.warning("Error getting %s boundary: %s", name, e)
+            return None
+        boundary = geometry.to_shapely(record.geom)
+        _counties[key] = (boundary, time.monotonic())
+    return boundary
+
+
+def clear():
+    """Forget the cached boundaries (called by ``artifacts.inputs_changed`` when a boundary is saved or deleted)"""
+    _counties.clear()
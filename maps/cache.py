@@ -0,0 +1,86 @@
+"""Derived arrays cached next to the population raster, and in memory per process.
+
+Coverage layers, footprints, hexbins, density and distance surfaces are each
+saved as one ``.npz`` file next to the raster, named by their kind, name and
+version (a hash of everything they were built from). A process keeps the
+value it last loaded for each kind, name and raster, and serves it until the
+version changes::
+
+    surfaces = cache.get_cached('kde', 'facilities', raster_path, version,
+                                lambda path: Surfaces.load(path, version),
+                                lambda: build(raster_path, facilities, version))
+
+A lock per kind, name and raster makes concurrent cold requests of a worker
+wait for the one loading or building the value instead of each building and
+writing the same file. Files of older versions are removed once the new one
+is written: nothing reads them again.
+"""
+import glob
+import logging
+import os
+import threading
+
+from .metrics import record_cache
+
+
+logger = logging.getLogger(__name__)
+
+# Values loaded in this process: {(kind, name, raster path): (cache path, value)}
+_loaded = {}
+# {(kind, name, raster path): lock held while loading or building the value}
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def path(raster_path, kind, name, version):
+    """File of version `version` of the cached `kind` `name` of the raster"""
+    return f'{raster_path}.{kind}-{name}-{version}.npz'
+
+
+def _lock(key):
+    with _locks_lock:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def get_cached(kind, name, raster_path, version, load, build):
+    """The value of `version`, from this process, from its file (`load(path)`) or freshly built (`build()`)
+
+    A freshly built value is saved with its ``save(path)`` method.
+    """
+    key = (kind, name, raster_path)
+    file_path = path(raster_path, kind, name, version)
+    cached_path, value = _loaded.get(key, (None, None))
+    if cached_path == file_path:
+        record_cache(kind, True)
+        return value
+
+    with _lock(key):
+        cached_path, value = _loaded.get(key, (None, None))
+        if cached_path == file_path:
+            record_cache(kind, True)
+            return value
+        value = None
+        if os.path.exists(file_path):
+            try:
+                value = load(file_path)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("Discarding unreadable %s cache %s: %s", kind, file_path, e)
+        record_cache(kind, value is not None)
+
+        if value is None:
+            logger.debug("Building %s %s", kind, file_path)
+            value = build()
+            try:
+                value.save(file_path)
+                for stale in glob.glob(path(glob.escape(raster_path), kind, name, '*')):
+                    if stale != file_path:
+                        try:
+                            os.remove(stale)
+                        except FileNotFoundError:
+                            # Another worker removed it first
+                            pass
+            except OSError as e:
+                logger.warning("Could not cache %s at %s: %s", kind, file_path, e)
+
+        _loaded[key] = (file_path, value)
+    return value
@@ -0,0 +1,92 @@
+"""Facility category policy: service radius, expected population and spacing by facility type.
+
+The policy lives in the FacilityCategory table and is loaded once per process
+(reloaded after MAPS_CATEGORY_POLICY_TTL seconds, or at once when a category
+is saved in this process)::
+
+    policy = categories.policy()
+    policy.radius_km('Health Centre')          # 3.0
+    policy.radii_km(facilities)                # one radius per facility
+    policy.version                             # changes with any policy field
+
+Types without a category get the DEFAULT_* values and count as served, as
+types missing from the old hard-coded tables did. Coverage caches are keyed
+by the radii they were built with, and the artifact graph by ``version``, so
+a policy change rebuilds exactly what depends on it.
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+
+from .models import FacilityCategory, normalize_facility_type
+
+
+DEFAULT_RADIUS_KM = 5.0
+DEFAULT_EXPECTED_POPULATION = 30000
+DEFAULT_MIN_SPACING_KM = 7.0
+
+_loaded = (None, 0.0)
+_lock = threading.Lock()
+
+
+class Policy:
+    """The categories by name, with lookups that fall back to the defaults"""
+
+    def __init__(self, categories):
+        self.categories = {category.name: category for category in categories}
+        digest = hashlib.sha1()
+        for category in sorted(categories, key=lambda category: category.name):
+            digest.update(f'{category.name}:{category.is_served_type}:{category.service_radius_km}:'
+                          f'{category.expected_population}:{category.min_spacing_km}\n'.encode())
+        self.version = digest.hexdigest()[:16]
+
+    def category(self, facility_type):
+        return self.categories.get(normalize_facility_type(facility_type))
+
+    def radius_km(self, facility_type):
+        category = self.category(facility_type)
+        return category.service_radius_km if category else DEFAULT_RADIUS_KM
+
+    def radii_km(self, facilities):
+        """Service radius of each facility, in km"""
+        return [self.radius_km(facility.facility_type) for facility in facilities]
+
+    def expected_population(self, facility_type):
+        category = self.category(facility_type)
+        return category.expected_population if category else DEFAULT_EXPECTED_POPULATION
+
+    def min_spacing_km(self, facility_type):
+        category = self.category(facility_type)
+        return category.min_spacing_km if category else DEFAULT_MIN_SPACING_KM
+
+    def served_radii_km(self):
+        """{facility type: service radius} of the served categories"""
+        return {name: category.service_radius_km for name, category in self.categories.items()
+                if category.is_served_type}
+
+    def excluded_types(self):
+        """Names of the categories left out of coverage analyses"""
+        return sorted(name for name, category in self.categories.items() if not category.is_served_type)
+
+
+def policy():
+    """The current policy, loaded from the database at most every MAPS_CATEGORY_POLICY_TTL seconds"""
+    global _loaded
+    current, loaded_at = _loaded
+    ttl = getattr(settings, 'MAPS_CATEGORY_POLICY_TTL', 60.0)
+    if current is not None and time.monotonic() - loaded_at < ttl:
+        return current
+    with _lock:
+        current, loaded_at = _loaded
+        if current is None or time.monotonic() - loaded_at >= ttl:
+            current = Policy(list(FacilityCategory.objects.all()))
+            _loaded = (current, time.monotonic())
+    return current
+
+
+def clear(**kwargs):
+    """Forget the loaded policy (called by ``artifacts.inputs_changed`` when a category is saved or deleted)"""
+    global _loaded
+    _loaded = (None, 0.0)
@@ -0,0 +1,312 @@
+"""Raster coverage layer over the population grid.
+
+Each facility's service area is burned into the population raster once,
+giving per pixel:
+
+- ``depth``: how many facilities reach the pixel
+- ``nearest``: index of the closest facility (-1 outside the county)
+- ``ward_ids``: 1-based position of the ward containing the pixel (0 for none)
+
+Served, underserved and redundant population, per county and per ward, are
+then plain numpy reductions over those arrays. A layer is saved next to the
+raster under a version hash of the facilities, their radii, the wards' and
+the county's geometry and the raster file, so a request only rebuilds it
+after one of those changes. Each
+analysis with its own radii keeps its layer under its own name.
+
+For what-if scenarios each facility's footprint is also kept as a packed
+bitset (``np.packbits``) over the rows of the grid it touches. Coverage with
+facilities added or removed is then the OR of the kept footprints, and the
+change in served population a weighted sum over the pixels that flipped.
+"""
+import hashlib
+import os
+
+import numpy as np
+from affine import Affine
+
+from . import cache, geometry
+from . import population as population_grid
+
+# Pixels reached by this many facilities or more count as redundant coverage
+REDUNDANT_DEPTH = 3
+
+
+def facility_version(facilities, radii_km):
+    """Hash of the facilities' ids, locations and service radii"""
+    digest = hashlib.sha1()
+    for facility, radius in zip(facilities, radii_km):
+        x, y = facility.location.coords
+        digest.update(f'{facility.pk}:{x:.7f}:{y:.7f}:{float(radius)}\n'.encode())
+    return digest.hexdigest()[:16]
+
+
+def area_version(wards, boundary):
+    """Hash of the wards' ids and geometries and of the county boundary"""
+    digest = hashlib.sha1()
+    for ward in wards:
+        digest.update(f'{ward.pk}:'.encode())
+        digest.update(bytes(ward.geom.wkb))
+    if boundary is not None:
+        digest.update(boundary.wkb)
+    return digest.hexdigest()[:16]
+
+
+def layer_version(raster_path, facilities, radii_km, wards, boundary=None):
+    """Cache key of the layer for this raster, facility set, wards and county boundary"""
+    stat = os.stat(raster_path)
+    digest = hashlib.sha1()
+    digest.update(facility_version(facilities, radii_km).encode())
+    digest.update(area_version(wards, boundary).encode())
+    digest.update(f'{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    return digest.hexdigest()[:16]
+
+
+class CoverageLayer:
+    """Per-pixel coverage depth, nearest facility and ward over the population grid"""
+
+    def __init__(self, depth, nearest, ward_ids, inside, population, row_area_km2, facility_ids):
+        self.depth = depth
+        self.nearest = nearest
+        self.ward_ids = ward_ids
+        self.inside = inside
+        self.population = population
+        self.row_area_km2 = row_area_km2
+        self.facility_ids = facility_ids
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(**{name: arrays[name] for name in arrays.files})
+
+    def save(self, path):
+        # Write under a temporary name so concurrent readers never see a partial file
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.savez(
+                file, depth=self.depth, nearest=self.nearest, ward_ids=self.ward_ids, inside=self.inside,
+                population=self.population, row_area_km2=self.row_area_km2, facility_ids=self.facility_ids,
+            )
+        os.replace(tmp_path, path)
+
+    @property
+    def pixel_area_km2(self):
+        return np.broadcast_to(self.row_area_km2[:, None], self.depth.shape)
+
+    def summary(self, ward_count):
+        """County totals and per-ward arrays (index i is the i-th ward) of area and population"""
+        area = np.where(self.inside, self.pixel_area_km2, 0)
+        population = np.where(self.inside, self.population, 0)
+        covered = self.depth > 0
+        redundant = self.depth >= REDUNDANT_DEPTH
+
+        ward_ids = self.ward_ids.ravel()
+
+        def per_ward(weights):
+            return np.bincount(ward_ids, weights=weights.ravel(), minlength=ward_count + 1)[1:ward_count + 1]
+
+        return {
+            'total_area_km2': float(area.sum()),
+            'covered_area_km2': float(area[covered].sum()),
+            'redundant_area_km2': float(area[redundant].sum()),
+            'population': float(population.sum()),
+            'served_population': float(population[covered].sum()),
+            'redundant_population': float(population[redundant].sum()),
+            'ward_area_km2': per_ward(area),
+            'ward_covered_km2': per_ward(np.where(covered, area, 0)),
+            'ward_population': per_ward(population),
+            'ward_served_population': per_ward(np.where(covered, population, 0)),
+            'ward_redundant_population': per_ward(np.where(redundant, population, 0)),
+        }
+
+
+def burn_wards(wards, shape, transform):
+    """1-based position of the ward containing each pixel of the grid (0 for none)"""
+    from rasterio import features
+
+    ward_geometries = geometry.from_django(ward.geom for ward in wards)
+    return features.rasterize(
+        ((ward_geom, i + 1) for i, ward_geom in enumerate(ward_geometries)), out_shape=shape,
+        transform=transform, fill=0, dtype='int32',
+    ) if len(ward_geometries) else np.zeros(shape, dtype='int32')
+
+
+def build(raster_path, facilities, radii_km, wards, boundary):
+    """Burn the facilities' service areas, the wards and the county into the population grid"""
+    from rasterio import features
+    from rasterio.enums import MergeAlg
+    from scipy.spatial import cKDTree
+
+    # Persons per pixel and pixel area per row, derived once per raster
+    grid = population_grid.get(raster_path)
+    transform = grid.transform
+    shape = grid.shape
+    row_area_km2 = np.asarray(grid.row_area_km2)
+    population = np.array(grid.counts)
+
+    inside = features.geometry_mask([boundary], shape, transform, invert=True)
+
+    lons, lats = geometry.coordinates(facilities)
+    buffers = geometry.metric_buffers(lons, lats, radii_km)
+    depth = features.rasterize(
+        ((buffer, 1) for buffer in buffers), out_shape=shape, transform=transform,
+        fill=0, merge_alg=MergeAlg.add, dtype='uint16',
+    ) if len(buffers) else np.zeros(shape, dtype='uint16')
+
+    ward_ids = burn_wards(wards, shape, transform)
+
+    # Nearest facility to each pixel centre inside the county, measured in UTM metres
+    nearest = np.full(shape, -1, dtype='int32')
+    if len(facilities):
+        rows, cols = np.nonzero(inside)
+        pixel_lons = transform.c + (cols + 0.5) * transform.a
+        pixel_lats = transform.f + (rows + 0.5) * transform.e
+        tree = cKDTree(np.column_stack(geometry.utm_coordinates(lons, lats)))
+        _, index = tree.query(np.column_stack(geometry.utm_coordinates(pixel_lons, pixel_lats)))
+        nearest[rows, cols] = index
+
+    facility_ids = np.array([facility.pk for facility in facilities], dtype='int64')
+    return CoverageLayer(depth, nearest, ward_ids, inside, population, row_area_km2, facility_ids)
+
+
+class Footprints:
+    """Packed per-facility coverage bitsets over the rows of the grid each facility reaches"""
+
+    def __init__(self, row_start, row_stop, offsets, bits, grid, facility_ids):
+        self.row_start = row_start
+        self.row_stop = row_stop
+        self.offsets = offsets
+        self.bits = bits
+        # Affine coefficients of the grid followed by its height and width
+        self.grid = grid
+        self.facility_ids = facility_ids
+
+    @property
+    def transform(self):
+        return Affine(*self.grid[:6])
+
+    @property
+    def shape(self):
+        return int(self.grid[6]), int(self.grid[7])
+
+    @property
+    def row_bytes(self):
+        return (self.shape[1] + 7) // 8
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(**{name: arrays[name] for name in arrays.files})
+
+    def save(self, path):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.savez(
+                file, row_start=self.row_start, row_stop=self.row_stop, offsets=self.offsets, bits=self.bits,
+                grid=self.grid, facility_ids=self.facility_ids,
+            )
+        os.replace(tmp_path, path)
+
+    def footprint(self, i):
+        """Packed rows of facility i, as (first row, array of shape (rows, row_bytes))"""
+        rows = self.row_stop[i] - self.row_start[i]
+        return self.row_start[i], self.bits[self.offsets[i]:self.offsets[i + 1]].reshape(rows, self.row_bytes)
+
+    def pack(self, geometries):
+        """Footprints of service areas that are not in the set, e.g. proposed facilities"""
+        return [pack_footprint(geom, self.transform, self.shape) for geom in geometries]
+
+    def union(self, indices, extra=()):
+        """Packed coverage of the facilities at `indices` plus extra (first row, packed rows) footprints"""
+        covered = np.zeros((self.shape[0], self.row_bytes), dtype=np.uint8)
+        for i in indices:
+            start, packed = self.footprint(i)
+            covered[start:start + len(packed)] |= packed
+        for start, packed in extra:
+            covered[start:start + len(packed)] |= packed
+        return covered
+
+
+def pack_footprint(geom, transform, shape):
+    """Rasterize one service area and pack the grid rows it touches"""
+    from rasterio import features
+
+    minx, miny, maxx, maxy = geom.bounds
+    row_start = max(int(np.floor((maxy - transform.f) / transform.e)), 0)
+    row_stop = min(int(np.ceil((miny - transform.f) / transform.e)), shape[0])
+    col_start = max(int(np.floor((minx - transform.c) / transform.a)), 0)
+    col_stop = min(int(np.ceil((maxx - transform.c) / transform.a)), shape[1])
+    rows = np.zeros((max(row_stop - row_start, 0), shape[1]), dtype=bool)
+    if row_stop > row_start and col_stop > col_start:
+        rows[:, col_start:col_stop] = features.rasterize(
+            [(geom, 1)], out_shape=(row_stop - row_start, col_stop - col_start),
+            transform=transform * Affine.translation(col_start, row_start), fill=0, dtype='uint8',
+        ).astype(bool)
+    return row_start, np.packbits(rows, axis=1)
+
+
+def build_footprints(raster_path, facilities, radii_km):
+    """Packed footprint of every facility's service area over the population grid"""
+    import rasterio
+
+    with rasterio.open(raster_path) as src:
+        transform, shape = src.transform, src.shape
+
+    lons, lats = geometry.coordinates(facilities)
+    buffers = geometry.metric_buffers(lons, lats, radii_km)
+    row_start = np.zeros(len(facilities), dtype='int32')
+    row_stop = np.zeros(len(facilities), dtype='int32')
+    chunks = []
+    for i, buffer in enumerate(buffers):
+        start, packed = pack_footprint(buffer, transform, shape)
+        row_start[i], row_stop[i] = start, start + len(packed)
+        chunks.append(packed.ravel())
+    offsets = np.concatenate([[0], np.cumsum([len(chunk) for chunk in chunks], dtype='int64')])
+    bits = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.uint8)
+    facility_ids = np.array([facility.pk for facility in facilities], dtype='int64')
+    grid = np.array(list(transform)[:6] + list(shape), dtype=float)
+    return Footprints(row_start, row_stop, offsets, bits, grid, facility_ids)
+
+
+def scenario_change(layer, footprints, keep, added, ward_count):
+    """Population and area gained and lost, in total and per ward (index i is the i-th ward),
+    when only the facilities at `keep` remain and the packed `added` footprints are built"""
+    width = layer.depth.shape[1]
+    before = np.packbits(layer.depth > 0, axis=1)
+    if len(keep) == len(footprints.facility_ids):
+        after = footprints.union([], extra=[(0, before)] + list(added))
+    else:
+        after = footprints.union(keep, extra=added)
+
+    gained = np.unpackbits(after & ~before, axis=1, count=width).view(bool) & layer.inside
+    lost = np.unpackbits(before & ~after, axis=1, count=width).view(bool) & layer.inside
+    area = layer.pixel_area_km2
+
+    def totals(mask):
+        ward_ids = layer.ward_ids[mask]
+        population = layer.population[mask].astype(float)
+        pixel_area = area[mask]
+        return {
+            'population': float(population.sum()),
+            'area_km2': float(pixel_area.sum()),
+            'ward_population': np.bincount(ward_ids, weights=population, minlength=ward_count + 1)[1:ward_count + 1],
+            'ward_area_km2': np.bincount(ward_ids, weights=pixel_area, minlength=ward_count + 1)[1:ward_count + 1],
+        }
+
+    return {'gained': totals(gained), 'lost': totals(lost), 'gained_mask': gained}
+
+
+def get_layer(name, raster_path, facilities, radii_km, wards, boundary):
+    """Coverage layer `name` for these facilities and radii, from cache or freshly built"""
+    radii_km = np.broadcast_to(np.asarray(radii_km, dtype=float), (len(facilities),))
+    version = layer_version(raster_path, facilities, radii_km, wards, boundary)
+    return cache.get_cached('coverage', name, raster_path, version, CoverageLayer.load,
+                            lambda: build(raster_path, facilities, radii_km, wards, boundary))
+
+
+def get_footprints(name, raster_path, facilities, radii_km):
+    """Packed footprints `name` for these facilities and radii, from cache or freshly built"""
+    radii_km = np.broadcast_to(np.asarray(radii_km, dtype=float), (len(facilities),))
+    version = layer_version(raster_path, facilities, radii_km, [])
+    return cache.get_cached('footprints', name, raster_path, version, Footprints.load,
+                            lambda: build_footprints(raster_path, facilities, radii_km))
@@ -0,0 +1,223 @@
+"""Multi-year population cube: every dataset resampled to one grid.
+
+The population datasets of different years can come on different grids, so
+comparing them pixel by pixel would mean opening and resampling one GeoTIFF
+per year on every request. Instead they are resampled once onto the grid of
+the most recent dataset (density averaged over the target pixel) and
+converted to persons per pixel. The result is stored as a ``(year, row, col)``
+float32 array under MAPS_ARTIFACT_ROOT and memory-mapped::
+
+    population_cube = cube.get()
+    population_cube.difference(2015, 2020)   # persons per pixel gained
+    population_cube.growth(2015, 2020)       # annual growth rate per pixel
+    population_cube.trend()                  # least-squares persons per year
+    population_cube.ward_series(wards)       # population of each ward, by year
+
+Each of these is a vectorized slice or reduction over the cube. The cube is
+rebuilt when a dataset is added, removed or its raster file changes.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+from affine import Affine
+from django.conf import settings
+
+from . import geometry, population
+from .metrics import record_cache
+from .models import PopulationDensity
+
+
+logger = logging.getLogger(__name__)
+
+# The cube loaded in this process: (version, cube)
+_loaded = (None, None)
+_lock = threading.Lock()
+# Ward rasters on the cube grid: {(cube version, ward pks): ward ids array}
+_ward_ids = {}
+
+
+def datasets():
+    """The datasets of the cube, one per year (the most recently added of a year), in year order"""
+    by_year = {}
+    for dataset in PopulationDensity.objects.order_by('year', 'pk'):
+        by_year[dataset.year] = dataset
+    return [by_year[year] for year in sorted(by_year)]
+
+
+def version(selected):
+    """Cache key of the cube of these datasets and their raster files"""
+    digest = hashlib.sha1()
+    for dataset in selected:
+        stat = os.stat(dataset.raster_file.path)
+        digest.update(f'{dataset.pk}:{dataset.year}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+    return digest.hexdigest()[:16]
+
+
+def cube_dir():
+    return os.path.join(settings.MAPS_ARTIFACT_ROOT, 'cube')
+
+
+def cache_paths(version):
+    """(counts array, metadata) files of the cube"""
+    return os.path.join(cube_dir(), f'population-{version}.npy'), os.path.join(cube_dir(), f'population-{version}.json')
+
+
+class PopulationCube:
+    """Persons per pixel of every year on one grid, with the pixel area of each row"""
+
+    def __init__(self, counts, years, dataset_ids, row_area_km2, transform, version):
+        self.counts = counts
+        self.years = np.asarray(years)
+        self.dataset_ids = list(dataset_ids)
+        self.row_area_km2 = row_area_km2
+        self.transform = transform
+        self.version = version
+
+    @property
+    def shape(self):
+        return self.counts.shape[1:]
+
+    def index(self, year):
+        """Position of `year` in the cube; raises KeyError if there's no dataset of that year"""
+        matches = np.flatnonzero(self.years == int(year))
+        if not len(matches):
+            raise KeyError(f'No population dataset for {year}')
+        return int(matches[0])
+
+    def difference(self, start, end):
+        """Persons per pixel gained from year `start` to `end` (negative where lost)"""
+        return self.counts[self.index(end)].astype('float64') - self.counts[self.index(start)]
+
+    def growth(self, start, end):
+        """Compound annual growth rate per pixel from `start` to `end` (NaN where either is empty)"""
+        before = self.counts[self.index(start)].astype('float64')
+        after = self.counts[self.index(end)].astype('float64')
+        years = int(end) - int(start)
+        rate = np.full(before.shape, np.nan)
+        populated = (before > 0) & (after > 0)
+        if years:
+            rate[populated] = (after[populated] / before[populated]) ** (1.0 / years) - 1
+        return rate
+
+    def trend(self):
+        """Least-squares slope of every pixel's population over the years, in persons per year"""
+        if len(self.years) < 2:
+            return np.zeros(self.shape)
+        t = self.years.astype('float64') - self.years.mean()
+        # Sum over the years of t * (y - mean y); the mean drops out since t sums to zero
+        return np.tensordot(t, self.counts, axes=(0, 0)) / (t ** 2).sum()
+
+    def ward_ids(self, wards):
+        """1-based position of the ward containing each pixel (0 for none), rasterized once per ward set"""
+        from rasterio import features
+
+        key = (self.version, tuple(ward.pk for ward in wards))
+        ids = _ward_ids.get(key)
+        record_cache('cube_wards', ids is not None)
+        if ids is None:
+            ward_geometries = geometry.from_django(ward.geom for ward in wards)
+            ids = features.rasterize(
+                ((ward_geom, i + 1) for i, ward_geom in enumerate(ward_geometries)), out_shape=self.shape,
+                transform=self.transform, fill=0, dtype='int32',
+            ) if len(ward_geometries) else np.zeros(self.shape, dtype='int32')
+            _ward_ids.clear()
+            _ward_ids[key] = ids
+        return ids
+
+    def ward_series(self, wards):
+        """Gridded population of each ward in each year, as a (ward, year) array"""
+        ids = self.ward_ids(wards).ravel()
+        ward_count = len(wards) + 1
+        # One bincount over (year, ward) pairs instead of one per year
+        pairs = (np.arange(len(self.years))[:, None] * ward_count + ids[None, :]).ravel()
+        totals = np.bincount(pairs, weights=self.counts.reshape(len(self.years), -1).ravel(),
+                             minlength=len(self.years) * ward_count)
+        return totals.reshape(len(self.years), ward_count)[:, 1:].T
+
+    @classmethod
+    def load(cls, version):
+        counts_path, meta_path = cache_paths(version)
+        with open(meta_path) as file:
+            meta = json.load(file)
+        return cls(np.load(counts_path, mmap_mode='r'), meta['years'], meta['dataset_ids'],
+                   np.asarray(meta['row_area_km2']), Affine(*meta['transform']), version)
+
+
+def build(selected, version):
+    """Resample the datasets onto the grid of the most recent one and save the cube"""
+    import rasterio
+    from rasterio.warp import Resampling, reproject
+
+    reference = population.get(selected[-1].raster_file.path)
+    height, width = reference.shape
+    os.makedirs(cube_dir(), exist_ok=True)
+    counts_path, meta_path = cache_paths(version)
+    tmp_path = f'{counts_path}.{os.getpid()}.tmp.npy'
+    counts = np.lib.format.open_memmap(tmp_path, mode='w+', dtype='float32', shape=(len(selected), height, width))
+
+    for i, dataset in enumerate(selected):
+        grid = population.get(dataset.raster_file.path)
+        if grid.shape == reference.shape and grid.transform.almost_equals(reference.transform):
+            counts[i] = grid.counts
+            continue
+        logger.debug("Resampling %s onto the cube grid", dataset)
+        with rasterio.open(dataset.raster_file.path) as src:
+            density = np.zeros((height, width), dtype='float32')
+            reproject(
+                source=np.asarray(grid.density(), dtype='float32'), destination=density,
+                src_transform=grid.transform, src_crs=src.crs, dst_transform=reference.transform, dst_crs=src.crs,
+                dst_nodata=0, resampling=Resampling.average,
+            )
+        counts[i] = density * reference.row_area_km2[:, None]
+
+    counts.flush()
+    del counts
+    meta = {
+        'years': [dataset.year for dataset in selected],
+        'dataset_ids': [dataset.pk for dataset in selected],
+        'row_area_km2': reference.row_area_km2.tolist(),
+        'transform': list(reference.transform)[:6],
+    }
+    with open(f'{meta_path}.{os.getpid()}.tmp', 'w') as file:
+        json.dump(meta, file)
+    os.replace(tmp_path, counts_path)
+    os.replace(f'{meta_path}.{os.getpid()}.tmp', meta_path)
+
+    # Cubes of older dataset sets are never read again
+    for name in os.listdir(cube_dir()):
+        if name.startswith('population-') and version not in name:
+            os.remove(os.path.join(cube_dir(), name))
+
+
+def get():
+    """The cube of all the population datasets, from the cached file or freshly built; None without datasets"""
+    global _loaded
+    selected = datasets()
+    if not selected:
+        return None
+    current = version(selected)
+    cached_version, cube = _loaded
+    record_cache('cube', cached_version == current)
+    if cached_version == current:
+        return cube
+
+    with _lock:
+        cached_version, cube = _loaded
+        if cached_version == current:
+            return cube
+        cube = None
+        if all(os.path.exists(path) for path in cache_paths(current)):
+            try:
+                cube = PopulationCube.load(current)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("Discarding unreadable population cube %s: %s", current, e)
+        if cube is None:
+            logger.debug("Building population cube %s of %s", current, ', '.join(str(d) for d in selected))
+            build(selected, current)
+            cube = PopulationCube.load(current)
+        _loaded = (current, cube)
+    return cube
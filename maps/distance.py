@@ -0,0 +1,174 @@
+"""Distance to the nearest facility, and population by distance.
+
+For the served facilities as a whole, and for each facility type, a Euclidean
+distance transform (``scipy.ndimage.distance_transform_edt``) of the
+population grid gives every pixel two values: its distance in metres to the
+nearest facility, and that facility's index. The grid is in degrees, so the
+transform is given the metric size of its centre pixel, measured as in
+``kde.pixel_size_m``.
+
+The populated pixels inside the county are then sorted by ward and by
+distance, and their population is summed cumulatively. That gives a
+population-by-distance curve for every ward, which add up to the county's.
+Coverage at any radius, for every ward at once, is one ``searchsorted``.
+No buffers are involved, so it costs the same at 4 km as at 3 km::
+
+    surfaces = distance.get(raster_path, facilities, wards, boundary)
+    surfaces.within('Health Centre', [3000, 4000])   # persons within 3 and 4 km, per ward
+    surfaces.layer('Health Centre')                  # metres to the nearest Health Centre
+
+Everything is built once per facility set, ward and county geometry and
+raster, and cached next to the raster like the coverage layers.
+
+Facilities are placed at the centre of their pixel, so a distance is off by at
+most half a pixel diagonal. Facilities outside the grid are left out.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+from . import cache, coverage, geometry, kde
+from . import population as population_grid
+
+
+# Distances (m) are offset by ward position times this in the sorted keys, so one sorted array holds every ward
+WARD_SPAN_M = 1e7
+
+# Type key of all the facilities together
+ALL_TYPES = ''
+
+
+def version(raster_path, facilities, wards, boundary):
+    """Cache key of the surfaces for this raster, facility set, wards and county boundary"""
+    stat = os.stat(raster_path)
+    digest = hashlib.sha1()
+    for facility in facilities:
+        x, y = facility.location.coords
+        digest.update(f'{facility.pk}:{x:.7f}:{y:.7f}:{facility.facility_type}\n'.encode())
+    digest.update(coverage.area_version(wards, boundary).encode())
+    digest.update(f'{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    return digest.hexdigest()[:16]
+
+
+class DistanceSurfaces:
+    """Per facility type: distance and nearest facility per pixel, and the sorted cumulative population"""
+
+    def __init__(self, arrays, version):
+        self.arrays = arrays
+        self.version = version
+        self.types = [str(facility_type) for facility_type in arrays['types']]
+
+    @classmethod
+    def load(cls, path, version):
+        with np.load(path) as arrays:
+            return cls({name: arrays[name] for name in arrays.files}, version)
+
+    def save(self, path):
+        # Write under a temporary name so concurrent readers never see a partial file
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.savez(file, **self.arrays)
+        os.replace(tmp_path, path)
+
+    def _index(self, facility_type):
+        """Position of the type's arrays; KeyError for a type without facilities on the grid"""
+        try:
+            return self.types.index(facility_type or ALL_TYPES)
+        except ValueError:
+            raise KeyError(facility_type) from None
+
+    def layer(self, facility_type=ALL_TYPES):
+        """Metres from each pixel to the nearest facility of the type"""
+        return self.arrays[f'distance_{self._index(facility_type)}']
+
+    def nearest(self, facility_type=ALL_TYPES):
+        """Index (into the facilities) of the nearest facility of the type to each pixel"""
+        return self.arrays[f'nearest_{self._index(facility_type)}']
+
+    def catchments(self, facility_type=ALL_TYPES):
+        """Population in the county nearer to each facility than to any other of the type, by facility index"""
+        return self.arrays[f'catchment_{self._index(facility_type)}']
+
+    def within(self, facility_type, radii_m):
+        """Population within each radius of a facility of the type: (radii, ward positions + 1)
+
+        Column 0 is the county outside every ward, column i the i-th ward;
+        rows sum to the county's.
+        """
+        index = self._index(facility_type)
+        keys, cumulative = self.arrays[f'keys_{index}'], self.arrays[f'cumulative_{index}']
+        starts = self.arrays['ward_starts']
+        radii_m = np.clip(np.asarray(radii_m, dtype='float64').reshape(-1), 0, WARD_SPAN_M / 2)
+        positions = np.searchsorted(keys, np.arange(len(starts) - 1) * WARD_SPAN_M + radii_m[:, None], side='right')
+        return cumulative[positions] - cumulative[starts[:-1]]
+
+    def population(self):
+        """Population of the county outside every ward, then of each ward"""
+        return self.arrays['ward_population']
+
+
+def build(raster_path, facilities, wards, boundary, version):
+    """Distance transforms of every facility type over the population grid, and the population curves"""
+    from rasterio import features
+    from scipy import ndimage
+
+    grid = population_grid.get(raster_path)
+    shape, transform = grid.shape, grid.transform
+    inside = features.geometry_mask([boundary], shape, transform, invert=True)
+    ward_ids = coverage.burn_wards(wards, shape, transform)
+    pixel_width_m, pixel_height_m = kde.pixel_size_m(transform, shape)
+
+    # The populated pixels inside the county, and where each ward's run of them starts once sorted
+    rows, cols = np.nonzero(inside & (np.asarray(grid.counts) > 0))
+    pixel_wards = ward_ids[rows, cols]
+    pixel_population = grid.counts[rows, cols].astype('float64')
+    ward_starts = np.concatenate([[0], np.cumsum(np.bincount(pixel_wards, minlength=len(wards) + 1))])
+    ward_population = np.bincount(pixel_wards, weights=pixel_population, minlength=len(wards) + 1)
+
+    lons, lats = geometry.coordinates(facilities)
+    facility_cols, facility_rows = ~transform * (lons, lats)
+    facility_rows = np.floor(facility_rows).astype('int64')
+    facility_cols = np.floor(facility_cols).astype('int64')
+    on_grid = ((facility_rows >= 0) & (facility_rows < shape[0]) &
+               (facility_cols >= 0) & (facility_cols < shape[1]))
+    facility_types = np.array([facility.facility_type or '' for facility in facilities], dtype=object)
+
+    arrays = {
+        'ward_starts': ward_starts,
+        'ward_population': ward_population,
+        'facility_ids': np.array([facility.pk for facility in facilities], dtype='int64'),
+    }
+    types = []
+    for facility_type in [ALL_TYPES] + sorted(set(facility_types) - {''}):
+        members = on_grid if facility_type == ALL_TYPES else on_grid & (facility_types == facility_type)
+        if not members.any():
+            continue
+        index = len(types)
+        types.append(facility_type)
+
+        seeds = np.full(shape, -1, dtype='int32')
+        seeds[facility_rows[members], facility_cols[members]] = np.flatnonzero(members)
+        distance, (nearest_rows, nearest_cols) = ndimage.distance_transform_edt(
+            seeds < 0, sampling=(pixel_height_m, pixel_width_m), return_indices=True,
+        )
+        nearest = seeds[nearest_rows, nearest_cols]
+        arrays[f'distance_{index}'] = distance.astype('float32')
+        arrays[f'nearest_{index}'] = nearest
+
+        keys = pixel_wards * WARD_SPAN_M + distance[rows, cols]
+        order = np.argsort(keys, kind='stable')
+        arrays[f'keys_{index}'] = keys[order]
+        arrays[f'cumulative_{index}'] = np.concatenate([[0.0], np.cumsum(pixel_population[order])])
+        arrays[f'catchment_{index}'] = np.bincount(nearest[rows, cols], weights=pixel_population,
+                                                   minlength=len(facilities))
+    arrays['types'] = np.array(types, dtype='str')
+    return DistanceSurfaces(arrays, version)
+
+
+def get(raster_path, facilities, wards, boundary):
+    """Distance surfaces of these facilities on the raster's grid, from the cache or freshly built"""
+    current = version(raster_path, facilities, wards, boundary)
+    return cache.get_cached('distance', 'facilities', raster_path, current,
+                            lambda path: DistanceSurfaces.load(path, current),
+                            lambda: build(raster_path, facilities, wards, boundary, current))
@@ -0,0 +1,303 @@
+"""Bulk export of analysis results as CSV, newline-delimited GeoJSON or GeoPackage.
+
+Each export is a table of rows, every row a geometry and a dict of
+properties::
+
+    export = exports.ward_coverage(dataset)       # or facilities(), wards(), suitability_candidates(...)
+    for chunk in exports.csv_chunks(export):
+        ...
+
+The database is read when the export is created; the rows themselves are a
+generator, so per-row work (scoring a candidate site, serializing a polygon)
+happens as the output is consumed and memory stays flat however many rows
+there are. CSV and GeoJSON are streamed in chunks of about
+STREAM_CHUNK_BYTES; a GeoPackage has to be a file, so ``write_geopackage``
+appends GPKG_CHUNK_ROWS rows at a time to it.
+
+``/maps/api/exports/<name>/?format=`` streams an export over HTTP and
+``python manage.py export_results <name> <path>`` writes one to disk.
+"""
+import csv
+import io
+import json
+import math
+import os
+import tempfile
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+from . import categories, coverage, geometry, population
+from .models import HealthCareFacility, KenyaConstituency, KenyaWard
+
+
+EXPORTS = ('ward-coverage', 'suitability-candidates', 'facilities', 'wards', 'constituencies')
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/geo+json-seq', 'geojsonl'),
+    'gpkg': ('application/geopackage+sqlite3', 'gpkg'),
+}
+
+STREAM_CHUNK_BYTES = 64 * 1024
+GPKG_CHUNK_ROWS = 5000
+
+
+class Export:
+    """A named table: (field, type) pairs with type 'str', 'int' or 'float', a geometry type and the rows"""
+
+    def __init__(self, name, fields, geometry_type, rows):
+        self.name = name
+        self.fields = fields
+        self.geometry_type = geometry_type
+        self.rows = rows  # iterator of (shapely geometry, {field: value})
+
+
+def facilities():
+    """The facilities shown on the map, in the order the analysis views read them"""
+    selected = list(HealthCareFacility.objects.served())
+
+    def rows():
+        for facility in selected:
+            yield shapely.Point(facility.location.coords), {
+                'id': facility.pk,
+                'name': facility.name,
+                'facility_type': facility.facility_type,
+                'capacity': facility.capacity,
+            }
+
+    fields = [('id', 'int'), ('name', 'str'), ('facility_type', 'str'), ('capacity', 'int')]
+    return Export('facilities', fields, 'Point', rows())
+
+
+def wards():
+    """The Kisumu wards with their census populations, in the order the analysis views read them"""
+    selected = list(KenyaWard.objects.in_county('KISUMU'))
+
+    def rows():
+        for ward in selected:
+            yield geometry.to_shapely(ward.geom), {
+                'gid': ward.pk,
+                'ward': ward.ward,
+                'subcounty': ward.subcounty,
+                'county': ward.county,
+                'uid': ward.uid,
+                'pop2009': ward.pop2009,
+                'pop2019': ward.pop2019,
+            }
+
+    fields = [('gid', 'int'), ('ward', 'str'), ('subcounty', 'str'), ('county', 'str'), ('uid', 'str'),
+              ('pop2009', 'int'), ('pop2019', 'int')]
+    return Export('wards', fields, 'MultiPolygon', rows())
+
+
+def constituencies():
+    """The Kisumu constituencies"""
+    selected = list(KenyaConstituency.objects.filter(county_nam__iexact='KISUMU').order_by('pk'))
+
+    def rows():
+        for constituency in selected:
+            yield geometry.to_shapely(constituency.geom), {
+                'gid': constituency.pk,
+                'const_no': constituency.const_no,
+                'const_name': constituency.const_name,
+                'county_nam': constituency.county_nam,
+            }
+
+    fields = [('gid', 'int'), ('const_no', 'int'), ('const_name', 'str'), ('county_nam', 'str')]
+    return Export('constituencies', fields, 'MultiPolygon', rows())
+
+
+def ward_coverage(dataset):
+    """Gridded population and service-area coverage of each Kisumu ward"""
+    from .views import get_kisumu_boundary
+
+    selected = list(HealthCareFacility.objects.served())
+    wards = list(KenyaWard.objects.in_county('KISUMU'))
+    radii_km = categories.policy().radii_km(selected)
+    layer = coverage.get_layer('service-areas', dataset.raster_file.path, selected, radii_km, wards,
+                               get_kisumu_boundary())
+    summary = layer.summary(len(wards))
+
+    def rows():
+        for i, ward in enumerate(wards):
+            population, served = float(summary['ward_population'][i]), float(summary['ward_served_population'][i])
+            area, covered = float(summary['ward_area_km2'][i]), float(summary['ward_covered_km2'][i])
+            yield geometry.to_shapely(ward.geom), {
+                'gid': ward.pk,
+                'ward': ward.ward,
+                'subcounty': ward.subcounty,
+                'pop2019': ward.pop2019,
+                'population': round(population),
+                'served_population': round(served),
+                'redundant_population': round(float(summary['ward_redundant_population'][i])),
+                'coverage_percent': round(served / population * 100, 2) if population > 0 else None,
+                'area_km2': round(area, 3),
+                'covered_area_km2': round(covered, 3),
+            }
+
+    fields = [('gid', 'int'), ('ward', 'str'), ('subcounty', 'str'), ('pop2019', 'int'), ('population', 'int'),
+              ('served_population', 'int'), ('redundant_population', 'int'), ('coverage_percent', 'float'),
+              ('area_km2', 'float'), ('covered_area_km2', 'float')]
+    return Export('ward-coverage', fields, 'MultiPolygon', rows())
+
+
+def suitability_candidates(dataset, facility_type):
+    """Every candidate site of the suitability analysis for `facility_type`, scored, in grid order
+
+    Unlike the analysis endpoint, which scores only the candidates that could
+    rank among the best, this scores the whole grid.
+    """
+    from .views import get_kisumu_boundary, score_sites
+    from .views import suitability_candidates as candidate_grid
+
+    existing = list(HealthCareFacility.objects.served())
+    wards = list(KenyaWard.objects.in_county('KISUMU'))
+    boundary = get_kisumu_boundary()
+    candidates = None
+    if existing and boundary is not None:
+        candidates = candidate_grid(existing, boundary, wards, population.get(dataset.raster_file.path),
+                                    facility_type)
+
+    def rows():
+        if candidates is None:
+            return
+        for feature in score_sites(candidates, range(len(candidates['points']))):
+            yield shape(feature['geometry']), feature['properties']
+
+    fields = [('population_served', 'int'), ('area_km2', 'float'), ('mean_density', 'float'),
+              ('max_density', 'float'), ('ward', 'str'), ('ward_population', 'float'),
+              ('ward_coverage_percent', 'float'), ('density_score', 'float'), ('coverage_score', 'float'),
+              ('population_score', 'float'), ('ward_pop_score', 'float'), ('accessibility_score', 'float'),
+              ('composite_score', 'float'), ('facility_type', 'str'), ('buffer_km', 'float')]
+    return Export('suitability-candidates', fields, 'Point', rows())
+
+
+def create(name, dataset, facility_type='Health Centre'):
+    """Export `name` of EXPORTS"""
+    if name == 'facilities':
+        return facilities()
+    if name == 'wards':
+        return wards()
+    if name == 'constituencies':
+        return constituencies()
+    if name == 'ward-coverage':
+        return ward_coverage(dataset)
+    if name == 'suitability-candidates':
+        return suitability_candidates(dataset, facility_type)
+    raise KeyError(name)
+
+
+def _buffered(pieces, size=STREAM_CHUNK_BYTES):
+    """Join small byte strings into chunks of about `size` bytes"""
+    buffer, length = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def csv_chunks(export):
+    """CSV of the export, the geometry as WKT in the last column"""
+    names = [name for name, _ in export.fields]
+
+    def lines():
+        text = io.StringIO()
+        writer = csv.writer(text)
+        writer.writerow(names + ['wkt'])
+        for geom, properties in export.rows:
+            writer.writerow([properties.get(name) for name in names] + [shapely.to_wkt(geom, rounding_precision=-1)])
+            yield text.getvalue().encode()
+            text.seek(0)
+            text.truncate()
+        # The header, if there were no rows
+        yield text.getvalue().encode()
+
+    return _buffered(lines())
+
+
+def _json_value(value):
+    return None if isinstance(value, float) and not math.isfinite(value) else value
+
+
+def ndjson_chunks(export):
+    """Newline-delimited GeoJSON of the export: one Feature per line"""
+    names = [name for name, _ in export.fields]
+
+    def lines():
+        for geom, properties in export.rows:
+            properties = json.dumps({name: _json_value(properties.get(name)) for name in names})
+            yield f'{{"type":"Feature","geometry":{shapely.to_geojson(geom)},"properties":{properties}}}\n'.encode()
+
+    return _buffered(lines())
+
+
+def _columns(fields, rows):
+    """pyogrio field arrays and null masks of a chunk of rows"""
+    arrays, masks = [], []
+    for name, kind in fields:
+        values = [properties.get(name) for _, properties in rows]
+        mask = np.array([value is None for value in values])
+        if kind == 'int':
+            arrays.append(np.array([0 if value is None else value for value in values], dtype='int64'))
+        elif kind == 'float':
+            arrays.append(np.array([np.nan if value is None else value for value in values], dtype='float64'))
+        else:
+            arrays.append(np.array(values, dtype=object))
+        masks.append(mask if mask.any() else None)
+    return arrays, masks
+
+
+def write_geopackage(export, path, chunk_rows=GPKG_CHUNK_ROWS):
+    """Write the export to a GeoPackage at `path`, `chunk_rows` rows at a time; returns the row count"""
+    try:
+        from pyogrio.raw import write
+    except ImportError:
+        raise RuntimeError('GeoPackage export requires pyogrio') from None
+
+    layer = export.name.replace('-', '_')
+    fields = [name for name, _ in export.fields]
+    count, chunk = 0, []
+
+    def flush(append):
+        arrays, masks = _columns(export.fields, chunk)
+        geometries = shapely.to_wkb(np.array([geom for geom, _ in chunk], dtype=object))
+        write(path, geometries, arrays, fields, field_mask=masks, layer=layer, driver='GPKG',
+              geometry_type=export.geometry_type, crs='EPSG:4326', append=append)
+
+    for row in export.rows:
+        chunk.append(row)
+        if len(chunk) == chunk_rows:
+            flush(append=count > 0)
+            count += len(chunk)
+            chunk = []
+    if chunk or not count:
+        flush(append=count > 0)
+        count += len(chunk)
+    return count
+
+
+def geopackage_file(export):
+    """The export written to an anonymous temporary GeoPackage, as an open binary file"""
+    fd, path = tempfile.mkstemp(suffix='.gpkg')
+    os.close(fd)
+    # GDAL creates the file itself
+    os.remove(path)
+    try:
+        write_geopackage(export, path)
+        file = open(path, 'rb')
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    return file
+
+
+def file_chunks(file, size=STREAM_CHUNK_BYTES):
+    """Read an open file in chunks of `size` bytes, closing it at the end"""
+    with file:
+        while chunk := file.read(size):
+            yield chunk
@@ -0,0 +1,102 @@
+"""Vectorized geometry kernel shared by the analysis views.
+
+Everything here works on numpy arrays of shapely geometries or coordinates, so
+an analysis over N facilities is a handful of GEOS/PROJ calls instead of N
+Python-level ones:
+
+    lons, lats = coordinates(facilities)
+    buffers = metric_buffers(lons, lats, radii_km)
+    coverage = union(buffers)
+    areas = areas_km2(ward_geometries)
+
+Buffers are built in UTM zone 36S, so a 5 km buffer really is 5 km across at
+any latitude, and areas are measured in a Lambert azimuthal equal-area
+projection centred on Kisumu, which preserves area on the ellipsoid.
+"""
+import functools
+
+import numpy as np
+import shapely
+
+
+WGS84 = 'EPSG:4326'
+UTM_36S = 'EPSG:32736'  # UTM zone 36S (covers Kenya)
+# Equal-area projection centred on Kisumu County
+KISUMU_LAEA = '+proj=laea +lat_0=-0.2 +lon_0=34.9 +datum=WGS84 +units=m +no_defs'
+
+
+@functools.lru_cache(maxsize=None)
+def transformer(source, target):
+    """Transformer from CRS `source` to `target`, built (and pyproj imported) once per process"""
+    import pyproj
+    return pyproj.Transformer.from_crs(source, target, always_xy=True)
+
+# Segments per quarter circle for buffers, as shapely's default
+QUAD_SEGS = 16
+
+
+def _reproject(transformer, geometries):
+    def transform_coords(coords):
+        x, y = transformer.transform(coords[:, 0], coords[:, 1])
+        return np.column_stack([x, y])
+    return shapely.transform(geometries, transform_coords)
+
+
+def to_utm(geometries):
+    """Project WGS84 geometries (one or an array) to UTM 36S metres"""
+    return _reproject(transformer(WGS84, UTM_36S), geometries)
+
+
+def from_utm(geometries):
+    """Project UTM 36S geometries (one or an array) back to WGS84"""
+    return _reproject(transformer(UTM_36S, WGS84), geometries)
+
+
+def to_shapely(geometry):
+    """Convert a GeoDjango geometry to a shapely one"""
+    if geometry is None:
+        return None
+    return shapely.from_wkb(bytes(geometry.wkb))
+
+
+def from_django(geometries):
+    """Convert an iterable of GeoDjango geometries to an array of shapely geometries"""
+    return shapely.from_wkb([bytes(geometry.wkb) for geometry in geometries])
+
+
+def coordinates(facilities):
+    """Longitude and latitude arrays of the facilities' locations"""
+    coords = np.array([facility.location.coords for facility in facilities], dtype=float).reshape(-1, 2)
+    return coords[:, 0], coords[:, 1]
+
+
+def utm_coordinates(lons, lats):
+    """UTM 36S x and y arrays (metres) of WGS84 coordinate arrays"""
+    return transformer(WGS84, UTM_36S).transform(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float))
+
+
+def metric_buffers(lons, lats, radii_km, quad_segs=QUAD_SEGS):
+    """True circular buffers of `radii_km` (scalar or per point) around WGS84 points, returned in WGS84"""
+    x, y = utm_coordinates(lons, lats)
+    radii_m = np.asarray(radii_km, dtype=float) * 1000
+    return from_utm(shapely.buffer(shapely.points(x, y), radii_m, quad_segs=quad_segs))
+
+
+def union(geometries):
+    """Union of an array of geometries"""
+    return shapely.union_all(geometries)
+
+
+def areas_km2(geometries):
+    """Areas in km² of WGS84 geometries (one or an array), measured on the ellipsoid"""
+    return shapely.area(_reproject(transformer(WGS84, KISUMU_LAEA), geometries)) / 1e6
+
+
+def locate(points, polygons):
+    """Index of the polygon containing each point, or -1 if none does"""
+    point_idx, polygon_idx = shapely.STRtree(polygons).query(points, predicate='within')
+    located = np.full(len(points), -1, dtype=np.intp)
+    # Where polygons overlap the point goes to the first, as a linear scan would
+    order = np.argsort(-polygon_idx, kind='stable')
+    located[point_idx[order]] = polygon_idx[order]
+    return located
@@ -0,0 +1,185 @@
+"""Hexagonal-bin aggregates of population, facilities and coverage.
+
+The county is tiled with pointy-top hexagons in the Kisumu equal-area
+projection, at a few fixed sizes (RESOLUTIONS_M, the hexagon circumradius in
+metres), so every hexagon of a resolution covers the same ground area and an
+aggregate map means the same thing at any zoom. Hexagons are indexed by
+integer axial coordinates (q, r), computed in NumPy for all points at once.
+
+Every populated pixel of the population grid inside the county is assigned to
+the hexagon containing its centre. Per hexagon this gives:
+
+- ``population``: persons (sum of the persons-per-pixel grid)
+- ``facilities``: facilities located in the hexagon
+- ``mean_distance_km``: population-weighted mean distance to the nearest facility
+- ``coverage_share``: share of the population inside a facility service area
+
+All resolutions are built together from the service-area coverage layer and
+cached next to the raster, under the coverage layer's version, so the
+aggregates are rebuilt only when the facilities, wards, county or raster change.
+``columns()`` and ``pack()`` serve a resolution as columnar JSON or binary.
+"""
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+from . import cache, coverage, geometry
+
+
+# Hexagon circumradius (centre to corner) in metres, by resolution
+RESOLUTIONS_M = (8000, 4000, 2000, 1000, 500)
+
+SQRT3 = np.sqrt(3)
+
+
+def axial(x, y, size):
+    """Axial (q, r) coordinates of the pointy-top hexagons of circumradius `size` containing points (x, y)"""
+    q = (SQRT3 / 3 * x - y / 3) / size
+    r = (2 / 3 * y) / size
+    # Round in cube coordinates (q + r + s = 0), fixing the component that moved most
+    s = -q - r
+    q_round, r_round, s_round = np.round(q), np.round(r), np.round(s)
+    q_diff, r_diff, s_diff = np.abs(q_round - q), np.abs(r_round - r), np.abs(s_round - s)
+    fix_q = (q_diff > r_diff) & (q_diff > s_diff)
+    fix_r = ~fix_q & (r_diff > s_diff)
+    q_round = np.where(fix_q, -r_round - s_round, q_round)
+    r_round = np.where(fix_r, -q_round - s_round, r_round)
+    return q_round.astype('int32'), r_round.astype('int32')
+
+
+def centres(q, r, size):
+    """Projected (x, y) centres of the hexagons (q, r)"""
+    return size * SQRT3 * (q + r / 2), size * 1.5 * r
+
+
+def _pack_keys(q, r):
+    return (q.astype('int64') << 32) | (r.astype('int64') & 0xFFFFFFFF)
+
+
+def aggregate(size, x, y, counts, served, distances_m, facility_x, facility_y):
+    """Per-hexagon columns at circumradius `size` of the pixels (x, y) and the facilities"""
+    pixel_keys = _pack_keys(*axial(x, y, size))
+    facility_keys = _pack_keys(*axial(facility_x, facility_y, size))
+    keys, inverse = np.unique(np.concatenate([pixel_keys, facility_keys]), return_inverse=True)
+    pixel_bins, facility_bins = inverse[:len(pixel_keys)], inverse[len(pixel_keys):]
+
+    population = np.bincount(pixel_bins, weights=counts, minlength=len(keys))
+    served_population = np.bincount(pixel_bins, weights=counts * served, minlength=len(keys))
+    weighted_distance = np.bincount(pixel_bins, weights=counts * distances_m, minlength=len(keys))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_distance_km = np.where(population > 0, weighted_distance / population / 1000, np.nan)
+        coverage_share = np.where(population > 0, served_population / population, np.nan)
+
+    q, r = (keys >> 32).astype('int32'), (keys & 0xFFFFFFFF).astype('uint32').view('int32')
+    lons, lats = geometry.transformer(geometry.KISUMU_LAEA, geometry.WGS84).transform(*centres(q, r, size))
+    return {
+        'q': q,
+        'r': r,
+        'lon': lons,
+        'lat': lats,
+        'population': population,
+        'facilities': np.bincount(facility_bins, minlength=len(keys)).astype('int32'),
+        'mean_distance_km': mean_distance_km,
+        'coverage_share': coverage_share,
+    }
+
+
+class HexBins:
+    """Columns of every resolution, {resolution: {column: array}}"""
+
+    def __init__(self, resolutions, version):
+        self.resolutions = resolutions
+        self.version = version
+
+    @classmethod
+    def load(cls, path, version):
+        resolutions = {}
+        with np.load(path) as arrays:
+            for name in arrays.files:
+                resolution, column = name.split('_', 1)
+                resolutions.setdefault(int(resolution), {})[column] = arrays[name]
+        return cls(resolutions, version)
+
+    def save(self, path):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.savez(file, **{f'{resolution}_{column}': values
+                              for resolution, columns in self.resolutions.items()
+                              for column, values in columns.items()})
+        os.replace(tmp_path, path)
+
+    def columns(self, resolution):
+        """Resolution `resolution` as JSON-serializable columns, rounded for size (NaN as null)"""
+        digits = {'lon': 6, 'lat': 6, 'population': 1, 'mean_distance_km': 3, 'coverage_share': 4}
+        result = {}
+        for column, values in self.resolutions[resolution].items():
+            if column in digits:
+                values = np.round(values.astype('float64'), digits[column])
+                result[column] = [None if np.isnan(value) else value for value in values.tolist()]
+            else:
+                result[column] = values.tolist()
+        return result
+
+    def pack(self, resolution):
+        """Resolution `resolution` as binary: a little-endian uint32 header length, a JSON header, then the columns
+
+        The header lists each column's name, dtype (int32 or float32; NaN
+        where undefined), byte offset from the start of the column data and
+        length. Offsets are 4-byte aligned, so a browser can view each column
+        directly as an Int32Array or Float32Array.
+        """
+        columns = self.resolutions[resolution]
+        header = {'resolution': resolution, 'size_m': RESOLUTIONS_M[resolution],
+                  'count': len(columns['q']), 'columns': []}
+        chunks, offset = [], 0
+        for column, values in columns.items():
+            dtype = '<i4' if values.dtype.kind in 'iu' else '<f4'
+            data = values.astype(dtype).tobytes()
+            header['columns'].append({'name': column, 'dtype': 'int32' if dtype == '<i4' else 'float32',
+                                      'offset': offset, 'length': len(values)})
+            chunks.append(data)
+            offset += len(data)
+        header_bytes = json.dumps(header, separators=(',', ':')).encode()
+        # Pad the header so the columns start 4-byte aligned
+        header_bytes += b' ' * (-(4 + len(header_bytes)) % 4)
+        return struct.pack('<I', len(header_bytes)) + header_bytes + b''.join(chunks)
+
+
+def build(layer, transform, facilities, version):
+    """Aggregate a service-area coverage layer and the facilities into hexagons of every resolution"""
+    rows, cols = np.nonzero(layer.inside & (layer.population > 0))
+    counts = layer.population[rows, cols].astype('float64')
+    served = (layer.depth[rows, cols] > 0).astype('float64')
+
+    to_laea = geometry.transformer(geometry.WGS84, geometry.KISUMU_LAEA)
+    x, y = to_laea.transform(transform.c + (cols + 0.5) * transform.a, transform.f + (rows + 0.5) * transform.e)
+    facility_x, facility_y = to_laea.transform(*geometry.coordinates(facilities))
+    # The layer already holds each pixel's nearest facility
+    nearest = layer.nearest[rows, cols]
+    if len(facilities):
+        distances_m = np.hypot(x - facility_x[nearest], y - facility_y[nearest])
+    else:
+        distances_m = np.full(len(counts), np.nan)
+
+    return HexBins({
+        resolution: aggregate(size, x, y, counts, served, distances_m, facility_x, facility_y)
+        for resolution, size in enumerate(RESOLUTIONS_M)
+    }, version)
+
+
+def get(raster_path, facilities, radii_km, wards, boundary):
+    """Hexagon aggregates of the service areas for these facilities and radii, from the cache or freshly built"""
+    radii_km = np.broadcast_to(np.asarray(radii_km, dtype=float), (len(facilities),))
+    resolutions = ','.join(str(size) for size in RESOLUTIONS_M)
+    layer_version = coverage.layer_version(raster_path, facilities, radii_km, wards, boundary)
+    version = hashlib.sha1(f'{layer_version}:{resolutions}'.encode()).hexdigest()[:16]
+
+    def build_hexbins():
+        layer = coverage.get_layer('service-areas', raster_path, facilities, radii_km, wards, boundary)
+        return build(layer, coverage.population_grid.get(raster_path).transform, facilities, version)
+
+    return cache.get_cached('hexbins', 'service-areas', raster_path, version,
+                            lambda path: HexBins.load(path, version), build_hexbins)
@@ -0,0 +1,149 @@
+"""Per-request phase timing.
+
+Wrap the expensive parts of a view in ``phase``::
+
+    with phase('raster'):
+        data = src.read(1)
+
+    @phase('buffer')
+    def build_buffers(...):
+        ...
+
+``ServerTimingMiddleware`` collects the phases of each request, reports them
+in a ``Server-Timing`` response header and logs one structured record per
+request on the ``maps.timing`` logger.
+"""
+import contextvars
+import json
+import logging
+import time
+from contextlib import ContextDecorator
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+
+logger = logging.getLogger('maps.timing')
+
+# Phase totals of the request being handled: {name: [total seconds, count]}
+_phases = contextvars.ContextVar('maps_request_phases', default=None)
+
+
+class phase(ContextDecorator):
+    """Time a named phase of the current request (context manager or decorator)"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self._started)
+        return False
+
+    def _recreate_cm(self):
+        # A fresh instance per decorated call keeps the decorator re-entrant
+        return phase(self.name)
+
+
+def record(name, seconds):
+    """Add `seconds` to phase `name` of the current request, if one is being timed"""
+    phases = _phases.get()
+    if phases is None:
+        return
+    totals = phases.setdefault(name, [0.0, 0])
+    totals[0] += seconds
+    totals[1] += 1
+
+
+def current_phases():
+    """Phase totals recorded so far in this request, in milliseconds"""
+    phases = _phases.get() or {}
+    return {name: totals[0] * 1000 for name, totals in phases.items()}
+
+
+def server_timing_header(phases, total_ms):
+    """Format phase durations (ms) as a Server-Timing header value"""
+    entries = [f'{name};dur={duration:.1f}' for name, duration in phases.items()]
+    entries.append(f'total;dur={total_ms:.1f}')
+    return ', '.join(entries)
+
+
+class ServerTimingMiddleware:
+    """Collect phase timings per request and report them as a header and a log record"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.emit_header = getattr(settings, 'SERVER_TIMING_HEADER', True)
+        self.log_level = logging.getLevelName(getattr(settings, 'REQUEST_TIMING_LOG_LEVEL', 'INFO'))
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _phases.set({})
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+            self.report(request, response, time.perf_counter() - started)
+        finally:
+            _phases.reset(token)
+        return response
+
+    async def __acall__(self, request):
+        token = _phases.set({})
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+            self.report(request, response, time.perf_counter() - started)
+        finally:
+            _phases.reset(token)
+        return response
+
+    def report(self, request, response, elapsed):
+        phases = current_phases()
+        total_ms = elapsed * 1000
+
+        if self.emit_header:
+            response['Server-Timing'] = server_timing_header(phases, total_ms)
+
+        if logger.isEnabledFor(self.log_level):
+            match = getattr(request, 'resolver_match', None)
+            timing = {
+                'method': request.method,
+                'path': request.path,
+                'view': match.view_name if match else None,
+                'status': response.status_code,
+                'total_ms': round(total_ms, 1),
+                'phases': {name: round(duration, 1) for name, duration in phases.items()},
+            }
+            logger.log(
+                self.log_level, '%s %s %s %.1fms %s',
+                request.method, request.path, response.status_code, total_ms,
+                ' '.join(f'{name}={duration:.1f}ms' for name, duration in phases.items()),
+                extra={'timing': timing},
+            )
+
+
+class JsonFormatter(logging.Formatter):
+    """Render log records as one JSON object per line, including any timing data"""
+
+    def format(self, record):
+        payload = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        timing = getattr(record, 'timing', None)
+        if timing is not None:
+            payload.update(timing)
+        if record.exc_info:
+            payload['exception'] = self.formatException(record.exc_info)
+        return json.dumps(payload)
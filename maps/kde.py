@@ -0,0 +1,177 @@
+"""Kernel density surfaces of the facilities, and of population per facility.
+
+The facilities are counted into the pixels of the population grid, either
+one each or weighted by their capacity, and smoothed with a Gaussian kernel
+whose standard deviation is the bandwidth. Each pixel then holds facilities
+(or beds) per km² around it. The convolution uses FFTs
+(``scipy.signal.fftconvolve``), so it costs the same for any bandwidth and any
+number of facilities. The population grid is smoothed with the same kernels.
+Their ratio is the population per facility (or per bed) within reach of the
+kernel, which is high where many people share few facilities.
+
+All the surfaces are built together and cached next to the raster. That is
+every bandwidth of BANDWIDTHS_KM, both weights and the ratios. The cache
+version covers the facilities, their capacities and the raster, so a request
+only slices an array that is already built::
+
+    surfaces = kde.get(dataset.raster_file.path, facilities)
+    surfaces.layer('ratio', 5.0, 'capacity')     # persons per bed, 5 km bandwidth
+
+The grid is in degrees. The kernels use the pixel size at the grid's centre,
+measured in the Kisumu equal-area projection. Across the county the shape of
+a pixel varies by well under 1%. Facilities outside the grid are left out.
+Facilities without a capacity are weighted as the median capacity of the
+facilities that have one.
+"""
+import hashlib
+import os
+
+import numpy as np
+
+from . import cache, geometry
+from . import population as population_grid
+
+
+# Kernel standard deviations, in km
+BANDWIDTHS_KM = (1.0, 2.0, 5.0, 10.0)
+
+# What each facility adds to the surface: 1, or its capacity
+WEIGHTS = ('count', 'capacity')
+
+LAYERS = ('facilities', 'population', 'ratio')
+
+UNITS = {
+    ('facilities', 'count'): 'facilities per km²',
+    ('facilities', 'capacity'): 'beds per km²',
+    ('population', 'count'): 'persons per km²',
+    ('population', 'capacity'): 'persons per km²',
+    ('ratio', 'count'): 'persons per facility',
+    ('ratio', 'capacity'): 'persons per bed',
+}
+
+# Kernels are cut off at this many bandwidths from their centre, as in scipy.ndimage.gaussian_filter
+TRUNCATE = 4.0
+
+
+def pixel_size_m(transform, shape):
+    """(width, height) in metres of the pixel at the centre of a north-up WGS84 grid"""
+    height, width = shape
+    col, row = width // 2, height // 2
+    lons, lats = transform * (np.array([col, col + 1, col]), np.array([row, row, row + 1]))
+    x, y = geometry.transformer(geometry.WGS84, geometry.KISUMU_LAEA).transform(lons, lats)
+    return float(np.hypot(x[1] - x[0], y[1] - y[0])), float(np.hypot(x[2] - x[0], y[2] - y[0]))
+
+
+def gaussian_kernel(bandwidth_m, pixel_width_m, pixel_height_m):
+    """Gaussian of standard deviation `bandwidth_m` sampled on the pixels, summing to 1"""
+    sigma_x, sigma_y = bandwidth_m / pixel_width_m, bandwidth_m / pixel_height_m
+    x = np.arange(-int(np.ceil(TRUNCATE * sigma_x)), int(np.ceil(TRUNCATE * sigma_x)) + 1) / sigma_x
+    y = np.arange(-int(np.ceil(TRUNCATE * sigma_y)), int(np.ceil(TRUNCATE * sigma_y)) + 1) / sigma_y
+    kernel = np.exp(-0.5 * (y[:, None] ** 2 + x[None, :] ** 2))
+    return kernel / kernel.sum()
+
+
+def smooth(values, kernel):
+    """`values` convolved with `kernel`, same shape, zero beyond the edges"""
+    from scipy.signal import fftconvolve
+
+    # FFT round-off leaves tiny negative values where there is nothing
+    return np.maximum(fftconvolve(values, kernel, mode='same'), 0)
+
+
+def capacities(facilities):
+    """Capacity of each facility, the median of the known ones where it has none"""
+    values = np.array([np.nan if facility.capacity is None else facility.capacity for facility in facilities],
+                      dtype='float64')
+    known = values[~np.isnan(values)]
+    return np.where(np.isnan(values), np.median(known) if known.size else 1.0, values)
+
+
+def facility_grid(transform, shape, facilities, weights):
+    """Sum of the facilities' weights in each pixel"""
+    grid = np.zeros(shape, dtype='float64')
+    lons, lats = geometry.coordinates(facilities)
+    cols, rows = ~transform * (lons, lats)
+    rows, cols = np.floor(rows).astype('int64'), np.floor(cols).astype('int64')
+    inside = (rows >= 0) & (rows < shape[0]) & (cols >= 0) & (cols < shape[1])
+    np.add.at(grid, (rows[inside], cols[inside]), weights[inside])
+    return grid
+
+
+def version(raster_path, facilities):
+    """Cache key of the surfaces for this raster and facility set"""
+    stat = os.stat(raster_path)
+    digest = hashlib.sha1()
+    for facility in facilities:
+        x, y = facility.location.coords
+        digest.update(f'{facility.pk}:{x:.7f}:{y:.7f}:{facility.capacity}\n'.encode())
+    digest.update(','.join(f'{bandwidth:g}' for bandwidth in BANDWIDTHS_KM).encode())
+    digest.update(f'{stat.st_size}:{stat.st_mtime_ns}'.encode())
+    return digest.hexdigest()[:16]
+
+
+def _key(layer, bandwidth_km, weight):
+    if layer == 'population':
+        return f'population_{bandwidth_km:g}'
+    return f'{layer}_{weight}_{bandwidth_km:g}'
+
+
+class Surfaces:
+    """Every layer, bandwidth and weight of the density surfaces, as float32 arrays on the population grid"""
+
+    def __init__(self, arrays, version):
+        self.arrays = arrays
+        self.version = version
+
+    @classmethod
+    def load(cls, path, version):
+        with np.load(path) as arrays:
+            return cls({name: arrays[name] for name in arrays.files}, version)
+
+    def save(self, path):
+        # Write under a temporary name so concurrent readers never see a partial file
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.savez(file, **self.arrays)
+        os.replace(tmp_path, path)
+
+    def layer(self, layer, bandwidth_km, weight='count'):
+        """Surface `layer` at `bandwidth_km` (one of BANDWIDTHS_KM); NaN ratio where no facility is in reach"""
+        return self.arrays[_key(layer, bandwidth_km, weight)]
+
+
+def build(raster_path, facilities, version):
+    """Smooth the facilities and the population at every bandwidth, and divide them"""
+    grid = population_grid.get(raster_path)
+    area_km2 = grid.row_area_km2[:, None]
+    pixel_width_m, pixel_height_m = pixel_size_m(grid.transform, grid.shape)
+    weighted = {
+        'count': facility_grid(grid.transform, grid.shape, facilities, np.ones(len(facilities))),
+        'capacity': facility_grid(grid.transform, grid.shape, facilities, capacities(facilities)),
+    }
+
+    arrays = {}
+    for bandwidth_km in BANDWIDTHS_KM:
+        kernel = gaussian_kernel(bandwidth_km * 1000, pixel_width_m, pixel_height_m)
+        population = smooth(grid.counts.astype('float64'), kernel) / area_km2
+        arrays[_key('population', bandwidth_km, None)] = population.astype('float32')
+        # Pixels within the kernel's reach of a facility; beyond them only round-off remains
+        reached = None
+        for weight in WEIGHTS:
+            facilities_smoothed = smooth(weighted[weight], kernel)
+            if reached is None:
+                reached = facilities_smoothed >= kernel.min() / 2
+            density = facilities_smoothed / area_km2
+            arrays[_key('facilities', bandwidth_km, weight)] = density.astype('float32')
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratio = np.where(reached & (density > 0), population / density, np.nan)
+            arrays[_key('ratio', bandwidth_km, weight)] = ratio.astype('float32')
+    return Surfaces(arrays, version)
+
+
+def get(raster_path, facilities):
+    """Density surfaces of these facilities on the raster's grid, from the cache or freshly built"""
+    current = version(raster_path, facilities)
+    return cache.get_cached('kde', 'facilities', raster_path, current,
+                            lambda path: Surfaces.load(path, current),
+                            lambda: build(raster_path, facilities, current))
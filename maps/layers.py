@@ -0,0 +1,249 @@
+"""GeoJSON map layers serialized by the database.
+
+PostGIS renders each geometry with ``ST_AsGeoJSON`` at a fixed number of
+decimal digits, optionally after ``ST_SimplifyPreserveTopology``, and the
+rows are read from a plain cursor in chunks. No model instances or GEOS
+geometries are created, and the output has the same shape as Django's
+``geojson`` serializer (``id`` and the selected fields as properties).
+
+    county_json = layers.render('county')
+    response = StreamingHttpResponse(layers.stream('wards'), content_type='application/geo+json')
+
+For the map pages each layer is also built once into a versioned artifact,
+stored uncompressed, gzip- and (if the brotli package is installed)
+brotli-compressed under ``MAPS_ARTIFACT_ROOT/layers``. The version is a hash
+of the content, and the layer endpoint serves whichever encoding the client
+accepts. Rebuild the artifacts with ``manage.py build_layers`` after the
+boundaries or facilities change. Builds update the manifest under a file lock,
+and a layer's previous version is kept until the next build replaces it, so a
+worker still holding the old manifest can serve it.
+"""
+import glob
+import gzip
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.gis.db.models.functions import AsGeoJSON, GeomOutputGeoFunc
+from django.db import connections
+from django.db.models import F
+from django.urls import reverse
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # no cross-process manifest lock on Windows
+    fcntl = None
+
+from .models import HealthCareFacility, KenyaConstituency, KenyaCounty, KenyaWard
+
+
+# Rows fetched from the cursor per chunk
+CHUNK_SIZE = 500
+
+
+class SimplifyPreserveTopology(GeomOutputGeoFunc):
+    arity = 2
+
+
+# precision: decimal digits of the coordinates (5 is ~1 m, 6 is ~0.1 m)
+# simplify: ST_SimplifyPreserveTopology tolerance in degrees, or None
+LAYERS = {
+    'county': {
+        'queryset': lambda: KenyaCounty.objects.filter(county__iexact='KISUMU'),
+        'geometry': 'geom',
+        'fields': ('county',),
+        'precision': 5,
+        'simplify': 0.0001,
+    },
+    'constituencies': {
+        'queryset': lambda: KenyaConstituency.objects.filter(county_nam__iexact='KISUMU'),
+        'geometry': 'geom',
+        'fields': ('const_name', 'const_no'),
+        'precision': 5,
+        'simplify': 0.0001,
+    },
+    'wards': {
+        'queryset': lambda: KenyaWard.objects.in_county('KISUMU'),
+        'geometry': 'geom',
+        'fields': ('ward', 'pop2019', 'subcounty'),
+        'precision': 5,
+        'simplify': 0.0001,
+    },
+    'facilities': {
+        'queryset': lambda: HealthCareFacility.objects.served(),
+        'geometry': 'location',
+        'fields': ('name', 'facility_type', 'capacity'),
+        'precision': 6,
+        'simplify': None,
+    },
+}
+
+HEADER = '{"type": "FeatureCollection", "crs": {"type": "name", "properties": {"name": "EPSG:4326"}}, "features": ['
+FOOTER = ']}'
+
+
+def layer_query(name):
+    """Queryset of layer `name` selecting pk, the fields and the GeoJSON geometry"""
+    layer = LAYERS[name]
+    geometry = F(layer['geometry'])
+    if layer['simplify']:
+        geometry = SimplifyPreserveTopology(geometry, layer['simplify'])
+    return layer['queryset']().annotate(
+        geojson=AsGeoJSON(geometry, precision=layer['precision'])
+    ).values_list('pk', *layer['fields'], 'geojson').order_by('pk')
+
+
+def rows(name, chunk_size=CHUNK_SIZE):
+    """Chunks of (pk, *fields, geojson) rows of layer `name`, read straight from a database cursor"""
+    queryset = layer_query(name)
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            chunk = cursor.fetchmany(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def feature(row, fields):
+    pk, *values, geojson = row
+    properties = json.dumps(dict(zip(fields, values)), default=str)
+    return f'{{"type": "Feature", "id": {json.dumps(pk)}, "properties": {properties}, "geometry": {geojson or "null"}}}'
+
+
+def stream(name, chunk_size=CHUNK_SIZE):
+    """Layer `name` as a GeoJSON FeatureCollection, in string chunks"""
+    fields = LAYERS[name]['fields']
+    yield HEADER
+    separator = ''
+    for chunk in rows(name, chunk_size):
+        yield separator + ', '.join(feature(row, fields) for row in chunk)
+        separator = ', '
+    yield FOOTER
+
+
+def render(name):
+    """Layer `name` as one GeoJSON string"""
+    return ''.join(stream(name))
+
+
+# Artifact encodings, preferred first: {encoding: file suffix}
+ENCODINGS = {'br': '.br', 'gzip': '.gz', 'identity': ''}
+
+# Manifest contents by mtime, so each request doesn't re-read it
+_manifest = (None, {})
+
+
+def artifact_dir():
+    return os.path.join(settings.MAPS_ARTIFACT_ROOT, 'layers')
+
+
+def artifact_path(name, version, encoding='identity'):
+    return os.path.join(artifact_dir(), f'{name}.{version}.geojson{ENCODINGS[encoding]}')
+
+
+def _manifest_path():
+    return os.path.join(artifact_dir(), 'manifest.json')
+
+
+def manifest():
+    """{layer name: version} of the built artifacts"""
+    global _manifest
+    try:
+        mtime = os.stat(_manifest_path()).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    if _manifest[0] != mtime:
+        with open(_manifest_path()) as file:
+            _manifest = (mtime, json.load(file))
+    return _manifest[1]
+
+
+@contextmanager
+def _manifest_lock():
+    """Exclusive lock across processes on the manifest, held while it is read, updated and written"""
+    with open(os.path.join(artifact_dir(), 'manifest.lock'), 'w') as file:
+        if fcntl is not None:
+            fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def _write(path, data):
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(data)
+    os.replace(tmp_path, path)
+
+
+def build_artifact(name):
+    """Render layer `name`, write its compressed artifacts and record the version; returns the version"""
+    data = render(name).encode()
+    version = hashlib.sha256(data).hexdigest()[:16]
+    os.makedirs(artifact_dir(), exist_ok=True)
+
+    encoded = {'identity': data, 'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encoded['br'] = brotli.compress(data, quality=11)
+
+    # Workers building other layers at the same time must not drop each other's entries, and a
+    # build of the same layer must not clean up these files between their write and the manifest's
+    with _manifest_lock():
+        for encoding, content in encoded.items():
+            _write(artifact_path(name, version, encoding), content)
+        try:
+            with open(_manifest_path()) as file:
+                versions = json.load(file)
+        except FileNotFoundError:
+            versions = {}
+        previous = versions.get(name)
+        versions[name] = version
+        _write(_manifest_path(), json.dumps(versions, indent=2).encode())
+
+        # Older versions of this layer are no longer referenced. The one just replaced is kept,
+        # since another worker may have read the old manifest and be about to open it.
+        keep = {f'{name}.{version}.', f'{name}.{previous}.'}
+        for stale in glob.glob(os.path.join(glob.escape(artifact_dir()), f'{glob.escape(name)}.*.geojson*')):
+            # Temporary files are another build's, still being written
+            if stale.endswith('.tmp') or any(os.path.basename(stale).startswith(prefix) for prefix in keep):
+                continue
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+    return version
+
+
+def artifact_version(name):
+    """Current version of layer `name`, building the artifact if there is none yet"""
+    version = manifest().get(name)
+    if version is None or not os.path.exists(artifact_path(name, version)):
+        version = build_artifact(name)
+    return version
+
+
+def artifact_file(name, version, accept_encoding):
+    """(path, encoding) of the best artifact of layer `name` the client accepts"""
+    accepted = {part.split(';')[0].strip().lower() for part in accept_encoding.split(',')}
+    for encoding in ENCODINGS:
+        path = artifact_path(name, version, encoding)
+        if (encoding == 'identity' or encoding in accepted) and os.path.exists(path):
+            return path, encoding
+    return artifact_path(name, version), 'identity'
+
+
+def url(name):
+    """Versioned URL of layer `name`, safe to cache indefinitely"""
+    return f"{reverse('map_layer', args=[name])}?v={artifact_version(name)}"
@@ -0,0 +1,93 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.conf import settings
+from datetime import datetime, timezone
+import json
+import os
+import tempfile
+
+from maps.benchmarks import fixtures, suite
+
+
+LOCAL_HOSTS = ('', 'localhost', '127.0.0.1', '::1')
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the analysis endpoints against synthetic Kisumu-scale fixtures'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', nargs='+', default=['small', 'medium'], choices=list(fixtures.SCALES),
+                            help='Data scales to benchmark')
+        parser.add_argument('--cases', nargs='+', default=None, choices=[case[0] for case in suite.CASES],
+                            help='Only run these cases')
+        parser.add_argument('--repeat', type=int, default=3, help='Requests per case')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic fixtures')
+        parser.add_argument('--output', type=str, default=os.path.join(settings.BASE_DIR, 'benchmarks', 'results.json'),
+                            help='Where to write the results JSON')
+        parser.add_argument('--baseline', type=str, default=None,
+                            help='Baseline JSON to compare against; regressions make the command fail')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed relative growth in wall time and peak memory')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the benchmark database afterwards')
+        parser.add_argument('--allow-remote', action='store_true',
+                            help='Allow creating the benchmark database on a non-local server')
+
+    def handle(self, *args, **options):
+        db_settings = connection.settings_dict
+        if connection.vendor != 'sqlite' and db_settings.get('HOST') not in LOCAL_HOSTS and not options['allow_remote']:
+            raise CommandError(
+                f'Refusing to create a benchmark database on {db_settings.get("HOST")}. '
+                'Point DATABASE_URL at a local PostGIS or SpatiaLite database, or pass --allow-remote.'
+            )
+
+        cases = [case for case in suite.CASES if not options['cases'] or case[0] in options['cases']]
+        results = {
+            'recorded_at': datetime.now(timezone.utc).isoformat(),
+            'seed': options['seed'],
+            'repeat': options['repeat'],
+            'environment': suite.environment(),
+            'scales': {},
+        }
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            with tempfile.TemporaryDirectory(prefix='healthmapper-bench-') as media_root:
+                with override_settings(MEDIA_ROOT=media_root, MAPS_ARTIFACT_ROOT=media_root, DEBUG=False,
+                                       MAPS_REBUILD_ON_CHANGE=False):
+                    for scale in options['scales']:
+                        self.stdout.write(f'Generating {scale} fixtures...')
+                        summary = fixtures.install(scale, media_root, seed=options['seed'])
+                        self.stdout.write(
+                            f'  {summary["facilities"]} facilities, {summary["wards"]} wards, '
+                            f'raster {summary["raster_shape"][0]}x{summary["raster_shape"][1]}'
+                        )
+
+                        scale_results = []
+                        for name, method, path, body in cases:
+                            result = suite.run_case(name, method, path, body, repeat=options['repeat'])
+                            scale_results.append(result)
+                            self.stdout.write(
+                                f'  {name:<30} {result["status"]}  '
+                                f'median {result["wall_time"]["median"]:.3f}s  '
+                                f'peak {result["peak_memory"] / 1e6:.1f}MB  '
+                                f'{result["queries"]} queries'
+                            )
+                        results['scales'][scale] = {'fixtures': summary, 'cases': scale_results}
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+        os.makedirs(os.path.dirname(os.path.abspath(options['output'])), exist_ok=True)
+        with open(options['output'], 'w') as file:
+            json.dump(results, file, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Wrote benchmark results to {options["output"]}'))
+
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+            regressions = suite.compare(results, baseline, tolerance=options['tolerance'])
+            if regressions:
+                for regression in regressions:
+                    self.stdout.write(self.style.ERROR(regression))
+                raise CommandError(f'{len(regressions)} benchmark regression(s) against {options["baseline"]}')
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
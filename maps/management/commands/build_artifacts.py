@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from maps import artifacts
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the derived artifacts (map layers, coverage layers, footprints) whose inputs changed, '
+            'in dependency order')
+
+    def add_arguments(self, parser):
+        artifact_names = [name for name, node in artifacts.GRAPH.items() if node.is_artifact]
+        parser.add_argument('names', nargs='*',
+                            help=f'Artifacts to build with their dependencies (default: all of {", ".join(artifact_names)})')
+        parser.add_argument('--force', action='store_true', help='Rebuild even if up to date')
+        parser.add_argument('--jobs', type=int, default=None,
+                            help='Artifacts built in parallel (default: MAPS_ARTIFACT_JOBS)')
+        parser.add_argument('--list', action='store_true', help='Only list the artifacts and whether they are stale')
+
+    def handle(self, *args, **options):
+        unknown = [name for name in options['names'] if name not in artifacts.GRAPH]
+        if unknown:
+            raise CommandError(f'Unknown artifacts: {", ".join(unknown)}')
+
+        if options['list']:
+            current = artifacts.keys(artifacts.Inputs(), options['names'] or None)
+            built = artifacts.built_keys()
+            for name, key in current.items():
+                node = artifacts.GRAPH[name]
+                if node.is_artifact:
+                    state = 'fresh' if built.get(name) == key else 'stale'
+                    self.stdout.write(f'{name} {key} {state} <- {", ".join(node.deps)}')
+            return
+
+        report = artifacts.build(options['names'] or None, force=options['force'], jobs=options['jobs'])
+        styles = {'built': self.style.SUCCESS, 'fresh': str, 'failed': self.style.ERROR, 'skipped': self.style.WARNING}
+        for name, (status, seconds) in report.items():
+            timing = f' in {seconds:.2f}s' if status == 'built' else ''
+            self.stdout.write(styles[status](f'{name}: {status}{timing}'))
+        if any(status == 'failed' for status, _ in report.values()):
+            raise CommandError('Some artifacts failed to build')
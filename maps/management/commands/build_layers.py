@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+import os
+
+from maps import layers
+
+
+class Command(BaseCommand):
+    help = 'Build the precompressed, versioned GeoJSON map layer artifacts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help=f'Layers to build (default: all of {", ".join(layers.LAYERS)})')
+
+    def handle(self, *args, **options):
+        unknown = [name for name in options['names'] if name not in layers.LAYERS]
+        if unknown:
+            raise CommandError(f'Unknown layers: {", ".join(unknown)}')
+
+        for name in options['names'] or layers.LAYERS:
+            version = layers.build_artifact(name)
+            sizes = ', '.join(
+                f'{encoding} {os.path.getsize(layers.artifact_path(name, version, encoding)) / 1024:.1f} KiB'
+                for encoding in layers.ENCODINGS
+                if os.path.exists(layers.artifact_path(name, version, encoding))
+            )
+            self.stdout.write(self.style.SUCCESS(f'{name} {version}: {sizes}'))
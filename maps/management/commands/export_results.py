@@ -0,0 +1,58 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from maps import exports
+from maps.models import PopulationDensity
+
+
+class Command(BaseCommand):
+    help = ('Export ward coverage, suitability candidates, facilities or boundaries as CSV, newline-delimited GeoJSON '
+            'or GeoPackage')
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=exports.EXPORTS, help='What to export')
+        parser.add_argument('output', help='File to write ("-" for standard output, except for gpkg)')
+        parser.add_argument('--format', choices=list(exports.FORMATS), default=None,
+                            help='Output format (default: from the output file extension, else csv)')
+        parser.add_argument('--dataset', type=int, default=None, help='Population dataset id (default: the first)')
+        parser.add_argument('--year', type=int, default=None, help='Population dataset year')
+        parser.add_argument('--facility-type', default='Health Centre',
+                            help='Facility type of the suitability candidates')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        output_format = options['format']
+        if output_format is None:
+            extensions = {extension: key for key, (_, extension) in exports.FORMATS.items()}
+            output_format = extensions.get(output.rsplit('.', 1)[-1].lower(), 'csv')
+        if output_format == 'gpkg' and output == '-':
+            raise CommandError('A GeoPackage must be written to a file')
+
+        if options['dataset'] is not None:
+            dataset = PopulationDensity.objects.filter(pk=options['dataset']).first()
+        elif options['year'] is not None:
+            dataset = PopulationDensity.objects.filter(year=options['year']).order_by('-pk').first()
+        else:
+            dataset = PopulationDensity.objects.first()
+        if dataset is None and options['name'] != 'facilities':
+            raise CommandError('No such population dataset')
+
+        export = exports.create(options['name'], dataset, options['facility_type'])
+        if output_format == 'gpkg':
+            count = exports.write_geopackage(export, output)
+            self.stdout.write(self.style.SUCCESS(f'Wrote {count} rows to {output}'))
+            return
+
+        chunks = exports.ndjson_chunks(export) if output_format == 'ndjson' else exports.csv_chunks(export)
+        if output == '-':
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+        size = 0
+        with open(output, 'wb') as file:
+            for chunk in chunks:
+                file.write(chunk)
+                size += len(chunk)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {size} bytes to {output}'))
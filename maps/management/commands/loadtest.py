@@ -0,0 +1,168 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.conf import settings
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from maps.benchmarks import fixtures, load
+from maps.management.commands.benchmark import LOCAL_HOSTS
+
+
+class Command(BaseCommand):
+    help = ('Replay frontend sessions against a running server at ramped concurrency and report latency '
+            'percentiles, throughput and error rates per endpoint')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=None,
+                            help='Server to load (e.g. http://127.0.0.1:8000); without it, gunicorn is started on '
+                                 'synthetic fixtures in a benchmark database')
+        parser.add_argument('--scale', default='small', choices=list(fixtures.SCALES),
+                            help='Fixture scale of the started server')
+        parser.add_argument('--workers', type=int, default=2, help='Gunicorn workers of the started server')
+        parser.add_argument('--threads', type=int, default=None,
+                            help='Analysis threads per worker of the started server (MAPS_ANALYSIS_THREADS)')
+        parser.add_argument('--port', type=int, default=8765, help='Port of the started server')
+        parser.add_argument('--stages', type=int, nargs='+', default=[1, 2, 4, 8],
+                            help='Concurrent virtual users of each stage')
+        parser.add_argument('--stage-seconds', type=float, default=30.0, help='Duration of each stage')
+        parser.add_argument('--think', type=float, default=1.0,
+                            help='Mean think time between a user\'s requests in seconds (0 for none)')
+        parser.add_argument('--timeout', type=float, default=120.0, help='Request timeout in seconds')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the sessions (and fixtures)')
+        parser.add_argument('--output', type=str, default=os.path.join(settings.BASE_DIR, 'benchmarks', 'load.json'),
+                            help='Where to write the results JSON')
+        parser.add_argument('--keepdb', action='store_true', help='Keep the benchmark database afterwards')
+        parser.add_argument('--allow-remote', action='store_true',
+                            help='Allow loading a non-local server, or creating the database on a non-local server')
+
+    def handle(self, *args, **options):
+        if options['url']:
+            host = urlsplit(options['url']).hostname or ''
+            if host not in LOCAL_HOSTS and not options['allow_remote']:
+                raise CommandError(f'Refusing to load {host}; pass --allow-remote to load a non-local server.')
+            results = self.load(options['url'], options)
+        else:
+            results = self.serve_and_load(options)
+
+        results['recorded_at'] = datetime.now(timezone.utc).isoformat()
+        os.makedirs(os.path.dirname(os.path.abspath(options['output'])), exist_ok=True)
+        with open(options['output'], 'w') as file:
+            json.dump(results, file, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Wrote load test results to {options["output"]}'))
+
+    def load(self, url, options):
+        self.stdout.write(f'Loading {url}: stages {options["stages"]} users, {options["stage_seconds"]:.0f}s each')
+        return asyncio.run(load.run(
+            url, options['stages'], stage_seconds=options['stage_seconds'], think=options['think'],
+            seed=options['seed'], timeout=options['timeout'], on_stage=self.report,
+        ))
+
+    def report(self, stage):
+        self.stdout.write(f'{stage["users"]} users, {stage["seconds"]:.1f}s')
+        for endpoint, stats in stage['endpoints'].items():
+            latency = stats['latency']
+            percentiles = '  '.join(
+                f'{name} {value * 1000:8.1f}ms' if value is not None else f'{name}        -  '
+                for name, value in latency.items()
+            )
+            line = (f'  {endpoint:<45} {stats["requests"]:6d} req  {stats["throughput"]:7.2f}/s  {percentiles}  '
+                    f'errors {stats["errors"]}  503 {stats["rejected"]}')
+            self.stdout.write(self.style.ERROR(line) if stats['errors'] else line)
+
+    def serve_and_load(self, options):
+        db_settings = connection.settings_dict
+        if connection.vendor != 'sqlite' and db_settings.get('HOST') not in LOCAL_HOSTS and not options['allow_remote']:
+            raise CommandError(
+                f'Refusing to create a benchmark database on {db_settings.get("HOST")}. '
+                'Point DATABASE_URL at a local PostGIS or SpatiaLite database, or pass --allow-remote.'
+            )
+
+        with tempfile.TemporaryDirectory(prefix='healthmapper-load-') as media_root:
+            if connection.vendor == 'sqlite' and not db_settings['TEST'].get('NAME'):
+                # The server runs in other processes, so the database can't be in memory
+                db_settings['TEST']['NAME'] = os.path.join(media_root, 'load.sqlite3')
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+            try:
+                with override_settings(MEDIA_ROOT=media_root, MAPS_ARTIFACT_ROOT=media_root, DEBUG=False,
+                                       MAPS_REBUILD_ON_CHANGE=False):
+                    self.stdout.write(f'Generating {options["scale"]} fixtures...')
+                    summary = fixtures.install(options['scale'], media_root, seed=options['seed'])
+                    self.stdout.write(
+                        f'  {summary["facilities"]} facilities, {summary["wards"]} wards, '
+                        f'raster {summary["raster_shape"][0]}x{summary["raster_shape"][1]}'
+                    )
+                    # Measure the steady state, not the first requests building the artifacts
+                    call_command('build_artifacts', stdout=self.stdout)
+
+                url = f'http://127.0.0.1:{options["port"]}'
+                server = self.start_server(media_root, options)
+                try:
+                    self.wait_until_ready(server, url)
+                    results = self.load(url, options)
+                finally:
+                    server.send_signal(signal.SIGTERM)
+                    try:
+                        server.wait(timeout=30)
+                    except subprocess.TimeoutExpired:
+                        server.kill()
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+        results['server'] = {'workers': options['workers'], 'threads': options['threads'], 'fixtures': summary}
+        return results
+
+    def database_url(self):
+        db_settings = connection.settings_dict
+        if connection.vendor == 'sqlite':
+            return f'spatialite:///{os.path.abspath(db_settings["NAME"])}'
+        credentials = quote(db_settings['USER'] or '', safe='')
+        if db_settings['PASSWORD']:
+            credentials += ':' + quote(db_settings['PASSWORD'], safe='')
+        host = db_settings['HOST'] or 'localhost'
+        port = f':{db_settings["PORT"]}' if db_settings['PORT'] else ''
+        return f'postgis://{credentials}@{host}{port}/{db_settings["NAME"]}'
+
+    def start_server(self, media_root, options):
+        env = dict(
+            os.environ,
+            DATABASE_URL=self.database_url(),
+            MEDIA_ROOT=media_root,
+            MAPS_ARTIFACT_ROOT=media_root,
+            MAPS_REBUILD_ON_CHANGE='0',
+            PROMETHEUS_MULTIPROC_DIR=os.path.join(media_root, 'metrics'),
+        )
+        if options['threads']:
+            env['MAPS_ANALYSIS_THREADS'] = str(options['threads'])
+        command = [
+            sys.executable, '-m', 'gunicorn',
+            '--config', os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'),
+            '--bind', f'127.0.0.1:{options["port"]}',
+            '--workers', str(options['workers']),
+            '--timeout', '120',
+            'HealthMapper.asgi:application',
+        ]
+        self.stdout.write(f'Starting gunicorn with {options["workers"]} workers on port {options["port"]}')
+        return subprocess.Popen(command, cwd=settings.BASE_DIR, env=env)
+
+    def wait_until_ready(self, server, url, timeout=120):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'The server exited with status {server.returncode}')
+            try:
+                with urllib.request.urlopen(f'{url}/maps/api/snapshots/', timeout=5):
+                    return
+            except OSError:
+                time.sleep(0.5)
+        raise CommandError(f'The server did not start within {timeout}s')
@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from maps import spatial_sql
+from maps.models import HealthCareFacility, KenyaConstituency, KenyaCounty, KenyaWard
+
+
+# (model, index name, CREATE INDEX body, fragment of pg_indexes.indexdef an equivalent index has)
+INDEXES = [
+    (KenyaCounty, 'kenya_counties_geom_gist', 'USING gist (geom)', 'USING gist (geom)'),
+    (KenyaCounty, 'kenya_counties_county_upper', '(UPPER(county))', 'USING btree (upper((county)::text))'),
+    (KenyaConstituency, 'kenya_constituencies_geom_gist', 'USING gist (geom)', 'USING gist (geom)'),
+    (KenyaConstituency, 'kenya_constituencies_county_nam_upper', '(UPPER(county_nam))',
+     'USING btree (upper((county_nam)::text))'),
+    (KenyaWard, 'kenya_wards_geom_gist', 'USING gist (geom)', 'USING gist (geom)'),
+    (KenyaWard, 'kenya_wards_county_upper', '(UPPER(county))', 'USING btree (upper((county)::text))'),
+    (HealthCareFacility, 'maps_healthcarefacility_location_gist', 'USING gist (location)', 'USING gist (location)'),
+    (HealthCareFacility, 'maps_healthcarefacility_facility_type', '(facility_type)', 'USING btree (facility_type)'),
+]
+
+# Companion table of the wards, which no query reads any more
+OBSOLETE_TABLES = ['kenya_wards_subdivided']
+
+
+class Command(BaseCommand):
+    help = ('Create the missing spatial and attribute indexes on the Kenya boundary and facility tables, '
+            'and build the ST_Subdivide companion table of the counties')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only report what is missing or stale')
+        parser.add_argument('--rebuild', action='store_true', help='Rebuild the subdivided table even if current')
+        parser.add_argument('--max-vertices', type=int, default=spatial_sql.PARTS_MAX_VERTICES,
+                            help='Maximum vertices per subdivided part (ST_Subdivide)')
+        parser.add_argument('--database', default='default', help='Database alias')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'postgresql':
+            raise CommandError('Spatial index provisioning needs a PostGIS database')
+
+        with connection.cursor() as cursor:
+            self.provision_indexes(cursor, options['check'])
+            if not options['check']:
+                for table in OBSOLETE_TABLES:
+                    cursor.execute(f'DROP TABLE IF EXISTS {table}')
+        self.provision_subdivided(connection, options)
+
+    def provision_indexes(self, cursor, check):
+        analyze = set()
+        for model, name, body, definition in INDEXES:
+            table = model._meta.db_table
+            cursor.execute(
+                'SELECT indexname FROM pg_indexes WHERE tablename = %s AND (indexname = %s OR indexdef LIKE %s)',
+                [table, name, f'%{definition}%'],
+            )
+            existing = cursor.fetchone()
+            if existing:
+                self.stdout.write(f'{table}: {definition} exists ({existing[0]})')
+            elif check:
+                self.stdout.write(self.style.WARNING(f'{table}: {definition} is missing'))
+            else:
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} {body}')
+                analyze.add(table)
+                self.stdout.write(self.style.SUCCESS(f'{table}: created {name}'))
+
+        # Fresh statistics so the planner uses the new indexes
+        for table in sorted(analyze):
+            cursor.execute(f'ANALYZE {table}')
+
+    def provision_subdivided(self, connection, options):
+        table = spatial_sql.COUNTY_PARTS_TABLE
+        status = spatial_sql.parts_status(options['max_vertices'], connection.alias)
+        if status == 'current' and not options['rebuild']:
+            self.stdout.write(f'{table}: up to date')
+            return
+        if options['check']:
+            self.stdout.write(self.style.WARNING(f'{table}: {status}'))
+            return
+
+        parts, features = spatial_sql.build_parts(options['max_vertices'], connection.alias)
+        self.stdout.write(self.style.SUCCESS(f'{table}: {parts} parts from {features} features'))
@@ -0,0 +1,130 @@
+"""Prometheus metrics for the map views.
+
+Under gunicorn, ``PROMETHEUS_MULTIPROC_DIR`` is set by gunicorn.conf.py so each
+worker writes its samples to files in that directory and ``metrics_view``
+aggregates them across workers. Without it (runserver, management commands)
+the default in-process registry is used.
+"""
+import os
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+
+# Long analyses run up to the 120s gunicorn timeout, so the buckets go that far
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, float('inf'))
+SIZE_BUCKETS = tuple(2 ** power for power in range(10, 27, 2)) + (float('inf'),)  # 1 KB .. 64 MB
+
+REQUEST_LATENCY = Histogram(
+    'healthmapper_request_duration_seconds', 'Request latency by view',
+    ['view', 'method'], buckets=LATENCY_BUCKETS,
+)
+RESPONSE_SIZE = Histogram(
+    'healthmapper_response_size_bytes', 'Response body size by view',
+    ['view'], buckets=SIZE_BUCKETS,
+)
+REQUESTS = Counter(
+    'healthmapper_requests', 'Requests by view and status',
+    ['view', 'method', 'status'],
+)
+IN_PROGRESS = Gauge(
+    'healthmapper_requests_in_progress', 'Requests currently being handled',
+    ['view'], multiprocess_mode='livesum',
+)
+RASTER_READ_BYTES = Counter(
+    'healthmapper_raster_read_bytes', 'Bytes of raster data read',
+    ['operation'],
+)
+CACHE_REQUESTS = Counter(
+    'healthmapper_cache_requests', 'Cache lookups by cache and result',
+    ['cache', 'result'],
+)
+ADMISSIONS = Counter(
+    'healthmapper_analysis_admissions', 'Heavy analysis requests by view and admission result',
+    ['view', 'result'],
+)
+
+
+def record_raster_read(array, operation):
+    """Count the bytes of a raster array that was read or masked"""
+    RASTER_READ_BYTES.labels(operation).inc(array.nbytes)
+
+
+def record_cache(cache, hit):
+    """Count a hit or miss of one of the app's caches"""
+    CACHE_REQUESTS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def record_admission(view, result):
+    """Count a heavy request admitted to a slot, rejected with 503 or coalesced into one in flight"""
+    ADMISSIONS.labels(view, result).inc()
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match and match.view_name else 'unmatched'
+
+
+class MetricsMiddleware:
+    """Record latency, response size and in-flight requests per view"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            self.finish_in_progress(request)
+        self.observe(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.finish_in_progress(request)
+        self.observe(request, response, time.perf_counter() - started)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # The view name is only known once the URL has been resolved
+        request._metrics_view = view_label(request)
+        IN_PROGRESS.labels(request._metrics_view).inc()
+
+    def finish_in_progress(self, request):
+        view = getattr(request, '_metrics_view', None)
+        if view is not None:
+            IN_PROGRESS.labels(view).dec()
+
+    def observe(self, request, response, elapsed):
+        view = view_label(request)
+        REQUEST_LATENCY.labels(view, request.method).observe(elapsed)
+        REQUESTS.labels(view, request.method, str(response.status_code)).inc()
+        if not response.streaming:
+            RESPONSE_SIZE.labels(view).observe(len(response.content))
+        elif response.has_header('Content-Length'):
+            RESPONSE_SIZE.labels(view).observe(int(response['Content-Length']))
+
+
+def metrics_view(request):
+    """Expose all metrics in the Prometheus text format"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
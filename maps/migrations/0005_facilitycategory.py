@@ -0,0 +1,83 @@
+# Generated by Django 4.2.19 on 2026-10-19 17:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Policy of each facility type, merged from the hard-coded tables of the views: the service radius of
+# the merged service areas, and the expected population and spacing of the site suitability analysis
+CATEGORIES = [
+    # name, is_served_type, service_radius_km, expected_population, min_spacing_km
+    ('District Hospital', True, 10.0, 300000, 8.0),
+    ('Provincial General Hospital', True, 15.0, 800000, 10.0),
+    ('Medical Clinic', True, 5.0, 7500, 3.0),
+    ('Other Hospital', True, 5.0, 5000, 5.0),
+    ('Sub-District Hospital', True, 6.0, 100000, 6.0),
+    ('Health Centre', True, 3.0, 10000, 3.0),
+    # Left out of the coverage analyses, as in the map layers
+    ('Dispensary', False, 5.0, 30000, 7.0),
+    ('Pharmacy', False, 5.0, 30000, 7.0),
+    ('VCT Centre (Stand-Alone)', False, 5.0, 30000, 7.0),
+    ('Laboratory (Stand-alone)', False, 5.0, 30000, 7.0),
+    ('Nursing Home', False, 5.0, 30000, 7.0),
+    ('Health Programme', False, 5.0, 30000, 7.0),
+]
+
+ALIASES = {
+    'Povincial General Hospital': 'Provincial General Hospital',
+    'Health Center': 'Health Centre',
+}
+
+
+def seed_categories(apps, schema_editor):
+    FacilityCategory = apps.get_model('maps', 'FacilityCategory')
+    HealthCareFacility = apps.get_model('maps', 'HealthCareFacility')
+
+    for name, is_served_type, service_radius_km, expected_population, min_spacing_km in CATEGORIES:
+        FacilityCategory.objects.update_or_create(name=name, defaults={
+            'is_served_type': is_served_type,
+            'service_radius_km': service_radius_km,
+            'expected_population': expected_population,
+            'min_spacing_km': min_spacing_km,
+        })
+
+    # Normalize the facility types, then link every facility to its category (other types get the defaults)
+    for facility_type in HealthCareFacility.objects.exclude(facility_type=None).values_list('facility_type', flat=True).distinct():
+        normalized = ' '.join(facility_type.split())
+        normalized = ALIASES.get(normalized, normalized) or None
+        if normalized != facility_type:
+            HealthCareFacility.objects.filter(facility_type=facility_type).update(facility_type=normalized)
+    for facility_type in HealthCareFacility.objects.exclude(facility_type=None).values_list('facility_type', flat=True).distinct():
+        category, _ = FacilityCategory.objects.get_or_create(name=facility_type)
+        HealthCareFacility.objects.filter(facility_type=facility_type).update(category=category)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maps', '0004_populationdensity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacilityCategory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('is_served_type', models.BooleanField(db_index=True, default=True)),
+                ('service_radius_km', models.FloatField(default=5.0)),
+                ('expected_population', models.IntegerField(default=30000)),
+                ('min_spacing_km', models.FloatField(default=7.0)),
+            ],
+            options={
+                'verbose_name_plural': 'Facility categories',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='healthcarefacility',
+            name='category',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='facilities', to='maps.facilitycategory'),
+        ),
+        migrations.RunPython(seed_categories, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.19 on 2026-10-19 18:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maps', '0005_facilitycategory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='healthcarefacility',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -1,15 +1,66 @@
 from django.contrib.gis.db import models
 from django.contrib.gis.geos import Point
 
-# Create your models here.
+# Misspellings of facility types found in the data and the old policy tables, and the canonical names
+FACILITY_TYPE_ALIASES = {
+    'Povincial General Hospital': 'Provincial General Hospital',
+    'Health Center': 'Health Centre',
+}
+
+
+def normalize_facility_type(facility_type):
+    """Canonical name of a facility type: whitespace collapsed and known misspellings corrected"""
+    if facility_type is None:
+        return None
+    facility_type = ' '.join(facility_type.split())
+    return FACILITY_TYPE_ALIASES.get(facility_type, facility_type) or None
+
+
+class FacilityCategory(models.Model):
+    """A facility type and its service policy"""
+    name = models.CharField(max_length=100, unique=True) # Canonical facility type, e.g. Health Centre
+    is_served_type = models.BooleanField(default=True, db_index=True) # Counted in coverage analyses (not pharmacies, labs...)
+    service_radius_km = models.FloatField(default=5.0) # Radius of the service area of a facility
+    expected_population = models.IntegerField(default=30000) # Population a new facility should serve (site suitability)
+    min_spacing_km = models.FloatField(default=7.0) # Minimum distance between recommended new sites
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        ordering = ['name']
+        verbose_name_plural = "Facility categories"
+
+
+class HealthCareFacilityQuerySet(models.QuerySet):
+    def served(self):
+        """Facilities counted in coverage analyses: of a served category, or of no known category
+
+        Ordered by primary key: the coverage, density and distance caches hash
+        the facilities in list order, and every caller must get the same key.
+        """
+        return self.filter(models.Q(category__isnull=True) | models.Q(category__is_served_type=True)).order_by('pk')
+
+
 class HealthCareFacility(models.Model):
     name = models.CharField(max_length=100) # Name of the facility
     facility_type = models.CharField(max_length=100, blank=True, null=True) # Type of facility e.g. Hospital, Clinic
+    category = models.ForeignKey(FacilityCategory, on_delete=models.SET_NULL, blank=True, null=True,
+                                 related_name='facilities') # Set from facility_type on save
     location = models.PointField(srid=4326) # GeoDjango PointField
     capacity = models.IntegerField(blank=True, null=True) # Number of patients the facility can hold
+    updated = models.DateTimeField(auto_now=True) # Last save; with the count, what nearest.version checks
+
+    objects = HealthCareFacilityQuerySet.as_manager()
 
     def __str__(self):
         return self.name
+
+    def save(self, *args, **kwargs):
+        self.facility_type = normalize_facility_type(self.facility_type)
+        if self.category is None or self.category.name != self.facility_type:
+            self.category = FacilityCategory.objects.filter(name=self.facility_type).first() if self.facility_type else None
+        super().save(*args, **kwargs)
     
     def latitude(self):
         return self.location.y if self.location else None
@@ -57,6 +108,16 @@ class KenyaConstituency(models.Model):
         return self.const_name
 
 
+class KenyaWardQuerySet(models.QuerySet):
+    def in_county(self, county):
+        """Wards of a county, ordered by primary key
+
+        Coverage layers and distance surfaces number the wards by list position
+        and hash them in list order, so every caller must list them the same way.
+        """
+        return self.filter(county__iexact=county).order_by('pk')
+
+
 class KenyaWard(models.Model):
     # map existing kenya_wards table
 
@@ -73,6 +134,8 @@ class KenyaWard(models.Model):
     pop2009 = models.IntegerField()
     pop2019 = models.IntegerField(null=True, blank=True)
 
+    objects = KenyaWardQuerySet.as_manager()
+
     def __str__(self):
         return self.ward
 
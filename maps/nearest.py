@@ -0,0 +1,95 @@
+"""Nearest-facility queries over a KD-tree of the facilities.
+
+The facilities are projected to UTM 36S and put in a ``scipy.spatial.cKDTree``,
+one for all of them and one per facility type. A query projects its points
+the same way and asks the tree for the k nearest in one vectorized call, so
+ten thousand points cost about as much as a few::
+
+    index = nearest.get()
+    distances_m, positions = index.query(lons, lats, k=3, facility_type='Health Centre')
+    index.facilities[positions[0, 0]]
+
+Distances are straight-line metres in UTM. The index of the served facilities
+is kept per process. A request checks it with one aggregate query (their
+count, last id and last update) and the category policy version, and it is
+rebuilt from the facilities only when those change.
+"""
+import hashlib
+import threading
+
+import numpy as np
+from django.db.models import Count, Max
+
+from . import categories, geometry
+from .metrics import record_cache
+from .models import HealthCareFacility
+
+
+# The index loaded in this process: (version, index)
+_loaded = (None, None)
+_lock = threading.Lock()
+
+
+def version():
+    """Hash of the served facilities' count, last id and last update, and of the category policy
+
+    Any save changes the last update, and a deletion the count (or the last
+    id, if a facility was added too); ``QuerySet.update()`` skips ``updated``.
+    """
+    stats = HealthCareFacility.objects.served().order_by().aggregate(
+        count=Count('pk'), last_pk=Max('pk'), updated=Max('updated'))
+    digest = hashlib.sha1(f'{stats["count"]}:{stats["last_pk"]}:{stats["updated"]}:'
+                          f'{categories.policy().version}'.encode())
+    return digest.hexdigest()[:16]
+
+
+class FacilityIndex:
+    """KD-trees of the facilities' UTM coordinates, of all of them and of each type"""
+
+    def __init__(self, facilities, version):
+        from scipy.spatial import cKDTree
+
+        self.facilities = facilities
+        self.version = version
+        self.ids = np.array([facility.pk for facility in facilities], dtype='int64')
+        x, y = geometry.utm_coordinates(*geometry.coordinates(facilities))
+        types = np.array([facility.facility_type or '' for facility in facilities], dtype=object)
+        # {type (None for all): (tree, positions of its facilities in self.facilities)}
+        self.trees = {}
+        for facility_type in [None] + sorted(set(types) - {''}):
+            positions = np.arange(len(facilities)) if facility_type is None else np.flatnonzero(types == facility_type)
+            self.trees[facility_type] = (cKDTree(np.column_stack([x[positions], y[positions]])), positions)
+
+    @property
+    def types(self):
+        return [facility_type for facility_type in self.trees if facility_type is not None]
+
+    def query(self, lons, lats, k=1, facility_type=None):
+        """(distances in metres, positions in `facilities`) of the k nearest facilities to each point, nearest first
+
+        Both arrays are (points, k'), where k' is k or the number of facilities
+        of the type if fewer. KeyError for a type without facilities.
+        """
+        tree, positions = self.trees[facility_type or None]
+        k = min(k, len(positions))
+        if k == 0 or not len(lons):
+            return np.zeros((len(lons), 0)), np.zeros((len(lons), 0), dtype='int64')
+        x, y = geometry.utm_coordinates(lons, lats)
+        distances, indices = tree.query(np.column_stack([x, y]), k=k)
+        return distances.reshape(len(lons), k), positions[indices.reshape(len(lons), k)]
+
+
+def get():
+    """The index of the served facilities, from this process's cache or freshly built"""
+    global _loaded
+    current = version()
+    cached_version, index = _loaded
+    record_cache('nearest', cached_version == current)
+    if cached_version == current:
+        return index
+    with _lock:
+        cached_version, index = _loaded
+        if cached_version != current:
+            index = FacilityIndex(list(HealthCareFacility.objects.served()), current)
+            _loaded = (current, index)
+    return index
@@ -0,0 +1,221 @@
+"""Run blocking analysis views off the event loop.
+
+Under ASGI a plain sync view runs on the one thread Django shares between all
+sync code, so a long analysis would hold up every other sync request in the
+worker. Views doing raster, GEOS or bulk database work are wrapped in
+``offload`` instead: the whole view runs on a bounded pool of analysis
+threads, and requests beyond the pool size wait in its queue without blocking
+the event loop or the cheap views::
+
+    @offload
+    @csrf_exempt
+    def site_suitability_analysis(request):
+        ...
+
+The caller's context variables (the request's phase timings) are copied into
+the pool thread, and the database connections the view opened there are
+closed when it returns, as Django does at the end of a sync request. Under
+WSGI the wrapped views behave as before, just through ``async_to_sync``.
+
+``iterate`` likewise advances a blocking iterator, such as the rows of a
+streamed export, on the pool.
+
+The cheap, fanned-out map calls (population density of a tile or an area)
+use ``offload_map`` instead: they run on a separate pool of map threads
+(MAPS_MAP_THREADS), so they don't queue behind the analyses, and they are
+neither admission-controlled nor coalesced.
+
+Offloaded views are also admission-controlled and coalesced (see
+``admission``): a view waits for an analysis slot before it runs, or gets a
+503 with Retry-After once the process's queue is full, and a request
+identical to one in flight (same view, path, query, body and If-None-Match)
+shares its response. Responses that set cookies or carry a CSRF token belong
+to their request and aren't shared; views can instead return a plain value,
+such as a template context, which is always shared. A streamed response
+keeps its slot until its content has been sent or the client went away, since
+the rows of an export are computed as they are sent.
+"""
+import asyncio
+import contextvars
+import functools
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.http import HttpResponse, HttpResponseBase, JsonResponse
+
+from . import admission
+from .instrumentation import record
+from .metrics import record_admission, view_label
+
+
+# {pool name: thread pool}
+_executors = {}
+_executor_lock = threading.Lock()
+# {pool name: (setting of its size, default size)}
+POOLS = {
+    'analysis': ('MAPS_ANALYSIS_THREADS', 4),
+    'map': ('MAPS_MAP_THREADS', 8),
+}
+
+
+def executor(pool='analysis'):
+    """The process-wide thread pool `pool`: analysis (MAPS_ANALYSIS_THREADS threads) or map (MAPS_MAP_THREADS)"""
+    if pool not in _executors:
+        with _executor_lock:
+            if pool not in _executors:
+                setting, default = POOLS[pool]
+                _executors[pool] = ThreadPoolExecutor(
+                    max_workers=getattr(settings, setting, default),
+                    thread_name_prefix=f'maps-{pool}',
+                )
+    return _executors[pool]
+
+
+def _run_with_connections(func, args, kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # Pool threads outlive the request, so their connections must not
+        connections.close_all()
+
+
+async def _run_on(pool, func, args, kwargs):
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, _run_with_connections, func, args, kwargs)
+    return await asyncio.get_running_loop().run_in_executor(executor(pool), call)
+
+
+async def run(func, *args, **kwargs):
+    """Await `func(*args, **kwargs)` run on the analysis pool, in a copy of the current context"""
+    return await _run_on('analysis', func, args, kwargs)
+
+
+async def iterate(iterable):
+    """Async iterator over a blocking iterable, each item produced on the analysis pool
+
+    Under ASGI Django reads a streaming response with a sync iterator into a
+    list before sending any of it; this keeps a large export streaming.
+    """
+    iterator = iter(iterable)
+    done = object()
+    while (item := await run(next, iterator, done)) is not done:
+        yield item
+
+
+def request_key(view, request, args, kwargs):
+    """What makes two calls of `view` interchangeable: the request's path, query, body and validators"""
+    body = hashlib.sha1(request.body).hexdigest() if request.body else ''
+    return (view.__module__, view.__qualname__, request.method, request.get_full_path(), body,
+            request.headers.get('If-None-Match', ''), args, tuple(sorted(kwargs.items())))
+
+
+def _shareable(request, result):
+    if not isinstance(result, HttpResponseBase):
+        return True
+    return not result.streaming and not result.cookies and not request.META.get('CSRF_COOKIE_NEEDS_UPDATE')
+
+
+def _copy(result):
+    """A response of its own for a coalesced request (middleware sets headers on it)"""
+    if not isinstance(result, HttpResponseBase):
+        return result
+    response = HttpResponse(result.content, status=result.status_code, reason=result.reason_phrase)
+    for header, value in result.items():
+        response[header] = value
+    return response
+
+
+def saturated_response(error):
+    response = JsonResponse({'error': str(error), 'retry_after': error.retry_after}, status=503)
+    response['Retry-After'] = str(error.retry_after)
+    return response
+
+
+class _HeldSlot:
+    """Streaming content that holds an analysis slot until it's exhausted or closed
+
+    Django calls ``close`` when the response is closed, which it is also when
+    the client disconnects mid-stream.
+    """
+    def __init__(self, content, token):
+        self.content = content
+        self.token = token
+        self.lock = threading.Lock()
+
+    def close(self):
+        with self.lock:
+            token, self.token = self.token, None
+        if token is not None:
+            admission.slots.release(token)
+
+
+class _HeldSlotIterator(_HeldSlot):
+    def __iter__(self):
+        try:
+            yield from self.content
+        finally:
+            self.close()
+
+
+class _HeldSlotAsyncIterator(_HeldSlot):
+    async def __aiter__(self):
+        try:
+            async for chunk in self.content:
+                yield chunk
+        finally:
+            self.close()
+
+
+async def _admitted_run(view, request, args, kwargs):
+    label = view_label(request)
+    try:
+        token = await admission.acquire()
+    except admission.Saturated as e:
+        record_admission(label, 'rejected')
+        return saturated_response(e)
+    record_admission(label, 'admitted')
+    try:
+        result = await run(view, request, *args, **kwargs)
+    except BaseException:
+        admission.slots.release(token)
+        raise
+    if isinstance(result, HttpResponseBase) and result.streaming:
+        held = _HeldSlotAsyncIterator if result.is_async else _HeldSlotIterator
+        result.streaming_content = held(result.streaming_content, token)
+    else:
+        admission.slots.release(token)
+    return result
+
+
+def offload(view):
+    """Turn a blocking view into an async one that runs on the analysis pool, admission-controlled and coalesced"""
+    @functools.wraps(view)
+    async def offloaded_view(request, *args, **kwargs):
+        async def compute():
+            result = await _admitted_run(view, request, args, kwargs)
+            return result, _shareable(request, result)
+
+        started = time.perf_counter()
+        (result, shareable), shared = await admission.single_flight(request_key(view, request, args, kwargs), compute)
+        if not shared:
+            return result
+        record('coalesced', time.perf_counter() - started)
+        if not shareable:
+            # The leader's response was its own; compute this request's
+            return await _admitted_run(view, request, args, kwargs)
+        record_admission(view_label(request), 'coalesced')
+        return _copy(result)
+    return offloaded_view
+
+
+def offload_map(view):
+    """Turn a cheap blocking view into an async one that runs on the map pool, without admission or coalescing"""
+    @functools.wraps(view)
+    async def offloaded_view(request, *args, **kwargs):
+        return await _run_on('map', view, (request, *args), kwargs)
+    return offloaded_view
@@ -0,0 +1,297 @@
+"""Persons-per-pixel grid derived from the population density raster.
+
+The density GeoTIFF is in EPSG:4326 and holds persons per km², so the
+population of a pixel is its density times its area, and a pixel's area
+shrinks with the cosine of its latitude. The grid is derived once per raster
+file: every pixel's population count, and the area of a pixel in each row
+measured on the ellipsoid (all pixels of a row have the same area), plus the
+summed-area table (integral image) of the counts. They are saved next to the
+raster as ``.npy`` files and memory-mapped, so every worker shares the pages::
+
+    grid = population.get(dataset.raster_file.path)
+    zone = grid.zonal(service_area)
+    zone['population'], zone['area_km2']
+    grid.bbox((west, south, east, north))['population']
+
+The population inside any mask or window is then a plain sum of counts, with
+no reprojection per query, and every endpoint gets the same figure for the
+same area. The total of an axis-aligned box is four lookups in the summed-area
+table, whatever its size, and ``bbox_totals`` answers thousands of boxes in
+one vectorized call.
+"""
+import glob
+import hashlib
+import logging
+import os
+import threading
+from functools import cached_property
+
+import numpy as np
+import shapely
+from affine import Affine
+
+from . import geometry
+from .metrics import record_cache, record_raster_read
+
+
+logger = logging.getLogger(__name__)
+
+# Pixels per side of the blocks of the density range-maximum table
+MAX_BLOCK = 16
+
+# Grids loaded in this process: {raster path: (version, grid)}
+_loaded = {}
+_lock = threading.Lock()
+
+
+def pixel_areas_km2(transform, height):
+    """Area in km² of one pixel in each row of a north-up WGS84 raster"""
+    tops = transform.f + np.arange(height) * transform.e
+    rows = shapely.box(transform.c, tops + transform.e, transform.c + transform.a, tops)
+    return geometry.areas_km2(rows)
+
+
+def window(transform, shape, bounds):
+    """(row slice, column slice) of the pixels of a north-up grid overlapping (west, south, east, north)"""
+    west, south, east, north = bounds
+    height, width = shape
+    inverse = ~transform
+    col_start, row_start = inverse * (west, north)
+    col_stop, row_stop = inverse * (east, south)
+    rows = slice(max(int(np.floor(row_start)), 0), min(int(np.ceil(row_stop)), height))
+    cols = slice(max(int(np.floor(col_start)), 0), min(int(np.ceil(col_stop)), width))
+    return rows, cols
+
+
+def version(raster_path):
+    """Cache key of the grid derived from this raster file"""
+    stat = os.stat(raster_path)
+    return hashlib.sha1(f'{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()[:16]
+
+
+def cache_paths(raster_path, version):
+    """(population counts, row pixel areas, summed-area table) files of the grid"""
+    return (f'{raster_path}.population-{version}.npy', f'{raster_path}.pixel-area-{version}.npy',
+            f'{raster_path}.population-sat-{version}.npy')
+
+
+def summed_area_table(counts):
+    """Integral image of `counts` with a zero first row and column: sat[r, c] is the sum of counts[:r, :c]"""
+    sat = np.zeros((counts.shape[0] + 1, counts.shape[1] + 1), dtype='float64')
+    np.cumsum(counts, axis=0, dtype='float64', out=sat[1:, 1:])
+    np.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+    return sat
+
+
+class PopulationGrid:
+    """Population per pixel and pixel area per row, on the grid of the density raster"""
+
+    def __init__(self, counts, row_area_km2, sat, transform):
+        self.counts = counts
+        self.row_area_km2 = row_area_km2
+        self.sat = sat
+        self.transform = transform
+        # Area of rows [0, r) of one pixel column, for the area of a box
+        self.row_area_cumsum = np.concatenate([[0.0], np.cumsum(row_area_km2)])
+
+    @property
+    def shape(self):
+        return self.counts.shape
+
+    @property
+    def total(self):
+        return float(self.counts.sum(dtype='float64'))
+
+    def density(self, rows=slice(None)):
+        """Persons per km² of the rows `rows`, as in the source raster (nodata as 0)"""
+        return self.counts[rows] / self.row_area_km2[rows, None]
+
+    def window(self, bounds):
+        """(row slice, column slice) of the pixels overlapping (west, south, east, north), clipped to the grid"""
+        return window(self.transform, self.shape, bounds)
+
+    def centre_windows(self, bounds):
+        """(row start, row stop, col start, col stop) arrays of the pixels whose centres lie in each box
+
+        `bounds` is an (N, 4) array of (west, south, east, north) boxes.
+        """
+        west, south, east, north = np.asarray(bounds, dtype='float64').reshape(-1, 4).T
+        transform = self.transform
+        height, width = self.shape
+
+        def index(values, origin, size, limit):
+            # First pixel whose centre is at or past `values` along the axis
+            return np.clip(np.ceil((values - origin) / size - 0.5), 0, limit).astype('int64')
+
+        row_start = index(north, transform.f, transform.e, height)
+        row_stop = np.maximum(index(south, transform.f, transform.e, height), row_start)
+        col_start = index(west, transform.c, transform.a, width)
+        col_stop = np.maximum(index(east, transform.c, transform.a, width), col_start)
+        return row_start, row_stop, col_start, col_stop
+
+    def bbox_totals(self, bounds):
+        """Population and pixel area of each (west, south, east, north) box, from the summed-area table
+
+        Returns (population, area_km2) arrays with one value per box.
+        """
+        row_start, row_stop, col_start, col_stop = self.centre_windows(bounds)
+        sat = self.sat
+        population = (sat[row_stop, col_stop] - sat[row_start, col_stop]
+                      - sat[row_stop, col_start] + sat[row_start, col_start])
+        area = (self.row_area_cumsum[row_stop] - self.row_area_cumsum[row_start]) * (col_stop - col_start)
+        return population, area
+
+    def bbox(self, bounds):
+        """Population, area and pixel count of the pixels whose centres lie in (west, south, east, north)"""
+        row_start, row_stop, col_start, col_stop = (int(value[0]) for value in self.centre_windows([bounds]))
+        population, area = self.bbox_totals([bounds])
+        # The box snapped to the edges of the pixels it selects
+        west, north = self.transform * (col_start, row_start)
+        east, south = self.transform * (col_stop, row_stop)
+        return {
+            'population': float(population[0]),
+            'area_km2': float(area[0]),
+            'pixels': (row_stop - row_start) * (col_stop - col_start),
+            'bounds': [west, south, east, north],
+        }
+
+    @cached_property
+    def _max_table(self):
+        """{(i, j): maximum density over every run of 2**i x 2**j blocks of MAX_BLOCK pixels}"""
+        height, width = self.shape
+        block_rows, block_cols = -(-height // MAX_BLOCK), -(-width // MAX_BLOCK)
+        padded = np.zeros((block_rows * MAX_BLOCK, block_cols * MAX_BLOCK), dtype='float64')
+        padded[:height, :width] = self.density()
+        table = {(0, 0): padded.reshape(block_rows, MAX_BLOCK, block_cols, MAX_BLOCK).max(axis=(1, 3))}
+        for i in range(block_rows.bit_length()):
+            if i:
+                previous, half = table[(i - 1, 0)], 1 << (i - 1)
+                table[(i, 0)] = np.maximum(previous[:-half], previous[half:])
+            for j in range(1, block_cols.bit_length()):
+                previous, half = table[(i, j - 1)], 1 << (j - 1)
+                table[(i, j)] = np.maximum(previous[:, :-half], previous[:, half:])
+        return table
+
+    def max_density_bound(self, bounds):
+        """Upper bound of the density of the pixels whose centres lie in each (west, south, east, north) box
+
+        The maximum over the MAX_BLOCK-pixel blocks the box overlaps, from a
+        sparse table: four lookups per box.
+        """
+        row_start, row_stop, col_start, col_stop = self.centre_windows(bounds)
+        empty = (row_stop == row_start) | (col_stop == col_start)
+        block_row_start, block_col_start = row_start // MAX_BLOCK, col_start // MAX_BLOCK
+        block_row_stop = np.maximum(-(-row_stop // MAX_BLOCK), block_row_start + 1)
+        block_col_stop = np.maximum(-(-col_stop // MAX_BLOCK), block_col_start + 1)
+        row_level = np.log2(block_row_stop - block_row_start).astype('int64')
+        col_level = np.log2(block_col_stop - block_col_start).astype('int64')
+
+        result = np.zeros(len(row_start), dtype='float64')
+        for i, j in set(zip(row_level.tolist(), col_level.tolist())):
+            table = self._max_table[(i, j)]
+            selected = (row_level == i) & (col_level == j)
+            top, left = block_row_start[selected], block_col_start[selected]
+            bottom, right = block_row_stop[selected] - (1 << i), block_col_stop[selected] - (1 << j)
+            result[selected] = np.maximum.reduce([table[top, left], table[bottom, left],
+                                                  table[top, right], table[bottom, right]])
+        result[empty] = 0
+        return result
+
+    def zonal(self, geom):
+        """Population, pixel area and densities of the populated pixels inside `geom`
+
+        A pixel counts if its centre is inside; a geometry smaller than a pixel
+        takes the pixels it touches instead.
+        """
+        from rasterio import features
+
+        rows, cols = self.window(geom.bounds)
+        counts = self.counts[rows, cols]
+        if counts.size == 0:
+            return {'population': 0.0, 'area_km2': 0.0, 'density': np.empty(0, dtype='float64'), 'pixels': 0}
+        transform = self.transform * Affine.translation(cols.start, rows.start)
+        inside = features.geometry_mask([geom], counts.shape, transform, invert=True)
+        if not inside.any():
+            inside = features.geometry_mask([geom], counts.shape, transform, invert=True, all_touched=True)
+        record_raster_read(counts, 'population')
+
+        area = np.broadcast_to(self.row_area_km2[rows, None], counts.shape)[inside]
+        counts = counts[inside]
+        populated = counts > 0
+        return {
+            'population': float(counts.sum(dtype='float64')),
+            'area_km2': float(area.sum()),
+            'density': counts[populated] / area[populated],
+            'pixels': int(inside.sum()),
+        }
+
+    @classmethod
+    def load(cls, raster_path, version):
+        import rasterio
+
+        counts_path, area_path, sat_path = cache_paths(raster_path, version)
+        with rasterio.open(raster_path) as src:
+            transform = src.transform
+        return cls(np.load(counts_path, mmap_mode='r'), np.load(area_path), np.load(sat_path, mmap_mode='r'), transform)
+
+    def save(self, raster_path, version):
+        arrays = (self.counts, self.row_area_km2, self.sat)
+        for path, array in zip(cache_paths(raster_path, version), arrays):
+            # Write under a temporary name so concurrent readers never see a partial file
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as file:
+                np.save(file, array)
+            os.replace(tmp_path, path)
+
+
+def build(raster_path):
+    """Derive the population counts, row pixel areas and summed-area table from the density raster"""
+    import rasterio
+
+    with rasterio.open(raster_path) as src:
+        density = src.read(1).astype('float32')
+        transform = src.transform
+        if src.nodata is not None and not np.isnan(src.nodata):
+            density[density == src.nodata] = 0
+    record_raster_read(density, 'full')
+    density = np.nan_to_num(density, nan=0.0)
+    density[density < 0] = 0
+
+    row_area_km2 = pixel_areas_km2(transform, density.shape[0])
+    counts = density * row_area_km2[:, None].astype('float32')
+    return PopulationGrid(counts, row_area_km2, summed_area_table(counts), transform)
+
+
+def get(raster_path):
+    """Population grid of the density raster, from the cached files or freshly derived"""
+    current = version(raster_path)
+    cached_version, grid = _loaded.get(raster_path, (None, None))
+    record_cache('population', cached_version == current)
+    if cached_version == current:
+        return grid
+
+    with _lock:
+        cached_version, grid = _loaded.get(raster_path, (None, None))
+        if cached_version == current:
+            return grid
+        grid = None
+        if all(os.path.exists(path) for path in cache_paths(raster_path, current)):
+            try:
+                grid = PopulationGrid.load(raster_path, current)
+            except (OSError, ValueError) as e:
+                logger.warning("Discarding unreadable population grid of %s: %s", raster_path, e)
+        if grid is None:
+            logger.debug("Building population grid of %s", raster_path)
+            grid = build(raster_path)
+            try:
+                grid.save(raster_path, current)
+                # Grids of older versions of the raster are never read again
+                for pattern in cache_paths(glob.escape(raster_path), '*'):
+                    for stale in glob.glob(pattern):
+                        if stale not in cache_paths(raster_path, current):
+                            os.remove(stale)
+                grid = PopulationGrid.load(raster_path, current)
+            except OSError as e:
+                logger.warning("Could not cache the population grid of %s: %s", raster_path, e)
+        _loaded[raster_path] = (current, grid)
+    return grid
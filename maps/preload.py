@@ -0,0 +1,135 @@
+"""Warm the read-only caches before gunicorn forks its workers.
+
+With ``GUNICORN_PRELOAD=1`` gunicorn imports the app in the master process and
+its ``when_ready`` hook calls ``warm()``, which imports the heavy libraries the
+views load lazily and fills the per-process caches:
+
+- the PROJ transformers of the geometry kernel
+- the Kisumu county boundary
+- the versioned map layer artifacts
+- the persons-per-pixel population grid and multi-year cube (memory-mapped)
+- the dashboard and service-area coverage layers, footprints, hexbins, and
+  facility density and distance surfaces (the population grid, ward and
+  buffer rasters), and the nearest-facility KD-trees, from the facilities and
+  wards of the GeoParquet snapshots when there are any
+
+The workers fork with all of this already in memory, shared copy-on-write, so
+they start serving immediately and don't each pay for it. Every step is timed
+and logged, and each worker logs its boot time and memory (RSS and PSS, the
+proportional share that counts shared pages once) when it is ready.
+"""
+import importlib
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+# Libraries the views and analysis modules import on first use
+LAZY_IMPORTS = ['pyproj', 'rasterio', 'rasterio.features', 'rasterio.mask', 'rasterio.windows', 'scipy.spatial']
+
+
+@contextmanager
+def _timed(timings, step):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        # A cache that can't be warmed is built lazily by the first request instead
+        logger.warning("Preload step %s failed: %s", step, e)
+    finally:
+        timings[step] = time.perf_counter() - started
+
+
+def warm():
+    """Import the heavy libraries and fill the read-only caches; returns {step: seconds}"""
+    from . import (boundaries, categories, coverage, cube, distance, geometry, hexbins, kde, layers, nearest,
+                   population, snapshots, views)
+    from .models import HealthCareFacility, KenyaWard, PopulationDensity
+
+    timings = {}
+    started = time.perf_counter()
+
+    with _timed(timings, 'imports'):
+        for module in LAZY_IMPORTS:
+            importlib.import_module(module)
+
+    with _timed(timings, 'transformers'):
+        for source, target in [(geometry.WGS84, geometry.UTM_36S), (geometry.UTM_36S, geometry.WGS84),
+                               (geometry.WGS84, geometry.KISUMU_LAEA)]:
+            geometry.transformer(source, target)
+
+    with _timed(timings, 'boundaries'):
+        boundary = boundaries.county('KISUMU')
+
+    with _timed(timings, 'layers'):
+        for name in layers.LAYERS:
+            layers.artifact_version(name)
+
+    with _timed(timings, 'population'):
+        dataset = PopulationDensity.objects.first()
+        if dataset is not None:
+            population.get(dataset.raster_file.path)
+            cube.get()
+
+    with _timed(timings, 'coverage'):
+        if dataset is not None and boundary is not None:
+            # From the GeoParquet snapshots if there are any: the caches are keyed by content, so
+            # they match the database's unless it changed since the snapshot
+            facilities = snapshots.facilities()
+            if facilities is None:
+                facilities = list(HealthCareFacility.objects.served())
+            wards = snapshots.wards()
+            if wards is None:
+                wards = list(KenyaWard.objects.in_county('KISUMU'))
+            raster_path = dataset.raster_file.path
+            radii_km = categories.policy().radii_km(facilities)
+            # The same layers the dashboard and the coverage scenario view use
+            coverage.get_layer('dashboard', raster_path, facilities, views.DASHBOARD_RADIUS_KM, wards, boundary)
+            coverage.get_layer('service-areas', raster_path, facilities, radii_km, wards, boundary)
+            coverage.get_footprints('service-areas', raster_path, facilities, radii_km)
+            hexbins.get(raster_path, facilities, radii_km, wards, boundary)
+            kde.get(raster_path, facilities)
+            distance.get(raster_path, facilities, wards, boundary)
+            nearest.get()
+
+    # Connections must not be shared with the forked workers
+    connections.close_all()
+
+    total = time.perf_counter() - started
+    logger.info(
+        "Preloaded caches in %.2fs (%s); master memory %s",
+        total, ', '.join(f'{step} {seconds:.2f}s' for step, seconds in timings.items()), format_memory(memory_usage()),
+    )
+    return timings
+
+
+def memory_usage():
+    """{'rss_mb', 'pss_mb'} of this process (PSS only where /proc provides it)"""
+    usage = {}
+    try:
+        with open('/proc/self/smaps_rollup') as file:
+            for line in file:
+                key, value = line.split(':', 1)
+                if key in ('Rss', 'Pss'):
+                    usage[f'{key.lower()}_mb'] = int(value.split()[0]) / 1024
+    except OSError:
+        import resource
+        usage['rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return usage
+
+
+def format_memory(usage):
+    return ', '.join(f'{key[:-3].upper()} {value:.0f} MB' for key, value in usage.items())
+
+
+def worker_ready(forked_at):
+    """Log how long this worker took to boot since it was forked, and how much memory it uses"""
+    logger.info(
+        "Worker %s ready in %.2fs; %s",
+        os.getpid(), time.perf_counter() - forked_at, format_memory(memory_usage()),
+    )
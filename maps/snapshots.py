@@ -0,0 +1,223 @@
+"""GeoParquet snapshots of the facilities, boundaries and analysis tables.
+
+Each table of ``exports`` named in SNAPSHOTS is also written as a GeoParquet
+file under ``MAPS_ARTIFACT_ROOT/snapshots``, so analysts can read it straight
+into geopandas or any Arrow tool instead of scraping GeoJSON::
+
+    geopandas.read_parquet('snapshots/wards-<version>.parquet')
+    snapshots.read('suitability-candidates', columns=['composite_score'], bbox=(34.6, -0.3, 34.9, -0.1))
+
+Geometries are WKB in lon/lat (the GeoParquet default CRS), and a ``bbox``
+struct column holds each row's extent, declared as the geometry's covering.
+Rows are written in row groups of ROW_GROUP_SIZE with column statistics, so
+readers skip the row groups a bbox or value filter excludes without decoding
+them. A snapshot's version is the key of its node in the artifact graph:
+it changes exactly when the data it was written from changes, and
+``manifest.json`` points at the current file of each table.
+
+The snapshots also serve as a cold-start cache: ``facilities()`` and
+``wards()`` return model instances read from the latest snapshot instead of
+PostGIS. Writing and reading need pyarrow (pinned in requirements.txt);
+without it the snapshots are skipped, with a warning at every build.
+"""
+import json
+import logging
+import os
+import threading
+
+import shapely
+from django.conf import settings
+from django.contrib.gis.geos import GEOSGeometry, Point
+
+from . import exports
+from .models import HealthCareFacility, KenyaWard
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional; without it there are no snapshots
+    pa = pc = pq = None
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOTS = ('facilities', 'wards', 'constituencies', 'ward-coverage', 'suitability-candidates')
+ROW_GROUP_SIZE = 4096
+GEOPARQUET_VERSION = '1.1.0'
+
+ARROW_TYPES = {'str': 'string', 'int': 'int64', 'float': 'float64'}
+BBOX_FIELDS = ('xmin', 'ymin', 'xmax', 'ymax')
+
+_manifest_lock = threading.Lock()
+
+
+def available():
+    return pa is not None
+
+
+def snapshot_dir():
+    return os.path.join(settings.MAPS_ARTIFACT_ROOT, 'snapshots')
+
+
+def snapshot_path(name, version):
+    return os.path.join(snapshot_dir(), f'{name}-{version}.parquet')
+
+
+def _manifest_path():
+    return os.path.join(snapshot_dir(), 'manifest.json')
+
+
+def manifest():
+    """{table name: {'version', 'file', 'rows', 'row_groups', 'bbox', 'columns'}} of the current snapshots"""
+    try:
+        with open(_manifest_path()) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def schema(export):
+    """Arrow schema of an export's snapshot, with the GeoParquet metadata"""
+    geo = {
+        'version': GEOPARQUET_VERSION,
+        'primary_column': 'geometry',
+        'columns': {
+            'geometry': {
+                'encoding': 'WKB',
+                'geometry_types': [export.geometry_type],
+                'covering': {'bbox': {field: ['bbox', field] for field in BBOX_FIELDS}},
+            },
+        },
+    }
+    fields = [pa.field(name, ARROW_TYPES[kind]) for name, kind in export.fields]
+    fields.append(pa.field('bbox', pa.struct([pa.field(field, pa.float64()) for field in BBOX_FIELDS])))
+    fields.append(pa.field('geometry', pa.binary()))
+    return pa.schema(fields, metadata={'geo': json.dumps(geo)})
+
+
+def _batch(export, table_schema, rows):
+    geometries = [geom for geom, _ in rows]
+    bounds = shapely.bounds(geometries)
+    columns = [pa.array([properties.get(name) for _, properties in rows], type=table_schema.field(name).type)
+               for name, _ in export.fields]
+    columns.append(pa.StructArray.from_arrays([pa.array(bounds[:, i]) for i in range(4)], names=BBOX_FIELDS))
+    columns.append(pa.array(shapely.to_wkb(geometries), type=pa.binary()))
+    return pa.record_batch(columns, schema=table_schema), bounds
+
+
+def write(export, path, row_group_size=ROW_GROUP_SIZE):
+    """Write an export to a GeoParquet file, one row group per `row_group_size` rows
+
+    Returns (row count, row group count, total bbox or None).
+    """
+    table_schema = schema(export)
+    count, groups, extent, chunk = 0, 0, None, []
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with pq.ParquetWriter(tmp_path, table_schema, compression='zstd', write_statistics=True) as writer:
+        def flush():
+            nonlocal extent
+            batch, bounds = _batch(export, table_schema, chunk)
+            writer.write_batch(batch, row_group_size=row_group_size)
+            low, high = bounds[:, :2].min(axis=0), bounds[:, 2:].max(axis=0)
+            if extent is not None:
+                low, high = [min(a, b) for a, b in zip(low, extent[:2])], [max(a, b) for a, b in zip(high, extent[2:])]
+            extent = [float(value) for value in (*low, *high)]
+
+        for row in export.rows:
+            chunk.append(row)
+            if len(chunk) == row_group_size:
+                flush()
+                count, groups, chunk = count + len(chunk), groups + 1, []
+        if chunk:
+            flush()
+            count, groups = count + len(chunk), groups + 1
+    os.replace(tmp_path, path)
+    return count, groups, extent
+
+
+def build(name, dataset, version):
+    """Write snapshot `name` at `version` unless it exists, and make it the current one"""
+    if not available():
+        logger.warning("Skipping the %s snapshot: pyarrow is not installed", name)
+        return
+    os.makedirs(snapshot_dir(), exist_ok=True)
+    path = snapshot_path(name, version)
+    entry = manifest().get(name)
+    if not (os.path.exists(path) and entry and entry['version'] == version):
+        export = exports.create(name, dataset)
+        count, groups, extent = write(export, path)
+        entry = {
+            'version': version,
+            'file': os.path.basename(path),
+            'rows': count,
+            'row_groups': groups,
+            'bbox': extent,
+            'columns': [field for field, _ in export.fields],
+        }
+
+    with _manifest_lock:
+        current = manifest()
+        current[name] = entry
+        tmp_path = f'{_manifest_path()}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(current, file, indent=2, sort_keys=True)
+        os.replace(tmp_path, _manifest_path())
+
+    # Older snapshots of the table are never read again
+    for file_name in os.listdir(snapshot_dir()):
+        if file_name.startswith(f'{name}-') and file_name.endswith('.parquet') and file_name != entry['file']:
+            os.remove(os.path.join(snapshot_dir(), file_name))
+
+
+def current_path(name):
+    """File of the current snapshot of `name`, or None if there is none"""
+    entry = manifest().get(name)
+    if not entry:
+        return None
+    path = os.path.join(snapshot_dir(), entry['file'])
+    return path if os.path.exists(path) else None
+
+
+def read(name, columns=None, bbox=None):
+    """The current snapshot of `name` as an Arrow table, or None if there is none
+
+    Only the `columns` given are read (the geometry is one of them), and with
+    a (west, south, east, north) `bbox` only the rows whose extent intersects
+    it; row groups outside it are skipped using their statistics.
+    """
+    path = current_path(name) if available() else None
+    if path is None:
+        return None
+    filters = None
+    if bbox is not None:
+        west, south, east, north = bbox
+        filters = ((pc.field('bbox', 'xmax') >= west) & (pc.field('bbox', 'xmin') <= east)
+                   & (pc.field('bbox', 'ymax') >= south) & (pc.field('bbox', 'ymin') <= north))
+    return pq.read_table(path, columns=columns, filters=filters)
+
+
+def facilities():
+    """The facilities of the current snapshot as (unsaved) model instances, or None without one"""
+    table = read('facilities')
+    if table is None:
+        return None
+    return [
+        HealthCareFacility(pk=row['id'], name=row['name'], facility_type=row['facility_type'],
+                           capacity=row['capacity'], location=Point(shapely.from_wkb(row['geometry']).coords[0],
+                                                                    srid=4326))
+        for row in table.to_pylist()
+    ]
+
+
+def wards():
+    """The Kisumu wards of the current snapshot as (unsaved) model instances, or None without one"""
+    table = read('wards')
+    if table is None:
+        return None
+    return [
+        KenyaWard(pk=row['gid'], ward=row['ward'], subcounty=row['subcounty'], county=row['county'], uid=row['uid'],
+                  pop2009=row['pop2009'], pop2019=row['pop2019'],
+                  geom=GEOSGeometry(memoryview(row['geometry']), srid=4326))
+        for row in table.to_pylist()
+    ]
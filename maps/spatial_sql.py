@@ -0,0 +1,194 @@
+"""Spatial analysis pushed down into PostGIS.
+
+Service areas are buffered on the spheroid with ``ST_Buffer(geography)``,
+merged with ``ST_Union``, clipped with ``ST_Intersection`` and measured with
+``ST_Area(geography)``, in a single set-based statement. Only the result row
+(the merged geometry, its area and facility count) comes back over the
+connection, instead of the facility geometries::
+
+    if spatial_sql.available():
+        result = spatial_sql.service_areas()
+
+Radii come from the category policy by facility type, as in the shapely path
+(``categories.policy().radius_km``), with the default radius for types without
+a category. Facilities of categories that are not served types are left out,
+as in ``HealthCareFacility.objects.served()``.
+
+The clip to the county intersects the coverage with the parts of the county in
+the ST_Subdivide companion table when it has been built (``manage.py
+provision_spatial_indexes``, and rebuilt by the artifact graph when the
+counties change), so GEOS overlays small parts, skipping those the index says
+are outside, instead of one polygon of thousands of vertices.
+"""
+import time
+
+from django.db import connections, transaction
+
+from . import categories
+from .models import FacilityCategory, HealthCareFacility, KenyaCounty
+
+
+# Segments per quarter circle for buffers, as geometry.QUAD_SEGS
+QUAD_SEGS = 16
+
+# Subdivided companion table of the counties (gid, county, geom part)
+COUNTY_PARTS_TABLE = 'kenya_counties_subdivided'
+# Maximum vertices per part (ST_Subdivide)
+PARTS_MAX_VERTICES = 256
+# Seconds before a missing companion table is looked for again
+PARTS_CHECK_INTERVAL = 60.0
+
+# {database alias: (whether the companion table exists, time.monotonic() of the check)}
+_has_parts = {}
+
+PARTS_FINGERPRINT_SQL = """
+SELECT md5(string_agg(gid::text || ':' || md5(ST_AsBinary(geom)), ',' ORDER BY gid)) FROM {source}
+"""
+
+# Built aside and swapped in by rename, in one transaction: readers see the old table or the new one
+PARTS_BUILD_SQL = [
+    "DROP TABLE IF EXISTS {table}_new",
+    """
+    CREATE TABLE {table}_new AS
+    SELECT gid, county, ST_Subdivide(ST_CollectionExtract(ST_MakeValid(geom), 3), %(max_vertices)s) AS geom
+    FROM {source}
+    """,
+    "CREATE INDEX {table}_new_geom_gist ON {table}_new USING gist (geom)",
+    "CREATE INDEX {table}_new_county_upper ON {table}_new (UPPER(county))",
+    "DROP TABLE IF EXISTS {table}",
+    "ALTER TABLE {table}_new RENAME TO {table}",
+    "ALTER INDEX {table}_new_geom_gist RENAME TO {table}_geom_gist",
+    "ALTER INDEX {table}_new_county_upper RENAME TO {table}_county_upper",
+    "COMMENT ON TABLE {table} IS %(comment)s",
+    "ANALYZE {table}",
+]
+
+# Service areas of the selected facilities, their union and the county boundary
+COVERAGE_CTES = """
+radii (facility_type, radius_km) AS (
+    SELECT * FROM unnest(%(types)s::text[], %(radii)s::float8[])
+),
+service_areas AS (
+    SELECT ST_Buffer(f.location::geography, COALESCE(r.radius_km, %(default_km)s) * 1000,
+                     'quad_segs={quad_segs}')::geometry AS geom
+    FROM {facilities} f
+    LEFT JOIN radii r ON r.facility_type = f.facility_type
+    LEFT JOIN {categories} c ON c.id = f.category_id
+    WHERE c.id IS NULL OR c.is_served_type
+),
+coverage AS (
+    SELECT ST_Union(geom) AS geom, count(*) AS facility_count FROM service_areas
+),
+county_parts AS (
+    SELECT geom FROM {county_parts} WHERE UPPER(county) = UPPER(%(county)s)
+)
+"""
+
+SERVICE_AREAS_SQL = """
+WITH {ctes},
+clipped AS (
+    SELECT CASE WHEN %(clip)s AND coverage.geom IS NOT NULL AND EXISTS (SELECT 1 FROM county_parts)
+                THEN COALESCE((SELECT ST_Union(ST_Intersection(coverage.geom, p.geom)) FROM county_parts p
+                               WHERE ST_Intersects(p.geom, coverage.geom)),
+                              ST_SetSRID('POLYGON EMPTY'::geometry, 4326))
+                ELSE coverage.geom END AS geom,
+           coverage.facility_count
+    FROM coverage
+)
+SELECT ST_AsGeoJSON(ST_SimplifyPreserveTopology(geom, %(simplify)s), %(precision)s),
+       COALESCE(ST_Area(geom::geography) / 1e6, 0),
+       facility_count
+FROM clipped
+"""
+
+
+def available(using='default'):
+    """Whether the database can run these queries (PostGIS)"""
+    return connections[using].vendor == 'postgresql'
+
+
+def has_parts_table(using='default'):
+    """Whether the county parts table has been built (a missing one is looked for again every PARTS_CHECK_INTERVAL)"""
+    exists, checked_at = _has_parts.get(using, (False, None))
+    if not exists and (checked_at is None or time.monotonic() - checked_at >= PARTS_CHECK_INTERVAL):
+        exists = COUNTY_PARTS_TABLE in connections[using].introspection.table_names()
+        _has_parts[using] = (exists, time.monotonic())
+    return exists
+
+
+def counties_fingerprint(using='default'):
+    """md5 of the county geometries, which the parts table records it was built from"""
+    with connections[using].cursor() as cursor:
+        cursor.execute(PARTS_FINGERPRINT_SQL.format(source=KenyaCounty._meta.db_table))
+        return cursor.fetchone()[0]
+
+
+def parts_status(max_vertices=PARTS_MAX_VERTICES, using='default'):
+    """'current', 'stale' or 'missing': the county parts table against the counties it was built from"""
+    comment = _parts_comment(counties_fingerprint(using), max_vertices)
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT obj_description(to_regclass(%s), 'pg_class')", [COUNTY_PARTS_TABLE])
+        current = cursor.fetchone()[0]
+    if current is None:
+        return 'missing'
+    return 'current' if current == comment else 'stale'
+
+
+def build_parts(max_vertices=PARTS_MAX_VERTICES, using='default'):
+    """(Re)build the county parts table; returns the number of parts and of counties"""
+    source = KenyaCounty._meta.db_table
+    params = {
+        'max_vertices': max_vertices,
+        'comment': _parts_comment(counties_fingerprint(using), max_vertices),
+    }
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        for statement in PARTS_BUILD_SQL:
+            statement = statement.format(table=COUNTY_PARTS_TABLE, source=source)
+            cursor.execute(statement, params if '%(' in statement else None)
+        cursor.execute(f'SELECT count(*), count(DISTINCT gid) FROM {COUNTY_PARTS_TABLE}')
+        parts, counties = cursor.fetchone()
+    _has_parts[using] = (True, time.monotonic())
+    return parts, counties
+
+
+def _parts_comment(fingerprint, max_vertices):
+    return f'ST_Subdivide of {KenyaCounty._meta.db_table}: max_vertices={max_vertices} source_md5={fingerprint}'
+
+
+def _tables(using):
+    counties = KenyaCounty._meta.db_table
+    return {
+        'facilities': HealthCareFacility._meta.db_table,
+        'categories': FacilityCategory._meta.db_table,
+        'county_parts': (COUNTY_PARTS_TABLE if has_parts_table(using)
+                         else f'(SELECT county, ST_MakeValid(geom) AS geom FROM {counties}) AS counties'),
+    }
+
+
+def _query(template, county, using, **params):
+    tables = _tables(using)
+    ctes = COVERAGE_CTES.format(quad_segs=QUAD_SEGS, **tables).strip()
+    sql = template.format(ctes=ctes, **tables)
+    policy = categories.policy()
+    params.update({
+        'types': list(policy.categories),
+        'radii': [float(policy.radius_km(name)) for name in policy.categories],
+        'default_km': float(categories.DEFAULT_RADIUS_KM),
+        'county': county,
+    })
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def service_areas(county='KISUMU', clip=True, simplify=0.0001, precision=6, using='default'):
+    """Merged service area of the selected facilities, clipped to the county
+
+    Returns {'geojson': geometry as a GeoJSON string (or None), 'area_km2', 'facility_count'}.
+    """
+    geojson, area_km2, facility_count = _query(
+        SERVICE_AREAS_SQL, county, using,
+        clip=clip, simplify=simplify, precision=precision,
+    )[0]
+    return {'geojson': geojson, 'area_km2': float(area_km2), 'facility_count': facility_count}
+
@@ -1,3 +1,483 @@
-from django.test import TestCase
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-# Create your tests here.
+import numpy as np
+import shapely
+from affine import Affine
+from django.contrib.gis.geos import GEOSGeometry, Point
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from . import (admission, artifacts, boundaries, cache, categories, coverage, distance, geometry, hexbins, kde, nearest,
+               offload)
+from . import population as population_grid
+from .models import FacilityCategory, HealthCareFacility, KenyaWard
+
+
+# A 0.01° grid over part of Kisumu County
+TRANSFORM = Affine(0.01, 0, 34.6, 0, -0.01, 0.1)
+SHAPE = (40, 50)
+
+
+def facility(pk, lon, lat, facility_type='Health Centre', capacity=None):
+    return HealthCareFacility(pk=pk, name=f'Facility {pk}', facility_type=facility_type,
+                              location=Point(lon, lat, srid=4326), capacity=capacity)
+
+
+def ward(pk, geom):
+    return KenyaWard(pk=pk, ward=f'Ward {pk}', county='KISUMU',
+                     geom=GEOSGeometry(shapely.MultiPolygon([geom]).wkt, srid=4326))
+
+
+def write_raster(path, density):
+    import rasterio
+
+    with rasterio.open(path, 'w', driver='GTiff', height=density.shape[0], width=density.shape[1], count=1,
+                       dtype='float32', crs='EPSG:4326', transform=TRANSFORM, nodata=-1) as dst:
+        dst.write(density.astype('float32'), 1)
+
+
+class GeometryTests(SimpleTestCase):
+    def test_areas_km2(self):
+        # A 0.1° square at the equator: 11.132 km by 11.057 km
+        areas = geometry.areas_km2(np.array([shapely.box(34.8, -0.05, 34.9, 0.05), shapely.box(34.8, 0, 35.0, 0.1)]))
+        self.assertAlmostEqual(areas[0], 11.132 * 11.057, delta=0.2)
+        self.assertAlmostEqual(areas[1], 2 * areas[0], delta=0.2)
+
+    def test_metric_buffers(self):
+        lons, lats = np.array([34.75, 34.9]), np.array([-0.1, 0.05])
+        buffers = geometry.metric_buffers(lons, lats, [5, 2])
+        np.testing.assert_allclose(geometry.areas_km2(buffers), np.pi * np.array([25, 4]), rtol=0.01)
+        # The buffers are circles of the radius in metres, whatever the latitude
+        centres = geometry.to_utm(shapely.points(lons, lats))
+        x, y = shapely.get_x(centres), shapely.get_y(centres)
+        for buffer, centre_x, centre_y, radius_m in zip(geometry.to_utm(buffers), x, y, [5000, 2000]):
+            ring = shapely.get_coordinates(buffer)
+            np.testing.assert_allclose(np.hypot(ring[:, 0] - centre_x, ring[:, 1] - centre_y), radius_m, rtol=1e-3)
+
+
+class ScenarioChangeTests(SimpleTestCase):
+    transform = Affine(1, 0, 0, 0, -1, 4)
+    shape = (4, 10)
+
+    def setUp(self):
+        # Facility 0 covers columns 0-3, facility 1 columns 2-5
+        footprints = [coverage.pack_footprint(shapely.box(x0, 0, x1, 4), self.transform, self.shape)
+                      for x0, x1 in [(0, 4), (2, 6)]]
+        chunks = [packed.ravel() for _, packed in footprints]
+        self.footprints = coverage.Footprints(
+            row_start=np.array([start for start, _ in footprints]),
+            row_stop=np.array([start + len(packed) for start, packed in footprints]),
+            offsets=np.concatenate([[0], np.cumsum([len(chunk) for chunk in chunks])]),
+            bits=np.concatenate(chunks),
+            grid=np.array(list(self.transform)[:6] + list(self.shape), dtype=float),
+            facility_ids=np.array([10, 11]),
+        )
+        depth = np.zeros(self.shape, dtype='uint16')
+        depth[:, 0:4] += 1
+        depth[:, 2:6] += 1
+        ward_ids = np.zeros(self.shape, dtype='int32')
+        ward_ids[:, :5], ward_ids[:, 5:] = 1, 2
+        inside = np.ones(self.shape, dtype=bool)
+        inside[3] = False
+        population = np.arange(40, dtype='float32').reshape(self.shape)
+        self.layer = coverage.CoverageLayer(depth, np.zeros(self.shape, dtype='int32'), ward_ids, inside,
+                                            population, np.full(4, 2.0), self.footprints.facility_ids)
+
+    def test_remove_and_add(self):
+        added = self.footprints.pack([shapely.box(8, 0, 10, 4)])
+        change = coverage.scenario_change(self.layer, self.footprints, [0], added, 2)
+
+        lost = np.zeros(self.shape, dtype=bool)
+        lost[:3, 4:6] = True
+        gained = np.zeros(self.shape, dtype=bool)
+        gained[:3, 8:10] = True
+        np.testing.assert_array_equal(change['gained_mask'], gained)
+        population = self.layer.population
+        self.assertEqual(change['lost']['population'], population[lost].sum())
+        self.assertEqual(change['lost']['area_km2'], 2.0 * lost.sum())
+        np.testing.assert_array_equal(change['lost']['ward_population'],
+                                      [population[:3, 4].sum(), population[:3, 5].sum()])
+        np.testing.assert_array_equal(change['gained']['ward_population'], [0, population[gained].sum()])
+        np.testing.assert_array_equal(change['gained']['ward_area_km2'], [0, 2.0 * gained.sum()])
+
+    def test_keep_all(self):
+        change = coverage.scenario_change(self.layer, self.footprints, [0, 1], [], 2)
+        self.assertEqual(change['gained']['population'], 0)
+        self.assertEqual(change['lost']['population'], 0)
+
+
+class PopulationGridTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = np.random.default_rng(0)
+        counts = rng.random(SHAPE) * 100
+        row_area_km2 = population_grid.pixel_areas_km2(TRANSFORM, SHAPE[0])
+        cls.grid = population_grid.PopulationGrid(counts, row_area_km2, population_grid.summed_area_table(counts),
+                                                  TRANSFORM)
+
+    def test_summed_area_table(self):
+        sat = self.grid.sat
+        self.assertEqual(sat.shape, (SHAPE[0] + 1, SHAPE[1] + 1))
+        self.assertAlmostEqual(sat[17, 23], self.grid.counts[:17, :23].sum(), places=6)
+        self.assertAlmostEqual(sat[-1, -1], self.grid.total, places=6)
+
+    def test_bbox_totals_match_pixel_sums(self):
+        rng = np.random.default_rng(1)
+        west = 34.6 + rng.random(200) * 0.5
+        north = 0.1 - rng.random(200) * 0.4
+        # Some boxes reach past the grid
+        bounds = np.column_stack([west, north - rng.random(200) * 0.3, west + rng.random(200) * 0.3, north])
+        population, area = self.grid.bbox_totals(bounds)
+
+        lons = TRANSFORM.c + (np.arange(SHAPE[1]) + 0.5) * TRANSFORM.a
+        lats = TRANSFORM.f + (np.arange(SHAPE[0]) + 0.5) * TRANSFORM.e
+        for i, (box_west, box_south, box_east, box_north) in enumerate(bounds):
+            rows = (lats >= box_south) & (lats <= box_north)
+            cols = (lons >= box_west) & (lons <= box_east)
+            self.assertAlmostEqual(population[i], self.grid.counts[np.ix_(rows, cols)].sum(), places=6)
+            self.assertAlmostEqual(area[i], self.grid.row_area_km2[rows].sum() * cols.sum(), places=6)
+
+    def test_bbox_snaps_to_pixels(self):
+        result = self.grid.bbox((34.651, -0.049, 34.699, 0.049))
+        self.assertEqual(result['pixels'], 10 * 5)
+        np.testing.assert_allclose(result['bounds'], [34.65, -0.05, 34.70, 0.05])
+        self.assertAlmostEqual(result['population'], self.grid.counts[5:15, 5:10].sum(), places=6)
+
+    def test_max_density_bound(self):
+        bounds = [(34.6, -0.3, 35.1, 0.1), (34.65, 0.0, 34.7, 0.05), (34.7, 0.0, 34.7, 0.0)]
+        bound = self.grid.max_density_bound(bounds)
+        density = self.grid.density()
+        self.assertGreaterEqual(bound[0], density.max())
+        self.assertGreaterEqual(bound[1], density[5:10, 5:10].max())
+        self.assertEqual(bound[2], 0)
+
+    def test_zonal(self):
+        counts = np.asarray(self.grid.counts)
+        zone = self.grid.zonal(shapely.box(34.651, -0.049, 34.699, 0.049))
+        self.assertEqual(zone['pixels'], 10 * 5)
+        self.assertAlmostEqual(zone['population'], counts[5:15, 5:10].sum(), places=6)
+        self.assertAlmostEqual(zone['area_km2'], self.grid.row_area_km2[5:15].sum() * 5, places=6)
+        # A geometry smaller than a pixel takes the pixel it touches
+        zone = self.grid.zonal(shapely.box(34.6512, 0.0512, 34.6514, 0.0514))
+        self.assertEqual(zone['pixels'], 1)
+        self.assertAlmostEqual(zone['population'], counts[4, 5], places=6)
+
+    def test_build_from_raster(self):
+        density = np.full(SHAPE, 250.0)
+        density[0, 0] = -1
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'density.tif')
+            write_raster(path, density)
+            grid = population_grid.build(path)
+        self.assertEqual(grid.counts[0, 0], 0)
+        np.testing.assert_allclose(grid.counts[1], 250.0 * grid.row_area_km2[1], rtol=1e-6)
+
+
+class HexbinTests(SimpleTestCase):
+    def test_axial_nearest_centre(self):
+        size = 1000
+        rng = np.random.default_rng(2)
+        x, y = rng.uniform(-20000, 20000, 5000), rng.uniform(-20000, 20000, 5000)
+        q, r = hexbins.axial(x, y, size)
+        centre_x, centre_y = hexbins.centres(q, r, size)
+        distances = np.hypot(x - centre_x, y - centre_y)
+        # A point lies in the hexagon whose centre is nearest
+        self.assertTrue((distances <= size + 1e-6).all())
+        for dq, dr in [(1, 0), (-1, 0), (0, 1), (0, -1), (1, -1), (-1, 1)]:
+            neighbour_x, neighbour_y = hexbins.centres(q + dq, r + dr, size)
+            self.assertTrue((distances <= np.hypot(x - neighbour_x, y - neighbour_y) + 1e-6).all())
+
+    def test_centres_round_trip(self):
+        q, r = np.array([0, 3, -2, 7]), np.array([0, -1, 5, -7])
+        for axis, expected in zip(hexbins.axial(*hexbins.centres(q, r, 500), 500), (q, r)):
+            np.testing.assert_array_equal(axis, expected)
+
+
+@override_settings(MAPS_ADMISSION_SLOTS=2, MAPS_ADMISSION_HOST_SLOTS=0, MAPS_ADMISSION_QUEUE=1,
+                   MAPS_ADMISSION_TIMEOUT=0.2, MAPS_ADMISSION_RETRY_AFTER=7)
+class AdmissionTests(SimpleTestCase):
+    def test_slots(self):
+        slots = admission.Slots()
+        tokens = [slots.try_acquire(), slots.try_acquire()]
+        self.assertTrue(all(tokens))
+        self.assertIsNone(slots.try_acquire())
+        slots.release(tokens.pop())
+        self.assertEqual(slots.running, 1)
+        self.assertIsNotNone(slots.try_acquire())
+
+    def test_queue_full(self):
+        slots = admission.Slots()
+        slots.enqueue()
+        with self.assertRaises(admission.Saturated) as raised:
+            slots.enqueue()
+        self.assertEqual(raised.exception.retry_after, 7)
+        slots.dequeue()
+        slots.enqueue()
+
+    def test_admitted_times_out(self):
+        async def run():
+            async with admission.admitted(), admission.admitted():
+                async with admission.admitted():
+                    pass
+
+        with self.assertRaises(admission.Saturated):
+            asyncio.run(run())
+        self.assertEqual((admission.slots.running, admission.slots.waiting), (0, 0))
+
+    def test_single_flight_coalesces(self):
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {'value': 42}
+
+        async def run():
+            return await asyncio.gather(*[admission.single_flight('coalesce', compute) for _ in range(5)])
+
+        results = asyncio.run(run())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([shared for _, shared in results], [False, True, True, True, True])
+        self.assertTrue(all(result is results[0][0] for result, _ in results))
+        self.assertNotIn('coalesce', admission._flights)
+
+    def test_single_flight_shares_exceptions(self):
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            raise ValueError('bad input')
+
+        async def run():
+            return await asyncio.gather(*[admission.single_flight('fail', compute) for _ in range(3)],
+                                        return_exceptions=True)
+
+        errors = asyncio.run(run())
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(isinstance(error, ValueError) for error in errors))
+        self.assertNotIn('fail', admission._flights)
+
+    def test_streamed_response_holds_slot_until_sent(self):
+        @offload.offload
+        def export(request):
+            return StreamingHttpResponse(iter([b'a', b'b']))
+
+        @offload.offload
+        def abandoned_export(request):
+            return StreamingHttpResponse(offload.iterate([b'a', b'b']))
+
+        response = asyncio.run(export(RequestFactory().get('/export/')))
+        self.assertEqual(admission.slots.running, 1)
+        self.assertEqual(b''.join(response), b'ab')
+        self.assertEqual(admission.slots.running, 0)
+
+        response = asyncio.run(abandoned_export(RequestFactory().get('/export/abandoned/')))
+        self.assertEqual(admission.slots.running, 1)
+        response.close()
+        response.close()
+        self.assertEqual(admission.slots.running, 0)
+
+    def test_map_calls_are_not_admitted(self):
+        @offload.offload_map
+        def density(request):
+            return admission.slots.running
+
+        async def run():
+            async with admission.admitted(), admission.admitted():
+                return await density(RequestFactory().get('/density/'))
+
+        self.assertEqual(asyncio.run(run()), 2)
+
+
+class KdeTests(SimpleTestCase):
+    def test_kernel(self):
+        kernel = kde.gaussian_kernel(3000, 1000, 1500)
+        self.assertAlmostEqual(kernel.sum(), 1.0)
+        self.assertEqual(kernel.shape, (2 * 8 + 1, 2 * 12 + 1))
+        self.assertEqual(kernel.argmax(), kernel.size // 2)
+
+    def test_smooth_matches_gaussian_filter(self):
+        from scipy import ndimage
+
+        values = np.zeros((80, 90))
+        values[[20, 40, 41, 60], [20, 45, 45, 70]] = [1, 2, 3, 4]
+        # Sigma of 2 pixels across and 3 down, so both truncate at the same radius
+        smoothed = kde.smooth(values, kde.gaussian_kernel(6000, 3000, 2000))
+        expected = ndimage.gaussian_filter(values, sigma=(3, 2), mode='constant', truncate=kde.TRUNCATE)
+        np.testing.assert_allclose(smoothed, expected, atol=1e-12)
+        self.assertAlmostEqual(smoothed.sum(), values.sum())
+        self.assertGreaterEqual(smoothed.min(), 0)
+
+    def test_capacities(self):
+        facilities = [facility(1, 34.7, 0, capacity=10), facility(2, 34.7, 0), facility(3, 34.7, 0, capacity=30)]
+        np.testing.assert_array_equal(kde.capacities(facilities), [10, 20, 30])
+
+
+class DistanceTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directory.cleanup)
+        rng = np.random.default_rng(3)
+        density = rng.random(SHAPE) * 500
+        density[rng.random(SHAPE) < 0.2] = 0
+        cls.raster_path = os.path.join(directory.name, 'density.tif')
+        write_raster(cls.raster_path, density)
+
+        cls.facilities = [facility(1, 34.705, -0.005), facility(2, 34.955, -0.155, 'Dispensary'),
+                          facility(3, 34.805, 0.045), facility(4, 36.0, 0.0)]
+        cls.wards = [ward(1, shapely.box(34.6, -0.3, 34.85, 0.1)), ward(2, shapely.box(34.85, -0.3, 35.05, 0.1))]
+        cls.boundary = shapely.box(34.62, -0.28, 35.08, 0.08)
+        cls.surfaces = distance.build(cls.raster_path, cls.facilities, cls.wards, cls.boundary, 'test')
+
+    def test_types(self):
+        self.assertEqual(self.surfaces.types, [distance.ALL_TYPES, 'Dispensary', 'Health Centre'])
+        with self.assertRaises(KeyError):
+            self.surfaces.layer('District Hospital')
+
+    def test_nearest_facility(self):
+        # The facility off the grid is left out
+        self.assertEqual(set(np.unique(self.surfaces.nearest())), {0, 1, 2})
+        self.assertEqual(set(np.unique(self.surfaces.nearest('Health Centre'))), {0, 2})
+        self.assertEqual(self.surfaces.layer()[10, 10], 0)
+        self.assertEqual(self.surfaces.nearest()[10, 10], 0)
+
+    def test_within_matches_thresholding(self):
+        from rasterio import features
+
+        grid = population_grid.get(self.raster_path)
+        inside = features.geometry_mask([self.boundary], SHAPE, TRANSFORM, invert=True)
+        ward_ids = coverage.burn_wards(self.wards, SHAPE, TRANSFORM)
+        radii_m = [0, 2500.5, 7321.7, 1e6]
+        for facility_type in self.surfaces.types:
+            within = self.surfaces.within(facility_type, radii_m)
+            layer = self.surfaces.layer(facility_type)
+            for i, radius_m in enumerate(radii_m):
+                reached = inside & (layer <= radius_m)
+                expected = [grid.counts[reached & (ward_ids == position)].sum() for position in range(3)]
+                np.testing.assert_allclose(within[i], expected, rtol=1e-5, atol=1e-3)
+        np.testing.assert_allclose(within[-1], self.surfaces.population(), rtol=1e-9)
+        self.assertAlmostEqual(self.surfaces.catchments().sum(), self.surfaces.population().sum(), places=3)
+
+
+class NearestTests(SimpleTestCase):
+    def test_query_matches_brute_force(self):
+        rng = np.random.default_rng(4)
+        types = ['Health Centre', 'Dispensary', None]
+        facilities = [facility(i, *rng.uniform([34.5, -0.4], [35.1, 0.2]), facility_type=types[i % 3])
+                      for i in range(60)]
+        index = nearest.FacilityIndex(facilities, 'test')
+        self.assertEqual(sorted(index.types), ['Dispensary', 'Health Centre'])
+
+        lons, lats = rng.uniform(34.5, 35.1, 300), rng.uniform(-0.4, 0.2, 300)
+        x, y = geometry.utm_coordinates(lons, lats)
+        facility_x, facility_y = geometry.utm_coordinates(*geometry.coordinates(facilities))
+        for facility_type in [None, 'Dispensary']:
+            distances, positions = index.query(lons, lats, k=3, facility_type=facility_type)
+            members = np.array([i for i, f in enumerate(facilities) if facility_type in (None, f.facility_type)])
+            brute = np.hypot(x[:, None] - facility_x[members], y[:, None] - facility_y[members])
+            order = np.argsort(brute, axis=1)[:, :3]
+            np.testing.assert_array_equal(positions, members[order])
+            np.testing.assert_allclose(distances, np.take_along_axis(brute, order, axis=1))
+
+    def test_query_fewer_facilities_than_k(self):
+        facilities = [facility(1, 34.7, 0), facility(2, 34.8, 0, 'Dispensary')]
+        index = nearest.FacilityIndex(facilities, 'test')
+        distances, positions = index.query([34.75], [0], k=5, facility_type='Dispensary')
+        self.assertEqual(positions.tolist(), [[1]])
+        self.assertEqual(len(index.query([], [], k=2)[0]), 0)
+        with self.assertRaises(KeyError):
+            index.query([34.75], [0], facility_type='District Hospital')
+
+
+class BoundaryEditTests(SimpleTestCase):
+    """The cached layers are rebuilt when a ward or the county changes shape"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.raster_path = os.path.join(directory.name, 'density.tif')
+        write_raster(self.raster_path, np.random.default_rng(6).random(SHAPE) * 500)
+        self.facilities = [facility(1, 34.705, -0.005), facility(2, 34.955, -0.155)]
+        self.wards = [ward(1, shapely.box(34.6, -0.3, 34.85, 0.1)), ward(2, shapely.box(34.85, -0.3, 35.05, 0.1))]
+        self.boundary = shapely.box(34.62, -0.28, 35.08, 0.08)
+
+    def test_ward_edit_rebuilds_coverage(self):
+        before = coverage.get_layer('test', self.raster_path, self.facilities, 5, self.wards, self.boundary)
+        wards = [ward(1, shapely.box(34.6, -0.3, 34.95, 0.1)), ward(2, shapely.box(34.95, -0.3, 35.05, 0.1))]
+        after = coverage.get_layer('test', self.raster_path, self.facilities, 5, wards, self.boundary)
+        self.assertGreater((after.ward_ids == 1).sum(), (before.ward_ids == 1).sum())
+
+    def test_county_edit_rebuilds_distance_and_hexbins(self):
+        boundary = shapely.box(34.62, -0.28, 34.9, 0.08)
+        surfaces = [distance.get(self.raster_path, self.facilities, self.wards, county)
+                    for county in (self.boundary, boundary)]
+        self.assertLess(surfaces[1].population().sum(), surfaces[0].population().sum())
+        bins = [hexbins.get(self.raster_path, self.facilities, 5, self.wards, county)
+                for county in (self.boundary, boundary)]
+        self.assertLess(bins[1].resolutions[0]['population'].sum(), bins[0].resolutions[0]['population'].sum())
+
+
+@override_settings(MAPS_REBUILD_ON_CHANGE=False)
+class InputsChangedTests(SimpleTestCase):
+    def test_caches_cleared_without_rebuilds(self):
+        boundaries._counties['KISUMU'] = (shapely.box(0, 0, 1, 1), 0.0)
+        categories._loaded = (categories.Policy([]), 0.0)
+        artifacts.inputs_changed(KenyaWard)
+        artifacts.inputs_changed(FacilityCategory)
+        self.assertEqual(boundaries._counties, {})
+        self.assertIsNone(categories._loaded[0])
+
+
+class CacheTests(SimpleTestCase):
+    class Value:
+        def save(self, path):
+            with open(path, 'wb') as file:
+                file.write(b'value')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.raster_path = os.path.join(directory.name, 'density.tif')
+
+    def test_concurrent_cold_requests_build_once(self):
+        built = []
+        lock = threading.Lock()
+
+        def build():
+            with lock:
+                built.append(1)
+            time.sleep(0.05)
+            return self.Value()
+
+        def get(_):
+            return cache.get_cached('test', 'cold', self.raster_path, 'v1', lambda path: self.Value(), build)
+
+        with ThreadPoolExecutor(8) as executor:
+            values = list(executor.map(get, range(8)))
+        self.assertEqual(len(built), 1)
+        self.assertTrue(all(value is values[0] for value in values))
+
+    def test_loads_saved_version_and_removes_stale(self):
+        loaded = []
+
+        def load(path):
+            loaded.append(path)
+            return self.Value()
+
+        cache.get_cached('test', 'files', self.raster_path, 'v1', load, self.Value)
+        cache.get_cached('test', 'files', self.raster_path, 'v2', load, self.Value)
+        self.assertFalse(os.path.exists(cache.path(self.raster_path, 'test', 'files', 'v1')))
+        self.assertTrue(os.path.exists(cache.path(self.raster_path, 'test', 'files', 'v2')))
+        # Another process finds the file
+        cache._loaded.pop(('test', 'files', self.raster_path))
+        cache.get_cached('test', 'files', self.raster_path, 'v2', load, self.Value)
+        self.assertEqual(loaded, [cache.path(self.raster_path, 'test', 'files', 'v2')])
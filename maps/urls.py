@@ -1,13 +1,29 @@
 from django.urls import path
 from .views import facility_map, get_population_density, get_population_density_for_area, site_suitability_analysis
-from .views import healthcare_dashboard, merged_service_areas
+from .views import healthcare_dashboard, merged_service_areas, coverage_scenario, map_layer, population_in_bbox
+from .views import population_change, facility_density, facility_distance, distance_coverage, nearest_facilities
+from .views import ward_population_series, hexbins_view, export_results
+from .views import snapshot_index, snapshot_file
 urlpatterns = [
     path('map/', facility_map, name='facility_map'),
     path('api/population-density/', get_population_density, name='get_population_density'),
     path('api/population-density-for-area/', get_population_density_for_area, name='population_density_for_area'),
+    path('api/population-in-bbox/', population_in_bbox, name='population_in_bbox'),
+    path('api/population-change/', population_change, name='population_change'),
+    path('api/facility-density/', facility_density, name='facility_density'),
+    path('api/facility-distance/', facility_distance, name='facility_distance'),
+    path('api/distance-coverage/', distance_coverage, name='distance_coverage'),
+    path('api/nearest-facilities/', nearest_facilities, name='nearest_facilities'),
+    path('api/ward-population-series/', ward_population_series, name='ward_population_series'),
+    path('api/hexbins/', hexbins_view, name='hexbins'),
     path('api/site-suitability-analysis/', site_suitability_analysis, name='site_suitability_analysis'),
     path('dashboard/', healthcare_dashboard, name='healthcare_dashboard'),
-    path('api/merged-service-areas/', merged_service_areas, name='merged_service_areas')
+    path('api/merged-service-areas/', merged_service_areas, name='merged_service_areas'),
+    path('api/coverage-scenario/', coverage_scenario, name='coverage_scenario'),
+    path('api/layers/<str:name>/', map_layer, name='map_layer'),
+    path('api/exports/<str:name>/', export_results, name='export_results'),
+    path('api/snapshots/', snapshot_index, name='snapshot_index'),
+    path('api/snapshots/<str:name>/', snapshot_file, name='snapshot_file')
 
 
 
@@ -1,83 +1,95 @@
 from django.shortcuts import render
-from django.core.serializers import serialize
-from .models import HealthCareFacility, KenyaCounty, KenyaConstituency, KenyaWard, PopulationDensity
+from .models import HealthCareFacility, KenyaWard, PopulationDensity
 from django.views.decorators.csrf import csrf_exempt
-import rasterio
-from rasterio.windows import from_bounds
+from asgiref.sync import sync_to_async
+from affine import Affine
 import numpy as np
 import json
-import traceback
-import pyproj
-from shapely.geometry import shape, Point, Polygon, mapping
-from shapely.ops import transform, unary_union
-from functools import partial
-import rasterio.mask
-from django.http import JsonResponse
-import networkx as nx
-import osmnx as ox
-from scipy.spatial import ConvexHull, Delaunay
-import geopandas as gpd
-import time
 import os
-import pickle
-from shapely.affinity import scale
+import shapely
+from shapely.geometry import shape, mapping
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import parse_etags
+import time
 from decimal import Decimal
+import logging
+from .instrumentation import phase
+from . import (boundaries, categories, coverage, cube, distance, exports, geometry, hexbins, kde, layers, nearest,
+               population, snapshots, spatial_sql)
+from .metrics import record_raster_read
+from .offload import iterate as offload_iterate, offload, offload_map
 
 
+logger = logging.getLogger(__name__)
 
-def facility_map(request):
-    # Get Kisumu data
-    kisumu_county = KenyaCounty.objects.get(county__iexact='KISUMU')
-    kisumu_constituencies = KenyaConstituency.objects.filter(county_nam__iexact='KISUMU')
-    kisumu_wards = KenyaWard.objects.filter(county__iexact='KISUMU')
-    
-    # Get selected facilities in Kisumu
-    selected_facilities = HealthCareFacility.objects.exclude(
-        facility_type__in=['Dispensary', 'Pharmacy', 'VCT Centre (Stand-Alone)',
-                            'Laboratory (Stand-alone)', 'Nursing Home', 'Health Programme',   
-                            ]
-    )
-
-    # Serialize data to GeoJSON
-    county_json = serialize('geojson', [kisumu_county],
-        geometry_field='geom',
-        fields=('county',)
-    )
+# Uniform service area radius (in km) of the dashboard's coverage statistics
+DASHBOARD_RADIUS_KM = 5.0
 
-    # Get population density datasets
-    population_datasets = PopulationDensity.objects.all().order_by('-year')
+# Site suitability scores every candidate that could rank among the best this many in full;
+# the others are screened out using bounds on their score from the population summed-area table
+SUITABILITY_SHORTLIST = 100
+
+# Layers of the population change endpoint
+CHANGE_LAYERS = ('difference', 'growth', 'trend')
 
-    constituencies_json = serialize('geojson', kisumu_constituencies,
-        geometry_field='geom',
-        fields=('const_name', 'const_no')
-    )
+# Most neighbours per point, and most points, of one nearest-facilities request
+NEAREST_MAX_K = 50
+NEAREST_MAX_POINTS = 10000
 
-    wards_json = serialize('geojson', kisumu_wards,
-        geometry_field='geom',
-        fields=('ward', 'pop2019', 'subcounty')
-    )
 
-    facilities_json = serialize('geojson', selected_facilities,
-        geometry_field='location',
-        fields=('name', 'facility_type', 'capacity')
-    )
+def select_dataset(request, data=None):
+    """The population dataset a request asks for, by `dataset` id or `year`, else the default one
+
+    The parameters are read from the query string, or from the JSON body `data`
+    if given. Returns None if there is no such dataset.
+    """
+    params = request.GET.dict()
+    if isinstance(data, dict):
+        params.update({key: data[key] for key in ('dataset', 'year') if data.get(key) is not None})
+    try:
+        if params.get('dataset'):
+            return PopulationDensity.objects.filter(pk=int(params['dataset'])).first()
+        if params.get('year'):
+            return PopulationDensity.objects.filter(year=int(params['year'])).order_by('-pk').first()
+    except (TypeError, ValueError):
+        return None
+    return PopulationDensity.objects.first()
+
+
+def server_error(message, *args):
+    """Log the exception being handled and answer 500 without its details"""
+    logger.exception(message, *args)
+    return JsonResponse({'error': 'Internal server error'}, status=500)
+
+
+def facility_map(request):
+    # Kisumu county, constituencies, wards and selected facilities are loaded by the
+    # page from their versioned layer artifacts
+    with phase('serialize'):
+        layer_urls = {name: layers.url(name) for name in ('county', 'constituencies', 'wards', 'facilities')}
+
+    # Get population density datasets
+    population_datasets = PopulationDensity.objects.all().order_by('-year')
 
     context = {
-        'county': county_json,
-        'constituencies': constituencies_json,
-        'wards': wards_json,
-        'facilities': facilities_json,
+        'layer_urls': layer_urls,
         'population_datasets': population_datasets
     }
 
     return render(request, 'maps/facility_map.html', context)
 
 
+@offload_map
 @csrf_exempt
 def get_population_density(request):
     """API endpoint to get population density data"""
+    import rasterio
+    from rasterio.windows import from_bounds
     try:
-        dataset = PopulationDensity.objects.first()
+        with phase('db'):
+            dataset = select_dataset(request)
         
         if not dataset:
             return JsonResponse({'error': 'No population dataset available'}, status=404)
@@ -97,7 +109,8 @@ def get_population_density(request):
         
        
         # Get Kisumu boundary for clipping
-        kisumu_boundary = get_kisumu_boundary()
+        with phase('db'):
+            kisumu_boundary = get_kisumu_boundary()
 
         # If bounds are provided, ensure they intersect with Kisumu
         if use_bounds and kisumu_boundary:
@@ -117,17 +130,19 @@ def get_population_density(request):
         
         with rasterio.open(dataset.raster_file.path) as src:
             # If bounds are provided and we want to use them, read only that window
-            if use_bounds:
-                # Convert geographic bounds to pixel window
-                window = from_bounds(*bounds, src.transform)
-                # Read the data for the window
-                data = src.read(1, window=window)
-                # Get the window transform
-                window_transform = rasterio.windows.transform(window, src.transform)
-            else:
-                # Read the entire dataset (should be manageable if clipped to Kisumu)
-                data = src.read(1)
-                window_transform = src.transform
+            with phase('raster'):
+                if use_bounds:
+                    # Convert geographic bounds to pixel window
+                    window = from_bounds(*bounds, src.transform)
+                    # Read the data for the window
+                    data = src.read(1, window=window)
+                    # Get the window transform
+                    window_transform = rasterio.windows.transform(window, src.transform)
+                else:
+                    # Read the entire dataset (should be manageable if clipped to Kisumu)
+                    data = src.read(1)
+                    window_transform = src.transform
+                record_raster_read(data, 'window' if use_bounds else 'full')
             
             # Determine appropriate downsample factor based on data size
             total_pixels = data.shape[0] * data.shape[1]
@@ -141,26 +156,32 @@ def get_population_density(request):
                 # For smaller datasets, use less aggressive downsampling
                 downsample_factor = max(1, int(np.sqrt(total_pixels / 2500)))
             
-            print(f"Total pixels: {total_pixels}, using downsample factor: {downsample_factor}")
+            logger.debug("Total pixels: %s, using downsample factor: %s", total_pixels, downsample_factor)
             
             # Downsample the data
             downsampled = data[::downsample_factor, ::downsample_factor]
             
             # Create a list of [lon, lat, value] for each cell
             points = []
-            for y in range(0, downsampled.shape[0]):
-                for x in range(0, downsampled.shape[1]):
-                    # Convert pixel coordinates to geographic coordinates
-                    lon, lat = window_transform * (x * downsample_factor, y * downsample_factor)
-                    value = float(downsampled[y, x])
-                    
-                    # Skip nodata values and zeros
-                    if not np.isnan(value) and value > 0:
-                        # Scale the value for better visualization (optional)
-                        # For population density, log scale often works well
-                        scaled_value = np.log1p(value)  # log(1+x) to handle zeros
-                        points.append([lat, lon, scaled_value])  # Note: swapped to [lat, lon, value] for Leaflet
+            with phase('serialize'):
+                for y in range(0, downsampled.shape[0]):
+                    for x in range(0, downsampled.shape[1]):
+                        # Convert pixel coordinates to geographic coordinates
+                        lon, lat = window_transform * (x * downsample_factor, y * downsample_factor)
+                        value = float(downsampled[y, x])
+                        
+                        # Skip nodata values and zeros
+                        if not np.isnan(value) and value > 0:
+                            # Scale the value for better visualization (optional)
+                            # For population density, log scale often works well
+                            scaled_value = np.log1p(value)  # log(1+x) to handle zeros
+                            points.append([lat, lon, scaled_value])  # Note: swapped to [lat, lon, value] for Leaflet
             
+            # Total population of the window from the summed-area table of the population grid
+            with phase('raster'):
+                grid = population.get(dataset.raster_file.path)
+                total_population = grid.bbox(bounds)['population'] if use_bounds else grid.total
+
             # Calculate statistics from the data
             valid_data = data[~np.isnan(data) & (data > 0)]
             if len(valid_data) > 0:
@@ -183,27 +204,25 @@ def get_population_density(request):
                 'mean': mean_val,
                 'log_min': log_min,
                 'log_max': log_max,
+                'total_population': int(round(total_population)),
                 'downsample_factor': downsample_factor,
                 'point_count': len(points)
             })
     
     except PopulationDensity.DoesNotExist:
         return JsonResponse({'error': 'Dataset not found'}, status=404)
-    except Exception as e:
-        import traceback
-        return JsonResponse({
-            'error': str(e),
-            'traceback': traceback.format_exc()
-        }, status=500)
+    except Exception:
+        return server_error("Error reading population density")
 
 
+@offload_map
 @csrf_exempt
 def get_population_density_for_area(request):
     """API endpoint to get population density for a specific GeoJSON area"""
     # Debug request information
-    print("Request method:", request.method)
-    print("Content type:", request.content_type)
-    print("Request body length:", len(request.body))
+    logger.debug("Request method: %s", request.method)
+    logger.debug("Content type: %s", request.content_type)
+    logger.debug("Request body length: %s", len(request.body))
     
     try:
         # Check if this is a GET request
@@ -243,7 +262,7 @@ def get_population_density_for_area(request):
             return JsonResponse({'error': 'No area provided in the request body'}, status=400)
         
         # Log what we received
-        print("Received GeoJSON type:", geojson_area.get('type'))
+        logger.debug("Received GeoJSON type: %s", geojson_area.get('type'))
         
         # Handle FeatureCollection
         if geojson_area.get('type') == 'FeatureCollection':
@@ -251,537 +270,510 @@ def get_population_density_for_area(request):
                 return JsonResponse({'error': 'Empty FeatureCollection'}, status=400)
             # Use the first feature
             geojson_area = geojson_area['features'][0]
-            print("Extracted feature from collection")
+            logger.debug("Extracted feature from collection")
         
         # SECTION 1: Convert GeoJSON to a shapely geometry
         try:
-            print("Converting GeoJSON to shapely geometry")
+            logger.debug("Converting GeoJSON to shapely geometry")
             geom = shape(geojson_area['geometry'])
-            print("Geometry type:", geom.geom_type)
-            print("Geometry is valid:", geom.is_valid)
+            logger.debug("Geometry type: %s", geom.geom_type)
+            logger.debug("Geometry is valid: %s", geom.is_valid)
         except Exception as e:
-            print("Error converting to shapely geometry:", str(e))
+            logger.warning("Error converting to shapely geometry: %s", e)
             return JsonResponse({'error': f'Error converting GeoJSON to shapely geometry: {str(e)}'}, status=400)
         
         # Get Kisumu boundary
-        kisumu_boundary = get_kisumu_boundary()
+        with phase('db'):
+            kisumu_boundary = get_kisumu_boundary()
 
         # Clip the input geometry to Kisumu boundary
         if kisumu_boundary:
-            print("Clipping input geometry to Kisumu County boundary...")
+            logger.debug("Clipping input geometry to Kisumu County boundary...")
             geom = geom.intersection(kisumu_boundary)
             if geom.is_empty:
                 return JsonResponse({'error': 'The provided area does not intersect with Kisumu County'}, status=400)
         
         # SECTION 2: Calculate area in square kilometers
         try:
-            print("Calculating area")
-            # Define projections
-            wgs84 = pyproj.CRS('EPSG:4326')  # WGS84 (lat/lon)
-            utm = pyproj.CRS('EPSG:32736')   # UTM zone 36S (covers Kenya)
-
-            # Create transformer using the newer API
-            transformer = pyproj.Transformer.from_crs(wgs84, utm, always_xy=True)
-            
-            # Define a function that uses the transformer
-            def transform_fn(x, y):
-                return transformer.transform(x, y)
-                    # Project geometry to UTM for accurate area calculation
-            
-            geom_utm = transform(transform_fn, geom)
-            
-            # Calculate area in square kilometers
-            area_km2 = geom_utm.area / 1000000
-            print(f"Calculated area: {area_km2} km²")
+            logger.debug("Calculating area")
+            with phase('area'):
+                area_km2 = float(geometry.areas_km2(geom))
+            logger.debug("Calculated area: %s km²", area_km2)
         except Exception as e:
-            print("Error calculating area:", str(e))
-            print(traceback.format_exc())
-            
-            # Fallback: calculate area using the unprojected geometry
-            try:
-                # This is less accurate but better than nothing
-                area_m2 = geom.area * 111319 * 111319  # Rough conversion from degrees to meters
-                area_km2 = area_m2 / 1000000
-                print(f"Fallback area calculation: {area_km2} km²")
-            except Exception as e2:
-                print("Error in fallback area calculation:", str(e2))
-                return JsonResponse({'error': f'Error calculating area: {str(e)} / {str(e2)}'}, status=500)
+            logger.exception("Error calculating area: %s", e)
+            # Fall back to the area of the population grid pixels inside the geometry
+            area_km2 = None
         
         # Get the population density dataset
-        dataset = PopulationDensity.objects.first()
+        with phase('db'):
+            dataset = select_dataset(request, data)
         if not dataset:
             return JsonResponse({'error': 'No population dataset available'}, status=404)
         
-        print("Using dataset:", dataset.name, dataset.year)
-        print("Raster file path:", dataset.raster_file.path)
+        logger.debug("Using dataset: %s %s", dataset.name, dataset.year)
+        logger.debug("Raster file path: %s", dataset.raster_file.path)
         
-        # SECTION 3: Open the raster file and process it
+        # SECTION 3: Sum the population grid inside the geometry
         try:
-            print("Opening raster file")
-            with rasterio.open(dataset.raster_file.path) as src:
-                print("Raster CRS:", src.crs)
-                print("Raster bounds:", src.bounds)
-                print("Raster shape:", src.shape)
+            with phase('raster'):
+                zone = population.get(dataset.raster_file.path).zonal(geom)
+            if area_km2 is None:
+                area_km2 = zone['area_km2']
+                logger.debug("Fallback area calculation: %s km²", area_km2)
+
+            # Densities of the populated pixels
+            valid_data = zone['density']
+            logger.debug("Valid data points: %s", len(valid_data))
+
+            if len(valid_data) > 0:
+                # Calculate statistics
+                min_val = float(np.min(valid_data))
+                max_val = float(np.max(valid_data))
+                mean_val = float(np.mean(valid_data))
+                median_val = float(np.median(valid_data))
+
+                logger.debug("Statistics - Min: %s, Max: %s, Mean: %s, Median: %s", min_val, max_val, mean_val, median_val)
+
+                # Persons per pixel summed over the area
+                total_population = int(round(zone['population']))
+
+                # Calculate percentiles
+                percentiles = np.percentile(valid_data, [25, 50, 75, 90])
+
+                return JsonResponse({
+                    'name': dataset.name,
+                    'year': dataset.year,
+                    'min_density': min_val,
+                    'max_density': max_val,
+                    'mean_density': mean_val,
+                    'median_density': median_val,
+                    'percentile_25': float(percentiles[0]),
+                    'percentile_50': float(percentiles[1]),
+                    'percentile_75': float(percentiles[2]),
+                    'percentile_90': float(percentiles[3]),
+                    'area_km2': area_km2,
+                    'estimated_population': total_population
+                })
+            else:
+                return JsonResponse({
+                    'error': 'No valid population data found in the specified area',
+                    'area_km2': area_km2,
+                    'mean_density': 0,
+                    'estimated_population': 0
+                }, status=404)
+        except Exception:
+            return server_error("Error processing raster")
+        
+    except Exception:
+        return server_error("Error in API")
+
+@csrf_exempt
+def population_in_bbox(request):
+    """API endpoint for the population inside a bounding box, from the summed-area table"""
+    try:
+        # Format: "west,south,east,north"
+        try:
+            west, south, east, north = map(float, request.GET['bbox'].split(','))
+        except (KeyError, ValueError):
+            return JsonResponse({'error': 'bbox must be "west,south,east,north" in degrees'}, status=400)
+        if west >= east or south >= north:
+            return JsonResponse({'error': 'bbox must have west < east and south < north'}, status=400)
+
+        with phase('db'):
+            dataset = select_dataset(request)
+        if not dataset:
+            return JsonResponse({'error': 'No population dataset available'}, status=404)
+
+        with phase('raster'):
+            result = population.get(dataset.raster_file.path).bbox((west, south, east, north))
+
+        return JsonResponse({
+            'name': dataset.name,
+            'year': dataset.year,
+            'bbox': [west, south, east, north],
+            # The pixels whose centres lie in the bbox, and their extent
+            'pixel_bbox': result['bounds'],
+            'pixels': result['pixels'],
+            'population': int(round(result['population'])),
+            'area_km2': result['area_km2'],
+            'density': result['population'] / result['area_km2'] if result['area_km2'] > 0 else 0,
+        })
+
+    except Exception:
+        return server_error("Error summing population in bbox")
+
+
+@offload
+@csrf_exempt
+def hexbins_view(request):
+    """API endpoint for hexagon aggregates of population, facilities and coverage at one resolution
+
+    ?resolution= is an index into hexbins.RESOLUTIONS_M (0 is the coarsest);
+    ?format=binary returns packed columns instead of columnar JSON.
+    """
+    try:
+        try:
+            resolution = int(request.GET.get('resolution', 2))
+            if not 0 <= resolution < len(hexbins.RESOLUTIONS_M):
+                raise ValueError
+        except ValueError:
+            return JsonResponse({'error': 'resolution must be an index into resolutions (hexagon size in metres)',
+                                 'resolutions': list(hexbins.RESOLUTIONS_M)}, status=400)
+        output_format = request.GET.get('format', 'json')
+        if output_format not in ('json', 'binary'):
+            return JsonResponse({'error': 'format must be json or binary'}, status=400)
+
+        with phase('db'):
+            dataset = select_dataset(request)
+            if not dataset:
+                return JsonResponse({'error': 'No population dataset available'}, status=404)
+            facilities = list(HealthCareFacility.objects.served())
+            wards = list(KenyaWard.objects.in_county('KISUMU'))
+            boundary = get_kisumu_boundary()
+        radii_km = categories.policy().radii_km(facilities)
+
+        with phase('hexbins'):
+            bins = hexbins.get(dataset.raster_file.path, facilities, radii_km, wards, boundary)
+
+        etag = f'"{bins.version}.{resolution}.{output_format}"'
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        elif output_format == 'binary':
+            with phase('serialize'):
+                response = HttpResponse(bins.pack(resolution), content_type='application/octet-stream')
+        else:
+            with phase('serialize'):
+                response = JsonResponse({
+                    'name': dataset.name,
+                    'year': dataset.year,
+                    'resolution': resolution,
+                    'size_m': hexbins.RESOLUTIONS_M[resolution],
+                    'count': len(bins.resolutions[resolution]['q']),
+                    'columns': bins.columns(resolution),
+                })
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    except Exception:
+        return server_error("Error building hexbins")
+
+
+def to_float(value):
+    """Convert value to float, handling Decimal types"""
+    if isinstance(value, Decimal):
+        return float(value)
+    return float(value) if value is not None else 0.0
+
+
+def suitability_candidates(existing_facilities, kisumu_boundary, kisumu_wards, grid, target_facility_type):
+    """Candidate sites for a new facility of `target_facility_type`, with everything needed to score them
+
+    The candidates are a regular grid of points over the county outside the
+    existing facilities' service areas. Returns None if those service areas
+    cover the whole county.
+    """
+    # Buffer sizes and expected populations by facility type come from the category policy
+    policy = categories.policy()
+    
+    # Get buffer size for target facility type
+    target_buffer_size = policy.radius_km(target_facility_type)
+    logger.debug("Using %skm buffer for analysis", target_buffer_size)
+    
+    # Create buffers around existing facilities based on their type
+    with phase('buffer'):
+        lons, lats = geometry.coordinates(existing_facilities)
+        radii_km = policy.radii_km(existing_facilities)
+        facility_buffers = geometry.metric_buffers(lons, lats, radii_km)
+    
+    logger.debug("Created %s facility buffers", len(facility_buffers))
+    
+    with phase('union'):
+        merged_buffer = geometry.union(facility_buffers)
+        logger.debug("Merged all facility buffers")
+    
+        # Find areas outside the buffer (underserved areas)
+        underserved_areas = kisumu_boundary.difference(merged_buffer)
+    logger.debug("Identified underserved areas: %s square degrees", underserved_areas.area)
+    
+    if underserved_areas.is_empty:
+        return None
+    
+    ward_names = [ward.ward for ward in kisumu_wards]
+    ward_geometries = geometry.from_django(ward.geom for ward in kisumu_wards)
+    # Convert to float to avoid Decimal issues
+    ward_populations = {ward.ward: to_float(ward.pop2019 or 0) for ward in kisumu_wards}
+    
+    # Ward areas and existing coverage are the same for every candidate site
+    with phase('wards'):
+        ward_areas_km2 = geometry.areas_km2(ward_geometries)
+        ward_coverage_km2 = geometry.areas_km2(shapely.intersection(ward_geometries, merged_buffer))
+    
+    # Create a grid of potential facility locations
+    # Adjust grid size based on county size
+    county_area_km2 = float(geometry.areas_km2(underserved_areas))
+    
+    # Adaptive grid size - smaller grid for smaller counties
+    if county_area_km2 < 1000:
+        grid_size = 0.005  # ~500m grid for small counties
+    elif county_area_km2 < 3000:
+        grid_size = 0.008  # ~800m grid for medium counties
+    else:
+        grid_size = 0.01   # ~1km grid for large counties
+    
+    logger.debug("Using grid size of %s degrees (~%.1fkm)", grid_size, grid_size*111)
+    
+    # Get bounds of underserved areas
+    minx, miny, maxx, maxy = underserved_areas.bounds
+    
+    logger.debug("Creating grid within bounds: %s, %s, %s, %s", minx, miny, maxx, maxy)
+    
+    # Create grid points
+    with phase('grid'):
+        grid_x, grid_y = np.meshgrid(np.arange(minx, maxx, grid_size), np.arange(miny, maxy, grid_size), indexing='ij')
+        grid_x, grid_y = grid_x.ravel(), grid_y.ravel()
+        shapely.prepare(underserved_areas)
+        inside = shapely.contains_xy(underserved_areas, grid_x, grid_y)
+        grid_points = shapely.points(grid_x[inside], grid_y[inside])
+    
+    logger.debug("Created %s grid points in underserved areas", len(grid_points))
+    
+    # Get county-wide population density statistics
+    with phase('raster'):
+        county_density_stats = {}
+        try:
+            # Densities of the populated pixels of the county
+            valid_county_data = grid.zonal(kisumu_boundary)['density']
+        
+            if len(valid_county_data) > 0:
+                county_density_stats = {
+                    'min': float(np.min(valid_county_data)),
+                    'max': float(np.max(valid_county_data)),
+                    'mean': float(np.mean(valid_county_data)),
+                    'median': float(np.median(valid_county_data)),
+                    'p75': float(np.percentile(valid_county_data, 75)),
+                    'p90': float(np.percentile(valid_county_data, 90))
+                }
+                logger.debug("County density stats: min=%.1f, max=%.1f, mean=%.1f",
+                             county_density_stats['min'], county_density_stats['max'], county_density_stats['mean'])
+        except Exception as e:
+            logger.warning("Error calculating county density stats: %s", e)
+            county_density_stats = {'max': 1000.0, 'mean': 500.0}  # Fallback values
+    
+    with phase('scoring'):
+        # Service areas, their sizes and the ward of every candidate site, each in one call
+        service_areas = geometry.metric_buffers(shapely.get_x(grid_points), shapely.get_y(grid_points), target_buffer_size)
+        service_areas_km2 = geometry.areas_km2(service_areas)
+        point_wards = geometry.locate(grid_points, ward_geometries)
+    
+    return {
+        'facility_type': target_facility_type,
+        'buffer_km': float(target_buffer_size),
+        'underserved_areas': underserved_areas,
+        'grid': grid,
+        'points': grid_points,
+        'service_areas': service_areas,
+        'service_areas_km2': service_areas_km2,
+        'point_wards': point_wards,
+        'ward_names': ward_names,
+        'ward_populations': ward_populations,
+        'ward_areas_km2': ward_areas_km2,
+        'ward_coverage_km2': ward_coverage_km2,
+        'density_max': to_float(county_density_stats.get('max', 1000)),
+        # Normalize based on expected population for facility type
+        'target_pop': to_float(policy.expected_population(target_facility_type)),
+        # Weights should sum to 1.0
+        'weights': {
+            'population_served': 0.35,  # Population served is most important
+            'coverage': 0.25,          # Low existing coverage is important
+            'ward_population': 0.15,   # Ward population is moderately important
+            'density': 0.20,           # Population density is moderately important
+            'accessibility': 0.15      # Accessibility is least important
+        },
+    }
+
+
+def score_sites(candidates, indices):
+    """Score the candidate sites `indices` of `suitability_candidates`, yielding one GeoJSON feature per site
+
+    A site with no populated pixel in its service area yields nothing.
+    """
+    grid = candidates['grid']
+    points, service_areas = candidates['points'], candidates['service_areas']
+    point_wards, ward_names = candidates['point_wards'], candidates['ward_names']
+    ward_populations = candidates['ward_populations']
+    density_max, target_pop, weights = candidates['density_max'], candidates['target_pop'], candidates['weights']
+
+    for point_idx in indices:
+        point = points[point_idx]
+        try:
+            # Service area around this point based on target facility type
+            service_area = service_areas[point_idx]
+        
+            # Calculate population served by this location
+            try:
+                # Population grid inside the service area
+                zone = grid.zonal(service_area)
+                valid_data = zone['density']
+            
+                if len(valid_data) > 0:
+                    # Calculate mean density
+                    mean_density = float(np.mean(valid_data))
+                    max_density = float(np.max(valid_data))
                 
-                # Create a mask for the geometry
-                geometry = [geom]
+                    # Area in square kilometers
+                    area_km2 = float(candidates['service_areas_km2'][point_idx])
                 
-                print("Creating mask for geometry")
-                # This gets the data only within the geometry
-                out_image, out_transform = rasterio.mask.mask(src, geometry, crop=True, all_touched=True)
+                    # Persons per pixel summed over the service area
+                    population_served = int(round(zone['population']))
                 
-                print("Mask created, processing data")
-                print("Out image shape:", out_image.shape)
+                    # Ward this point is in
+                    ward = None
+                    ward_pop = 0
+                    ward_idx = point_wards[point_idx]
+                    if ward_idx >= 0:
+                        ward = ward_names[ward_idx]
+                        ward_pop = to_float(ward_populations.get(ward, 0))
                 
-                # Get the valid data (non-nodata values)
-                valid_data = out_image[0][~np.isnan(out_image[0]) & (out_image[0] > 0)]
-                print("Valid data points:", len(valid_data))
+                    # Calculate ward coverage
+                    ward_coverage_percent = 0
                 
-                if len(valid_data) > 0:
-                    # Calculate statistics
-                    min_val = float(np.min(valid_data))
-                    max_val = float(np.max(valid_data))
-                    mean_val = float(np.mean(valid_data))
-                    median_val = float(np.median(valid_data))
+                    if ward:
+                        # How much of the ward is already covered by existing facilities
+                        ward_area_km2 = float(candidates['ward_areas_km2'][ward_idx])
+                        coverage_km2 = float(candidates['ward_coverage_km2'][ward_idx])
                     
-                    print(f"Statistics - Min: {min_val}, Max: {max_val}, Mean: {mean_val}, Median: {median_val}")
-                    
-                    # Calculate total population in the area
-                    total_population = int(mean_val * area_km2)
-                    
-                    # Calculate percentiles
-                    percentiles = np.percentile(valid_data, [25, 50, 75, 90])
-                    
-                    return JsonResponse({
-                        'name': dataset.name,
-                        'year': dataset.year,
-                        'min_density': min_val,
-                        'max_density': max_val,
-                        'mean_density': mean_val,
-                        'median_density': median_val,
-                        'percentile_25': float(percentiles[0]),
-                        'percentile_50': float(percentiles[1]),
-                        'percentile_75': float(percentiles[2]),
-                        'percentile_90': float(percentiles[3]),
-                        'area_km2': area_km2,
-                        'estimated_population': total_population
-                    })
-                else:
-                    return JsonResponse({
-                        'error': 'No valid population data found in the specified area',
-                        'area_km2': area_km2,
-                        'mean_density': 0,
-                        'estimated_population': 0
-                    }, status=404)
+                        # Calculate percentage covered
+                        if ward_area_km2 > 0:
+                            ward_coverage_percent = (coverage_km2 / ward_area_km2) * 100
+                
+                    # Calculate scores for different factors
+                
+                    # 1. Population density score (0-1)
+                    # Normalize against county-wide statistics
+                    density_score = min(mean_density / (density_max * 0.7), 1.0)
+                
+                    # 2. Ward coverage score (0-1)
+                    # Lower coverage is better for new facilities
+                    coverage_score = 1.0 - min(ward_coverage_percent / 100, 1.0)
+                
+                    # 3. Population served score (0-1)
+                    population_score = min(population_served / target_pop, 1.0)
+                
+                    # 4. Ward population score (0-1)
+                    # Higher ward population is better
+                    ward_pop_score = min(to_float(ward_pop) / 50000, 1.0)
+                
+                    # 5. Accessibility score (0-1)
+                    # Areas with higher max density might indicate urban centers with better access
+                    accessibility_score = min(max_density / density_max, 1.0)
+                
+                    # Calculate composite score with weighted factors
+                    composite_score = (
+                        (weights['population_served'] * population_score) +
+                        (weights['coverage'] * coverage_score) +
+                        (weights['ward_population'] * ward_pop_score) +
+                        (weights['density'] * density_score) +
+                        (weights['accessibility'] * accessibility_score)
+                    )
+                
+                    # Score this location
+                    yield {
+                        'type': 'Feature',
+                        'geometry': mapping(point),
+                        'properties': {
+                            'population_served': population_served,
+                            'area_km2': float(area_km2),
+                            'mean_density': float(mean_density),
+                            'max_density': float(max_density),
+                            'ward': ward,
+                            'ward_population': float(ward_pop),
+                            'ward_coverage_percent': round(float(ward_coverage_percent), 1),
+                            'density_score': round(float(density_score), 2),
+                            'coverage_score': round(float(coverage_score), 2),
+                            'population_score': round(float(population_score), 2),
+                            'ward_pop_score': round(float(ward_pop_score), 2),
+                            'accessibility_score': round(float(accessibility_score), 2),
+                            'composite_score': round(float(composite_score), 2),
+                            'facility_type': candidates['facility_type'],
+                            'buffer_km': candidates['buffer_km']
+                        }
+                    }
+            except Exception as e:
+                logger.warning("Error analyzing point %s: %s", point.wkt, e)
         except Exception as e:
-            print("Error processing raster:", str(e))
-            print(traceback.format_exc())
-            return JsonResponse({
-                'error': f'Error processing raster: {str(e)}',
-                'traceback': traceback.format_exc()
-            }, status=500)
-        
-    except Exception as e:
-        print("Error in API:", str(e))
-        print(traceback.format_exc())
-        return JsonResponse({
-            'error': str(e),
-            'traceback': traceback.format_exc()
-        }, status=500)
+            logger.warning("Error processing point: %s", e)
+
 
+@offload
 @csrf_exempt
 def site_suitability_analysis(request):
     """API endpoint to identify optimal locations for new healthcare facilities"""
-    from decimal import Decimal
-    
-    # Helper function to convert values to float
-    def to_float(value):
-        """Convert value to float, handling Decimal types"""
-        if isinstance(value, Decimal):
-            return float(value)
-        return float(value) if value is not None else 0.0
-    
     try:
-        print("Starting site suitability analysis...")
+        logger.debug("Starting site suitability analysis...")
         start_time = time.time()
         
         # Get facility type from request (optional)
         target_facility_type = request.GET.get('facility_type', 'Health Centre')
-        print(f"Target facility type: {target_facility_type}")
-        
-        # Define buffer sizes for different facility types (in km)
-        buffer_sizes = {
-            'District Hospital': 8.0,                  # Larger radius for hospitals
-            'Povincial General Hospital': 10.0,        # Medium radius for health centers
-            'Medical Clinic': 3.0,                     # Standard radius for clinics
-            'Other Hospital': 5.0,                     # Medium radius for medical centers
-            'Sub-District Hospital': 6.0,              # Medium radius
-            'Health Center': 3.0,
-        }
-        
-        # Get buffer size for target facility type
-        target_buffer_size = buffer_sizes.get(target_facility_type, 5.0)
-        print(f"Using {target_buffer_size}km buffer for analysis")
+        logger.debug("Target facility type: %s", target_facility_type)
         
         # Get existing facilities
-        existing_facilities = HealthCareFacility.objects.exclude(
-            facility_type__in=['Dispensary', 'Pharmacy', 'VCT Centre (Stand-Alone)',
-                              'Laboratory (Stand-alone)', 'Nursing Home', 'Health Programme']
-        )
+        with phase('db'):
+            existing_facilities = list(HealthCareFacility.objects.served())
         
-        # Get population density data
-        population_dataset = PopulationDensity.objects.first()
-        if not population_dataset:
-            return JsonResponse({'error': 'No population dataset available'}, status=404)
+            # Get population density data
+            population_dataset = select_dataset(request)
+            if not population_dataset:
+                return JsonResponse({'error': 'No population dataset available'}, status=404)
         
-        # Get Kisumu boundary
-        kisumu_county = KenyaCounty.objects.get(county__iexact='KISUMU')
-        kisumu_boundary = shape(json.loads(kisumu_county.geom.json))  # Convert to shapely geometry
+            # Get Kisumu boundary
+            kisumu_boundary = get_kisumu_boundary()
         
         if not kisumu_boundary:
             return JsonResponse({'error': 'Could not retrieve Kisumu boundary'}, status=500)
         
-        print(f"Processing {existing_facilities.count()} existing facilities...")
-        
-        # Create buffers around existing facilities based on their type
-        facility_buffers = []
-        for facility in existing_facilities:
-            try:
-                # Get facility point as shapely geometry
-                facility_point = shape(json.loads(facility.location.json))
-                
-                # Get buffer size based on facility type
-                facility_type = facility.facility_type
-                buffer_size_km = buffer_sizes.get(facility_type, 5.0)
-                
-                # Create buffer
-                lat = to_float(facility_point.y)
-                lon = to_float(facility_point.x)
-                
-                # Calculate approximate degrees for buffer
-                lat_km_per_degree = 111.0
-                lon_km_per_degree = 111.0 * np.cos(np.radians(lat))
-                
-                # Convert buffer size to degrees
-                lat_buffer = buffer_size_km / lat_km_per_degree
-                
-                # Create buffer
-                buffer = Point(lon, lat).buffer(lat_buffer)
-                
-                # Scale to account for longitude distortion
-                scale_factor = lon_km_per_degree / lat_km_per_degree
-                buffer = scale(buffer, xfact=scale_factor, yfact=1.0, origin='center')
-                
-                # Ensure buffer is valid
-                if not buffer.is_valid:
-                    buffer = buffer.buffer(0)  # This often fixes invalid geometries
-                
-                if buffer.is_valid:
-                    facility_buffers.append(buffer)
-                    print(f"Created {buffer_size_km}km buffer for {facility.name} ({facility_type})")
-            except Exception as e:
-                print(f"Error creating buffer for facility: {str(e)}")
-                continue
-        
-        print(f"Created {len(facility_buffers)} facility buffers")
+        logger.debug("Processing %s existing facilities...", len(existing_facilities))
         
-        # Merge all buffers
-        if not facility_buffers:
+        if len(existing_facilities) == 0:
             return JsonResponse({'error': 'No valid facility buffers could be created'}, status=500)
         
-        # Merge buffers in batches to avoid memory issues
-        if len(facility_buffers) > 100:
-            print("Large number of buffers, merging in batches")
-            batch_size = 50
-            merged_buffer = None
-            
-            for i in range(0, len(facility_buffers), batch_size):
-                batch = facility_buffers[i:i+batch_size]
-                batch_merged = unary_union(batch)
-                
-                if merged_buffer is None:
-                    merged_buffer = batch_merged
-                else:
-                    merged_buffer = unary_union([merged_buffer, batch_merged])
-                
-                print(f"Merged batch {i//batch_size + 1}/{(len(facility_buffers)+batch_size-1)//batch_size}")
-        else:
-            merged_buffer = unary_union(facility_buffers)
+        # Get all wards for later analysis
+        with phase('db'):
+            kisumu_wards = list(KenyaWard.objects.in_county('KISUMU'))
         
-        print("Merged all facility buffers")
+        logger.debug("Loaded %s wards with population data", len(kisumu_wards))
         
-        # Find areas outside the buffer (underserved areas)
-        underserved_areas = kisumu_boundary.difference(merged_buffer)
-        print(f"Identified underserved areas: {underserved_areas.area} square degrees")
+        # Persons per pixel, summed inside the county and each candidate service area
+        with phase('raster'):
+            grid = population.get(population_dataset.raster_file.path)
+        
+        candidates = suitability_candidates(existing_facilities, kisumu_boundary, kisumu_wards, grid,
+                                            target_facility_type)
         
         # If there are no underserved areas, return early
-        if underserved_areas.is_empty:
+        if candidates is None:
             return JsonResponse({
                 'message': f'No underserved areas found. The entire county is within service range of existing facilities.',
                 'processing_time': time.time() - start_time
             })
         
-        # Get all wards for later analysis
-        kisumu_wards = list(KenyaWard.objects.filter(county__iexact='KISUMU'))
-        ward_geometries = {}
-        ward_populations = {}
-        
-        for ward in kisumu_wards:
-            ward_geometries[ward.ward] = shape(json.loads(ward.geom.json))
-            # Convert to float to avoid Decimal issues
-            ward_populations[ward.ward] = to_float(ward.pop2019 or 0)
-        
-        print(f"Loaded {len(kisumu_wards)} wards with population data")
-        
-        # Now analyze population density in underserved areas
-        print("Analyzing population density in underserved areas...")
-        
-        # Create a grid of potential facility locations
-        # Adjust grid size based on county size
-        county_area_km2 = to_float(underserved_areas.area) * (111 * 111)  # Rough conversion to km²
-        
-        # Adaptive grid size - smaller grid for smaller counties
-        if county_area_km2 < 1000:
-            grid_size = 0.005  # ~500m grid for small counties
-        elif county_area_km2 < 3000:
-            grid_size = 0.008  # ~800m grid for medium counties
-        else:
-            grid_size = 0.01   # ~1km grid for large counties
-        
-        print(f"Using grid size of {grid_size} degrees (~{grid_size*111:.1f}km)")
-        
-        # Get bounds of underserved areas
-        minx, miny, maxx, maxy = underserved_areas.bounds
-        
-        print(f"Creating grid within bounds: {minx}, {miny}, {maxx}, {maxy}")
-        
-        # Create grid points
-        grid_points = []
-        for x in np.arange(minx, maxx, grid_size):
-            for y in np.arange(miny, maxy, grid_size):
-                point = Point(x, y)
-                if point.within(underserved_areas):
-                    grid_points.append(point)
-        
-        print(f"Created {len(grid_points)} grid points in underserved areas")
+        grid_points = candidates['points']
         
         # If no grid points were created, return early
-        if not grid_points:
+        if len(grid_points) == 0:
             return JsonResponse({
                 'message': 'Could not create grid points in underserved areas.',
                 'processing_time': time.time() - start_time
             })
         
-        # Score each point based on population served
-        scored_locations = []
-        
-        # Process points in batches to avoid memory issues
-        batch_size = min(100, len(grid_points))
-        num_batches = (len(grid_points) + batch_size - 1) // batch_size
+        with phase('scoring'):
+            shortlist = screen_candidates(candidates)
+            logger.debug("Scoring %s of %s candidate points after screening", len(shortlist), len(grid_points))
         
-        print(f"Processing {len(grid_points)} points in {num_batches} batches of {batch_size}")
-        
-        # Calculate county-wide statistics for normalization
-        county_pop_total = sum(ward_populations.values())
-        print(f"Total county population (2019): {county_pop_total}")
-        
-        # Open the raster file once for all points
-        with rasterio.open(population_dataset.raster_file.path) as src:
-            # Get county-wide population density statistics
-            county_density_stats = {}
-            try:
-                # Create a mask for the county
-                county_image, county_transform = rasterio.mask.mask(src, [kisumu_boundary], crop=True, all_touched=True)
-                valid_county_data = county_image[0][~np.isnan(county_image[0]) & (county_image[0] > 0)]
-                
-                if len(valid_county_data) > 0:
-                    county_density_stats = {
-                        'min': float(np.min(valid_county_data)),
-                        'max': float(np.max(valid_county_data)),
-                        'mean': float(np.mean(valid_county_data)),
-                        'median': float(np.median(valid_county_data)),
-                        'p75': float(np.percentile(valid_county_data, 75)),
-                        'p90': float(np.percentile(valid_county_data, 90))
-                    }
-                    print(f"County density stats: min={county_density_stats['min']:.1f}, "
-                          f"max={county_density_stats['max']:.1f}, mean={county_density_stats['mean']:.1f}")
-            except Exception as e:
-                print(f"Error calculating county density stats: {str(e)}")
-                county_density_stats = {'max': 1000.0, 'mean': 500.0}  # Fallback values
-            
-            for batch_idx in range(num_batches):
-                start_idx = batch_idx * batch_size
-                end_idx = min((batch_idx + 1) * batch_size, len(grid_points))
-                batch_points = grid_points[start_idx:end_idx]
-                
-                print(f"Processing batch {batch_idx + 1}/{num_batches} ({len(batch_points)} points)")
-                
-                for point in batch_points:
-                    try:
-                        # Create a service area around this point based on target facility type
-                        lat = to_float(point.y)
-                        lon = to_float(point.x)
-                        
-                        # Calculate approximate degrees for buffer
-                        lat_km_per_degree = 111.0
-                        lon_km_per_degree = 111.0 * np.cos(np.radians(lat))
-                        
-                        # Convert target buffer size to degrees
-                        lat_buffer = target_buffer_size / lat_km_per_degree
-                        
-                        # Create buffer
-                        service_area = Point(lon, lat).buffer(lat_buffer)
-                        
-                        # Scale to account for longitude distortion
-                        scale_factor = lon_km_per_degree / lat_km_per_degree
-                        service_area = scale(service_area, xfact=scale_factor, yfact=1.0, origin='center')
-                        
-                        # Ensure service area is valid
-                        if not service_area.is_valid:
-                            service_area = service_area.buffer(0)
-                        
-                        if not service_area.is_valid:
-                            continue
-                        
-                        # Calculate population served by this location
-                        try:
-                            # Create a mask for the service area
-                            geometry = [service_area]
-                            
-                            # Get the data only within the service area
-                            area_image, area_transform = rasterio.mask.mask(src, geometry, crop=True, all_touched=True)
-                            
-                            # Get the valid data (non-nodata values)
-                            valid_data = area_image[0][~np.isnan(area_image[0]) & (area_image[0] > 0)]
-                            
-                            if len(valid_data) > 0:
-                                # Calculate mean density
-                                mean_density = float(np.mean(valid_data))
-                                max_density = float(np.max(valid_data))
-                                
-                                # Calculate area in square kilometers
-                                wgs84 = pyproj.CRS('EPSG:4326')
-                                utm = pyproj.CRS('EPSG:32736')
-                                transformer = pyproj.Transformer.from_crs(wgs84, utm, always_xy=True)
-                                
-                                def transform_fn(x, y):
-                                    return transformer.transform(x, y)
-                                
-                                service_area_utm = transform(transform_fn, service_area)
-                                area_km2 = to_float(service_area_utm.area) / 1000000
-                                
-                                # Calculate population served
-                                population_served = int(mean_density * area_km2)
-                                
-                                # Find ward this point is in
-                                ward = None
-                                ward_obj = None
-                                ward_pop = 0
-                                
-                                for ward_name, ward_geom in ward_geometries.items():
-                                    if point.within(ward_geom):
-                                        ward = ward_name
-                                        ward_pop = to_float(ward_populations.get(ward_name, 0))
-                                        break
-                                
-                                # Calculate ward coverage and population metrics
-                                ward_coverage_percent = 0
-                                ward_pop_density = 0
-                                
-                                if ward:
-                                    # Calculate how much of the ward is already covered by existing facilities
-                                    ward_geom = ward_geometries[ward]
-                                    ward_area_utm = transform(transform_fn, ward_geom)
-                                    ward_area_km2 = to_float(ward_area_utm.area) / 1000000
-                                    
-                                    # Calculate intersection with existing facility buffers
-                                    ward_coverage = ward_geom.intersection(merged_buffer)
-                                    ward_coverage_utm = transform(transform_fn, ward_coverage)
-                                    coverage_km2 = to_float(ward_coverage_utm.area) / 1000000
-                                    
-                                    # Calculate percentage covered
-                                    if ward_area_km2 > 0:
-                                        ward_coverage_percent = (coverage_km2 / ward_area_km2) * 100
-                                        ward_pop_density = ward_pop / ward_area_km2
-                                
-                                # Calculate scores for different factors
-                                
-                                # 1. Population density score (0-1)
-                                # Normalize against county-wide statistics
-                                density_max = to_float(county_density_stats.get('max', 1000))
-                                density_score = min(mean_density / (density_max * 0.7), 1.0)
-                                
-                                # 2. Ward coverage score (0-1)
-                                # Lower coverage is better for new facilities
-                                coverage_score = 1.0 - min(ward_coverage_percent / 100, 1.0)
-                                
-                                # 3. Population served score (0-1)
-                                # Normalize based on expected population for facility type
-                                expected_pop = {
-                                    'District Hospital': 300000,                  # Larger radius for hospitals
-                                    'Povincial General Hospital': 800000,        # Medium radius for health centers
-                                    'Medical Clinic': 7500,                       # Standard radius for clinics
-                                    'Other Hospital': 5000,                       # Medium radius for medical centers
-                                    'Sub-District Hospital': 100000,              # Medium radius
-                                    'Health Center': 10000,
-                                }
-                                target_pop = to_float(expected_pop.get(target_facility_type, 30000))
-                                population_score = min(population_served / target_pop, 1.0)
-                                
-                                # 4. Ward population score (0-1)
-                                # Higher ward population is better
-                                ward_pop_score = min(to_float(ward_pop) / 50000, 1.0)
-                                
-                                # 5. Accessibility score (0-1)
-                                # Areas with higher max density might indicate urban centers with better access
-                                accessibility_score = min(max_density / density_max, 1.0)
-                                
-                                # Calculate composite score with weighted factors
-                                # Weights should sum to 1.0
-                                weights = {
-                                    'population_served': 0.35,  # Population served is most important
-                                    'coverage': 0.25,          # Low existing coverage is important
-                                    'ward_population': 0.15,   # Ward population is moderately important
-                                    'density': 0.20,           # Population density is moderately important
-                                    'accessibility': 0.15      # Accessibility is least important
-                                }
-                                
-                                composite_score = (
-                                    (weights['population_served'] * population_score) +
-                                    (weights['coverage'] * coverage_score) +
-                                    (weights['ward_population'] * ward_pop_score) +
-                                    (weights['density'] * density_score) +
-                                    (weights['accessibility'] * accessibility_score)
-                                )
-                                
-                                # Score this location
-                                scored_locations.append({
-                                    'type': 'Feature',
-                                    'geometry': mapping(point),
-                                    'properties': {
-                                        'population_served': population_served,
-                                        'area_km2': float(area_km2),
-                                        'mean_density': float(mean_density),
-                                        'max_density': float(max_density),
-                                        'ward': ward,
-                                        'ward_population': float(ward_pop),
-                                        'ward_coverage_percent': round(float(ward_coverage_percent), 1),
-                                        'density_score': round(float(density_score), 2),
-                                        'coverage_score': round(float(coverage_score), 2),
-                                        'population_score': round(float(population_score), 2),
-                                        'ward_pop_score': round(float(ward_pop_score), 2),
-                                        'accessibility_score': round(float(accessibility_score), 2),
-                                        'composite_score': round(float(composite_score), 2),
-                                        'facility_type': target_facility_type,
-                                        'buffer_km': float(target_buffer_size)
-                                    }
-                                })
-                        except Exception as e:
-                            print(f"Error analyzing point {point.wkt}: {str(e)}")
-                    except Exception as e:
-                        print(f"Error processing point: {str(e)}")
-        
-        print(f"Scored {len(scored_locations)} potential locations")
+            # Score each point based on population served
+            scored_locations = list(score_sites(candidates, shortlist))
+    
+        logger.debug("Scored %s potential locations", len(scored_locations))
         
         # Sort locations by composite score (descending)
         scored_locations.sort(key=lambda x: x['properties']['composite_score'], reverse=True)
@@ -793,18 +785,11 @@ def site_suitability_analysis(request):
             
             # 2. Define a minimum distance between recommended facilities (in degrees)
             # Adjust minimum distance based on facility type
-            min_distance_km = {
-                'District Hospital': 8.0,                  # Larger radius for hospitals
-                'Povincial General Hospital': 10.0,        # Medium radius for health centers
-                'Medical Clinic': 3.0,                     # Standard radius for clinics
-                'Other Hospital': 5.0,                     # Medium radius for medical centers
-                'Sub-District Hospital': 6.0,              # Medium radius
-                'Health Center': 3.0,
-            }.get(target_facility_type, 7.0)
+            min_distance_km = categories.policy().min_spacing_km(target_facility_type)
             
             # Convert km to degrees (approximate)
             min_distance = min_distance_km / 111.0
-            print(f"Using minimum distance of {min_distance_km}km between recommended facilities")
+            logger.debug("Using minimum distance of %skm between recommended facilities", min_distance_km)
             
             # 3. Select remaining locations ensuring minimum distance
             remaining_candidates = scored_locations[1:]
@@ -834,11 +819,11 @@ def site_suitability_analysis(request):
                     # If we checked all candidates and none were suitable,
                     # reduce the minimum distance requirement
                     min_distance *= 0.9
-                    print(f"Reducing minimum distance to {min_distance*111:.1f}km")
+                    logger.debug("Reducing minimum distance to %.1fkm", min_distance*111)
                     
                     # If minimum distance gets too small, just take the highest scored remaining
                     if min_distance < 0.01:  # ~1km
-                        print("Minimum distance too small, selecting highest scored remaining location")
+                        logger.debug("Minimum distance too small, selecting highest scored remaining location")
                         distributed_locations.append(remaining_candidates[0])
                         remaining_candidates.pop(0)
         
@@ -850,17 +835,19 @@ def site_suitability_analysis(request):
             location['properties']['rank'] = i + 1
         
         # Create GeoJSON for underserved areas
-        underserved_geojson = mapping(underserved_areas)
+        with phase('serialize'):
+            underserved_geojson = mapping(candidates['underserved_areas'])
         
         # Calculate processing time
         processing_time = time.time() - start_time
-        print(f"Site suitability analysis completed in {processing_time:.2f} seconds")
+        logger.debug("Site suitability analysis completed in %.2f seconds", processing_time)
         
         # Create summary statistics for the results
         summary = {
             'facility_type': target_facility_type,
-            'buffer_size_km': float(target_buffer_size),
+            'buffer_size_km': candidates['buffer_km'],
             'total_locations_analyzed': len(scored_locations),
+            'candidates_screened_out': int(len(grid_points) - len(shortlist)),
             'top_location_score': float(top_locations[0]['properties']['composite_score']) if top_locations else 0,
             'average_score': float(sum(loc['properties']['composite_score'] for loc in top_locations) / len(top_locations)) if top_locations else 0,
             'total_population_served': int(sum(loc['properties']['population_served'] for loc in top_locations)) if top_locations else 0,
@@ -878,47 +865,76 @@ def site_suitability_analysis(request):
             'summary': summary
         })
     
-    except Exception as e:
-        print("Error in site suitability analysis:", str(e))
-        print(traceback.format_exc())
-        return JsonResponse({
-            'error': str(e),
-            'traceback': traceback.format_exc()
-        }, status=500)
+    except Exception:
+        return server_error("Error in site suitability analysis")
 
 
 
 
-def healthcare_dashboard(request):
-    """View for the healthcare dashboard with real data calculations"""
+def screen_candidates(candidates, shortlist=SUITABILITY_SHORTLIST):
+    """Indices of the candidate sites of `suitability_candidates` that could score among the best `shortlist`
+
+    The population of a service area lies between that of the square inscribed
+    in it and that of its bounding box (widened by half a pixel, to include
+    every pixel it touches), both four lookups in the summed-area table. Its
+    densities lie between that population over the box's area and the box's
+    maximum density. The ward terms of the score don't depend on the raster.
+    A candidate is dropped if even its best possible score is below the
+    `shortlist`-th best guaranteed score, or if no population is within reach.
+    """
+    grid = candidates['grid']
+    points, service_areas = candidates['points'], candidates['service_areas']
+    point_wards, ward_names = candidates['point_wards'], candidates['ward_names']
+    ward_populations, ward_coverage_km2 = candidates['ward_populations'], candidates['ward_coverage_km2']
+    density_max, target_pop, weights = candidates['density_max'], candidates['target_pop'], candidates['weights']
+
+    half_pixel = np.array([-abs(grid.transform.a), -abs(grid.transform.e), abs(grid.transform.a), abs(grid.transform.e)]) / 2
+    outer = shapely.bounds(service_areas) + half_pixel
+    x, y = shapely.get_x(points), shapely.get_y(points)
+    # Half sides of the inscribed square, a little inside the buffer's polygon
+    half_width = (outer[:, 2] - outer[:, 0] - 2 * half_pixel[2]) / 2 * 0.99 / np.sqrt(2)
+    half_height = (outer[:, 3] - outer[:, 1] - 2 * half_pixel[3]) / 2 * 0.99 / np.sqrt(2)
+    inner = np.column_stack([x - half_width, y - half_height, x + half_width, y + half_height])
+    most, outer_area_km2 = grid.bbox_totals(outer)
+    least, _ = grid.bbox_totals(inner)
+    densest = grid.max_density_bound(outer)
+    sparsest = np.divide(least, outer_area_km2, out=np.zeros(len(least)), where=outer_area_km2 > 0)
+
+    # Coverage and ward population scores by ward, as in the full scoring
+    ward_areas_km2 = np.asarray(candidates['ward_areas_km2'], dtype='float64')
+    ward_coverage = np.divide(ward_coverage_km2, ward_areas_km2, out=np.zeros(len(ward_names)), where=ward_areas_km2 > 0)
+    ward_pop = np.array([float(ward_populations.get(name, 0) or 0) for name in ward_names])
+    ward_scores = (weights['coverage'] * (1.0 - np.minimum(ward_coverage, 1.0))
+                   + weights['ward_population'] * np.minimum(ward_pop / 50000, 1.0))
+    no_ward_score = weights['coverage']
+    fixed = np.where(point_wards >= 0, np.append(ward_scores, no_ward_score)[point_wards], no_ward_score)
+
+    def raster_score(population, density):
+        # Mean density is at most the maximum, which is the accessibility term's density
+        return (weights['population_served'] * np.minimum(np.maximum(population, 0) / target_pop, 1.0)
+                + weights['density'] * np.minimum(density / (density_max * 0.7), 1.0)
+                + weights['accessibility'] * np.minimum(density / density_max, 1.0))
+
+    # Served population is rounded to whole persons before scoring
+    lower = raster_score(least - 1, sparsest) + fixed
+    upper = raster_score(most + 1, densest) + fixed
+    threshold = np.partition(lower, -shortlist)[-shortlist] if len(lower) > shortlist else -np.inf
+    return np.flatnonzero((most > 0) & (upper >= threshold))
+
+
+@offload
+def dashboard_context(request):
+    """Template context of the healthcare dashboard (shared by identical concurrent requests)"""
     # Get Kisumu data
-    kisumu_county = KenyaCounty.objects.get(county__iexact='KISUMU')
-    kisumu_constituencies = KenyaConstituency.objects.filter(county_nam__iexact='KISUMU')
-    kisumu_wards = KenyaWard.objects.filter(county__iexact='KISUMU')
+    with phase('db'):
+        kisumu_wards = list(KenyaWard.objects.in_county('KISUMU'))
     
-    # Get selected facilities in Kisumu
-    selected_facilities = HealthCareFacility.objects.exclude(
-        facility_type__in=['Dispensary', 'Pharmacy', 'VCT Centre (Stand-Alone)',
-                          'Laboratory (Stand-alone)', 'Nursing Home', 'Health Programme']
-    )
+        # Get selected facilities in Kisumu
+        selected_facilities = list(HealthCareFacility.objects.served())
     
-    # Serialize data to GeoJSON
-    county_json = serialize('geojson', [kisumu_county],
-        geometry_field='geom',
-        fields=('county',)
-    )
-    constituencies_json = serialize('geojson', kisumu_constituencies,
-        geometry_field='geom',
-        fields=('const_name', 'const_no')
-    )
-    wards_json = serialize('geojson', kisumu_wards,
-        geometry_field='geom',
-        fields=('ward', 'pop2019', 'subcounty')
-    )
-    facilities_json = serialize('geojson', selected_facilities,
-        geometry_field='location',
-        fields=('name', 'facility_type', 'capacity')
-    )
+    with phase('serialize'):
+        # GeoJSON layers are loaded by the page from their versioned artifacts
+        layer_urls = {name: layers.url(name) for name in ('county', 'wards', 'facilities')}
     
     # Count facilities by type
     facility_types = {}
@@ -926,155 +942,74 @@ def healthcare_dashboard(request):
         facility_type = facility.facility_type
         facility_types[facility_type] = facility_types.get(facility_type, 0) + 1
     
-    # Get population density dataset
-    population_dataset = PopulationDensity.objects.first()
-    if not population_dataset:
-        return JsonResponse({'error': 'No population dataset available'}, status=404)
-    
-    # Get Kisumu boundary
-    kisumu_boundary_django = get_kisumu_boundary()
-    if hasattr(kisumu_boundary_django, 'wkt'):
-        from shapely import wkt
-        kisumu_boundary = wkt.loads(kisumu_boundary_django.wkt)
-    else:
-        kisumu_boundary = kisumu_boundary_django
-    
-    # Set up projection for area calculations
-    wgs84 = pyproj.CRS('EPSG:4326')
-    utm = pyproj.CRS('EPSG:32736')
-    transformer = pyproj.Transformer.from_crs(wgs84, utm, always_xy=True)
+    with phase('db'):
+        # Get population density dataset
+        population_dataset = select_dataset(request)
+        if not population_dataset:
+            return JsonResponse({'error': 'No population dataset available'}, status=404)
     
-    def transform_fn(x, y):
-        return transformer.transform(x, y)
+        # Get Kisumu boundary
+        kisumu_boundary = get_kisumu_boundary()
     
     # Calculate total population from ward data
     total_population = sum(ward.pop2019 or 0 for ward in kisumu_wards)
-    print(f"Total population from ward data: {total_population}")
-    
-    # Calculate 5km service areas for coverage analysis
-    facility_buffers = []
-    for facility in selected_facilities:
-        try:
-            # Get facility point as shapely geometry
-            facility_point = shape(json.loads(facility.location.json))
-            
-            # Create buffer (similar to merged_service_areas function)
-            lat = facility_point.y
-            lon = facility_point.x
-            
-            # Calculate approximate degrees for 5km buffer
-            lat_km_per_degree = 111.0
-            lon_km_per_degree = 111.0 * np.cos(np.radians(lat))
-            
-            # Convert 5km to degrees
-            lat_buffer = 5.0 / lat_km_per_degree
-            
-            # Create buffer
-            buffer = Point(lon, lat).buffer(lat_buffer)
-            
-            # Scale to account for longitude distortion
-            scale_factor = lon_km_per_degree / lat_km_per_degree
-            buffer = scale(buffer, xfact=scale_factor, yfact=1.0, origin='center')
-            
-            # Ensure buffer is valid
-            if not buffer.is_valid:
-                buffer = buffer.buffer(0)  # This often fixes invalid geometries
-            
-            if buffer.is_valid:
-                facility_buffers.append(buffer)
-        except Exception as e:
-            print(f"Error creating buffer for facility: {str(e)}")
-            continue
-    
-    # Merge all buffers to get total coverage area
-    merged_buffer = unary_union(facility_buffers)
-    
-    # Clip to Kisumu boundary
-    if kisumu_boundary:
-        merged_buffer = merged_buffer.intersection(kisumu_boundary)
+    logger.debug("Total population from ward data: %s", total_population)
+    ward_geometries = geometry.from_django(ward.geom for ward in kisumu_wards)
     
     # Calculate coverage statistics
     coverage_stats = {}
-    underserved_areas = None
     underserved_population = 0
     coverage_percent = 0
     served_population = 0
+    ward_stats = None
     
-    try:
-        # Project geometries to UTM for accurate area calculation
-        kisumu_utm = transform(transform_fn, kisumu_boundary)
-        merged_buffer_utm = transform(transform_fn, merged_buffer)
-        
-        # Calculate areas in square kilometers
-        kisumu_area_km2 = kisumu_utm.area / 1000000
-        covered_area_km2 = merged_buffer_utm.area / 1000000
+    with phase('coverage'):
+        try:
+            # 5km service areas burned into the population grid, cached next to the raster
+            layer = coverage.get_layer('dashboard', population_dataset.raster_file.path, selected_facilities,
+                                       DASHBOARD_RADIUS_KM, kisumu_wards, kisumu_boundary)
+            ward_stats = layer.summary(len(kisumu_wards))
         
-        # Calculate coverage percentage
-        coverage_percent = (covered_area_km2 / kisumu_area_km2) * 100
+            # Calculate areas in square kilometers
+            kisumu_area_km2 = ward_stats['total_area_km2']
+            covered_area_km2 = ward_stats['covered_area_km2']
+            underserved_area_km2 = kisumu_area_km2 - covered_area_km2
         
-        # Find underserved areas (areas outside the buffer)
-        underserved_areas = kisumu_boundary.difference(merged_buffer)
-        underserved_areas_utm = transform(transform_fn, underserved_areas)
-        underserved_area_km2 = underserved_areas_utm.area / 1000000
+            # Calculate coverage percentage
+            coverage_percent = (covered_area_km2 / kisumu_area_km2) * 100 if kisumu_area_km2 > 0 else 0
         
-        # Calculate served and underserved population using ward data
-        served_population = 0
-        underserved_population = 0
+            # Census population of each ward, split by the share of its gridded population that is served
+            served_population = 0
+            underserved_population = 0
         
-        for ward in kisumu_wards:
-            try:
-                ward_geom = shape(json.loads(ward.geom.json))
+            for i, ward in enumerate(kisumu_wards):
                 ward_pop = ward.pop2019 or 0
-                
-                # Calculate intersection with facility buffers
-                ward_coverage_geom = ward_geom.intersection(merged_buffer)
-                ward_coverage_utm = transform(transform_fn, ward_coverage_geom)
-                coverage_km2 = ward_coverage_utm.area / 1000000
-                
-                # Calculate uncovered area
-                uncovered_geom = ward_geom.difference(merged_buffer)
-                uncovered_utm = transform(transform_fn, uncovered_geom)
-                uncovered_km2 = uncovered_utm.area / 1000000
-                
-                # Calculate ward area
-                ward_utm = transform(transform_fn, ward_geom)
-                ward_area_km2 = ward_utm.area / 1000000
-                
-                # Calculate percentage covered
-                if ward_area_km2 > 0:
-                    coverage_percent_ward = (coverage_km2 / ward_area_km2) * 100
-                    uncovered_percent_ward = 100 - coverage_percent_ward
-                else:
-                    coverage_percent_ward = 0
-                    uncovered_percent_ward = 0
-                
-                # Estimate served and underserved population based on area coverage
-                ward_served_pop = int(ward_pop * (coverage_percent_ward / 100))
-                ward_underserved_pop = ward_pop - ward_served_pop
-                
+                ward_grid_pop = ward_stats['ward_population'][i]
+                served_share = ward_stats['ward_served_population'][i] / ward_grid_pop if ward_grid_pop > 0 else 0
+            
+                ward_served_pop = int(ward_pop * served_share)
                 served_population += ward_served_pop
-                underserved_population += ward_underserved_pop
-                
-            except Exception as e:
-                print(f"Error calculating coverage for ward {ward.ward}: {str(e)}")
-        
-        # Calculate served percentage
-        served_percent = (served_population / total_population) * 100 if total_population > 0 else 0
-        underserved_percent = (underserved_population / total_population) * 100 if total_population > 0 else 0
-        
-        coverage_stats = {
-            'covered_area_km2': round(covered_area_km2, 2),
-            'total_area_km2': round(kisumu_area_km2, 2),
-            'coverage_percent': round(coverage_percent, 1),
-            'served_population': served_population,
-            'served_percent': round(served_percent, 1),
-            'underserved_area_km2': round(underserved_area_km2, 2),
-            'underserved_population': underserved_population,
-            'underserved_percent': round(underserved_percent, 1)
-        }
-    except Exception as e:
-        print(f"Error calculating coverage statistics: {str(e)}")
-        print(traceback.format_exc())
+                underserved_population += ward_pop - ward_served_pop
+        
+            # Calculate served percentage
+            served_percent = (served_population / total_population) * 100 if total_population > 0 else 0
+            underserved_percent = (underserved_population / total_population) * 100 if total_population > 0 else 0
+            redundant_percent = (ward_stats['redundant_population'] / ward_stats['population']) * 100 if ward_stats['population'] > 0 else 0
+        
+            coverage_stats = {
+                'covered_area_km2': round(covered_area_km2, 2),
+                'total_area_km2': round(kisumu_area_km2, 2),
+                'coverage_percent': round(coverage_percent, 1),
+                'served_population': served_population,
+                'served_percent': round(served_percent, 1),
+                'underserved_area_km2': round(underserved_area_km2, 2),
+                'underserved_population': underserved_population,
+                'underserved_percent': round(underserved_percent, 1),
+                'redundant_area_km2': round(ward_stats['redundant_area_km2'], 2),
+                'redundant_percent': round(redundant_percent, 1)
+            }
+        except Exception as e:
+            logger.exception("Error calculating coverage statistics: %s", e)
 
     # Calculate facilities per ward directly in the backend
     facilities_per_ward = {}
@@ -1083,105 +1018,92 @@ def healthcare_dashboard(request):
     for ward in kisumu_wards:
         facilities_per_ward[ward.ward] = 0
     
-    # Count facilities in each ward
-    for facility in selected_facilities:
+    with phase('wards'):
+        # Count facilities in each ward
         try:
-            facility_point = shape(json.loads(facility.location.json))
-            
-            # Check which ward contains this facility
-            for ward in kisumu_wards:
-                try:
-                    ward_geom = shape(json.loads(ward.geom.json))
-                    
-                    # Check if facility is inside this ward
-                    if ward_geom.contains(facility_point):
-                        facilities_per_ward[ward.ward] += 1
-                        break
-                except Exception as e:
-                    print(f"Error checking if facility is in ward {ward.ward}: {str(e)}")
+            facility_points = shapely.points(*geometry.coordinates(selected_facilities))
+            facility_wards = geometry.locate(facility_points, ward_geometries)
+            for ward_idx in facility_wards[facility_wards >= 0]:
+                facilities_per_ward[kisumu_wards[ward_idx].ward] += 1
         except Exception as e:
-            print(f"Error processing facility for ward count: {str(e)}")
+            logger.warning("Error counting facilities per ward: %s", e)
     
     # Log the results
-    print("Facilities per ward calculation complete:")
-    for ward_name, count in facilities_per_ward.items():
-        print(f"{ward_name}: {count} facilities")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Facilities per ward calculation complete:")
+        for ward_name, count in facilities_per_ward.items():
+            logger.debug("%s: %s facilities", ward_name, count)
 
     # Identify priority wards based on population and coverage
     priority_wards = []
     ward_coverage = {}
     
-    try:
-        # Calculate coverage and population for each ward
-        for ward in kisumu_wards:
-            try:
-                ward_name = ward.ward
-                ward_geom = shape(json.loads(ward.geom.json))
-                ward_pop = ward.pop2019 or 0
-                
-                # Calculate ward area
-                ward_utm = transform(transform_fn, ward_geom)
-                ward_area_km2 = ward_utm.area / 1000000
-                
-                # Calculate intersection with facility buffers
-                ward_coverage_geom = ward_geom.intersection(merged_buffer)
-                ward_coverage_utm = transform(transform_fn, ward_coverage_geom)
-                coverage_km2 = ward_coverage_utm.area / 1000000
+    with phase('coverage'):
+        try:
+            # Calculate coverage and population for each ward
+            for i, ward in enumerate(kisumu_wards):
+                try:
+                    ward_name = ward.ward
+                    ward_pop = ward.pop2019 or 0
+                    ward_area_km2 = float(ward_stats['ward_area_km2'][i])
+                    coverage_km2 = float(ward_stats['ward_covered_km2'][i])
+                    ward_grid_pop = float(ward_stats['ward_population'][i])
                 
-                # Calculate uncovered area
-                uncovered_geom = ward_geom.difference(merged_buffer)
-                uncovered_utm = transform(transform_fn, uncovered_geom)
-                uncovered_km2 = uncovered_utm.area / 1000000
+                    # Calculate percentage covered
+                    if ward_area_km2 > 0:
+                        coverage_percent_ward = (coverage_km2 / ward_area_km2) * 100
+                    else:
+                        coverage_percent_ward = 0
                 
-                # Calculate percentage covered
-                if ward_area_km2 > 0:
-                    coverage_percent_ward = (coverage_km2 / ward_area_km2) * 100
-                    uncovered_percent_ward = 100 - coverage_percent_ward
-                else:
-                    coverage_percent_ward = 0
-                    uncovered_percent_ward = 0
+                    # Share of the ward's people outside every service area, and within reach of 3+ facilities
+                    if ward_grid_pop > 0:
+                        uncovered_percent_ward = 100 - (float(ward_stats['ward_served_population'][i]) / ward_grid_pop) * 100
+                        redundant_percent_ward = (float(ward_stats['ward_redundant_population'][i]) / ward_grid_pop) * 100
+                    else:
+                        uncovered_percent_ward = 100 - coverage_percent_ward if ward_area_km2 > 0 else 0
+                        redundant_percent_ward = 0
                 
-                # Calculate ward population density
-                ward_density = ward_pop / ward_area_km2 if ward_area_km2 > 0 else 0
+                    # Calculate ward population density
+                    ward_density = ward_pop / ward_area_km2 if ward_area_km2 > 0 else 0
                 
-                # Estimate uncovered population based on area
-                uncovered_population = int(ward_pop * (uncovered_percent_ward / 100))
+                    # Estimate uncovered population from the uncovered share
+                    uncovered_population = int(ward_pop * (uncovered_percent_ward / 100))
                 
-                # Get facility count for  this ward
-                facility_count = facilities_per_ward.get(ward_name, 0)
+                    # Get facility count for  this ward
+                    facility_count = facilities_per_ward.get(ward_name, 0)
                 
-                # Calculate priority score (higher is more priority)
-                # Factors: uncovered population, population density, and coverage percentage
-                priority_score = (uncovered_population * 0.6) + (ward_density * 0.2) + ((100 - coverage_percent_ward) * 0.2)
+                    # Calculate priority score (higher is more priority)
+                    # Factors: uncovered population, population density, and coverage percentage
+                    priority_score = (uncovered_population * 0.6) + (ward_density * 0.2) + ((100 - coverage_percent_ward) * 0.2)
                 
-                # Store ward coverage data
-                ward_coverage[ward_name] = {
-                    'ward': ward_name,
-                    'population': ward_pop,
-                    'area_km2': round(ward_area_km2, 2),
-                    'density': round(ward_density, 2),
-                    'coverage_percent': round(coverage_percent_ward, 1),
-                    'uncovered_percent': round(uncovered_percent_ward, 1),
-                    'uncovered_population': uncovered_population,
-                    'priority_score': round(priority_score, 2),
-                    'facilities': facility_count
-                }
-            except Exception as e:
-                print(f"Error calculating coverage for ward {ward.ward}: {str(e)}")
+                    # Store ward coverage data
+                    ward_coverage[ward_name] = {
+                        'ward': ward_name,
+                        'population': ward_pop,
+                        'area_km2': round(ward_area_km2, 2),
+                        'density': round(ward_density, 2),
+                        'coverage_percent': round(coverage_percent_ward, 1),
+                        'uncovered_percent': round(uncovered_percent_ward, 1),
+                        'uncovered_population': uncovered_population,
+                        'redundant_percent': round(redundant_percent_ward, 1),
+                        'priority_score': round(priority_score, 2),
+                        'facilities': facility_count
+                    }
+                except Exception as e:
+                    logger.warning("Error calculating coverage for ward %s: %s", ward.ward, e)
         
-        # Sort wards by priority score (descending)
-        sorted_wards = sorted(
-            ward_coverage.values(),
-            key=lambda x: x['priority_score'],
-            reverse=True
-        )
+            # Sort wards by priority score (descending)
+            sorted_wards = sorted(
+                ward_coverage.values(),
+                key=lambda x: x['priority_score'],
+                reverse=True
+            )
         
-        # Take top 5 wards as priority
-        priority_wards = [ward['ward'] for ward in sorted_wards[:5]]
+            # Take top 5 wards as priority
+            priority_wards = [ward['ward'] for ward in sorted_wards[:5]]
     
-    except Exception as e:
-        print(f"Error identifying priority wards: {str(e)}")
-        print(traceback.format_exc())
+        except Exception as e:
+            logger.exception("Error identifying priority wards: %s", e)
     
     # Calculate travel time coverage (simplified)
     # In a real implementation, you'd use your travel time analysis
@@ -1195,7 +1117,7 @@ def healthcare_dashboard(request):
     # Create summary stats object
     summary_stats = {
         'total_population': total_population,
-        'total_facilities': selected_facilities.count(),
+        'total_facilities': len(selected_facilities),
         'facility_types': facility_types,
         'coverage_stats': coverage_stats,
         'travel_time_coverage': {k: round(v, 1) for k, v in travel_time_coverage.items()},
@@ -1211,187 +1133,123 @@ def healthcare_dashboard(request):
                 return float(obj)
             return super(DecimalEncoder, self).default(obj)
     
-    context = {
-        'county': county_json,
-        'constituencies': constituencies_json,
-        'wards': wards_json,
-        'facilities': facilities_json,
+    return {
+        'layer_urls': layer_urls,
         'summary_stats': json.dumps(summary_stats, cls=DecimalEncoder),
     }
+
+
+async def healthcare_dashboard(request):
+    """View for the healthcare dashboard with real data calculations"""
+    context = await dashboard_context(request)
+    if isinstance(context, HttpResponse):
+        return context
     
-    return render(request, 'maps/dashboard.html', context)
+    # Rendered per request: the page carries the requester's CSRF token
+    with phase('render'):
+        return await sync_to_async(render)(request, 'maps/dashboard.html', context)
 
 
 
+@offload
 @csrf_exempt
 def merged_service_areas(request):
     """API endpoint to generate merged service areas for all facilities with type-specific buffer sizes"""
     try:
+        if spatial_sql.available():
+            # Buffer, merge and clip in PostGIS; only the merged geometry comes back
+            with phase('db'):
+                result = spatial_sql.service_areas()
+                buffer_types = categories.policy().served_radii_km()
+            if result['geojson'] is None:
+                return JsonResponse({
+                    'error': 'No valid buffers could be created'
+                }, status=500)
+            with phase('serialize'):
+                merged_geojson = json.loads(result['geojson'])
+            return JsonResponse({
+                'type': 'Feature',
+                'geometry': merged_geojson,
+                'properties': {
+                    'buffer_types': buffer_types,
+                    'facility_count': result['facility_count'],
+                    'area_km2': round(result['area_km2'], 2)
+                }
+            })
+
         # Get facilities
-        selected_facilities = HealthCareFacility.objects.exclude(
-            facility_type__in=['Dispensary', 'Pharmacy', 'VCT Centre (Stand-Alone)', 
-                              'Laboratory (Stand-alone)', 'Nursing Home', 'Health Programme']
-        )
+        with phase('db'):
+            selected_facilities = list(HealthCareFacility.objects.served())
         
-        print(f"Creating buffers for {selected_facilities.count()} facilities")
+        logger.debug("Creating buffers for %s facilities", len(selected_facilities))
         
-        # Define buffer sizes for different facility types (in km)
-        buffer_sizes = {
-           'District Hospital': 10.0,                  # Larger radius for hospitals
-            'Povincial General Hospital': 15,              # Medium radius for health centers
-            'Medical Clinic': 5.0,             # Standard radius for clinics
-            'Other Hospital': 5.0,             # Medium radius for medical centers
-            'Sub-District Hospital': 6.0,       # Medium radius
-            'Health Center' : 3,                 # Default radius
-        }
+        # Buffer sizes for different facility types (in km)
+        policy = categories.policy()
+        buffer_sizes = policy.served_radii_km()
         
         # Create buffer for each facility
-        from shapely.geometry import Point
-        buffers = []
+        with phase('buffer'):
+            lons, lats = geometry.coordinates(selected_facilities)
+            radii_km = policy.radii_km(selected_facilities)  # Default to 5km if type not found
+            buffers = geometry.metric_buffers(lons, lats, radii_km)
         
-        for facility in selected_facilities:
-            try:
-                # Get the appropriate buffer size for this facility type
-                facility_type = facility.facility_type
-                buffer_size_km = buffer_sizes.get(facility_type, 5.0)  # Default to 5km if type not found
-                
-                # Create a buffer with the appropriate size
-                point = Point(facility.location.x, facility.location.y)
-                
-                # Convert km to degrees (approximate)
-                lat = point.y
-                lon = point.x
-                
-                # Calculate approximate degrees for the buffer
-                lat_km_per_degree = 111.0  # km per degree of latitude
-                lon_km_per_degree = 111.0 * np.cos(np.radians(lat))  # km per degree of longitude
-                
-                # Convert buffer size to degrees (different for lat and lon)
-                lat_buffer = buffer_size_km / lat_km_per_degree
-                
-                # Create an elliptical buffer (more accurate than circular at non-equatorial latitudes)
-                buffer = point.buffer(lat_buffer)
-                
-                # Scale to account for longitude distortion
-                scale_factor = lon_km_per_degree / lat_km_per_degree
-                buffer = scale(buffer, xfact=scale_factor, yfact=1.0, origin='center')
-                
-                # Ensure the buffer is valid
-                if not buffer.is_valid:
-                    buffer = buffer.buffer(0)  # This often fixes invalid geometries
-                
-                if buffer.is_valid:
-                    buffers.append(buffer)
-                    print(f"Created {buffer_size_km}km buffer for {facility.name} ({facility_type})")
-                else:
-                    print(f"Skipping invalid buffer for facility {facility.name}")
-            except Exception as e:
-                print(f"Error creating buffer for facility {facility.name}: {str(e)}")
-        
-        if not buffers:
+        if len(buffers) == 0:
             return JsonResponse({
                 'error': 'No valid buffers could be created'
             }, status=500)
         
-        print(f"Created {len(buffers)} valid buffers")
+        logger.debug("Created %s valid buffers", len(buffers))
         
         # Merge all buffers
-        from shapely.ops import unary_union
-        try:
-            # Make sure all buffers are valid before merging
-            valid_buffers = []
-            for i, buffer in enumerate(buffers):
-                if buffer.is_valid:
-                    valid_buffers.append(buffer)
-                else:
-                    print(f"Buffer {i} is invalid, attempting to fix")
-                    fixed_buffer = buffer.buffer(0)
-                    if fixed_buffer.is_valid:
-                        valid_buffers.append(fixed_buffer)
-                    else:
-                        print(f"Could not fix buffer {i}, skipping")
-            
-            print(f"Merging {len(valid_buffers)} valid buffers")
-            
-            # If we have many buffers, merge them in batches to avoid memory issues
-            if len(valid_buffers) > 100:
-                print("Large number of buffers, merging in batches")
-                batch_size = 50
-                merged_buffer = None
-                
-                for i in range(0, len(valid_buffers), batch_size):
-                    batch = valid_buffers[i:i+batch_size]
-                    batch_merged = unary_union(batch)
-                    
-                    if merged_buffer is None:
-                        merged_buffer = batch_merged
-                    else:
-                        merged_buffer = unary_union([merged_buffer, batch_merged])
-                    
-                    print(f"Merged batch {i//batch_size + 1}/{(len(valid_buffers)+batch_size-1)//batch_size}")
-            else:
-                merged_buffer = unary_union(valid_buffers)
-            
-            print(f"Successfully merged buffers: {merged_buffer.geom_type}")
+        with phase('union'):
+            try:
+                merged_buffer = geometry.union(buffers)
+                logger.debug("Successfully merged buffers: %s", merged_buffer.geom_type)
             
-            # Simplify the merged buffer to reduce complexity
-            merged_buffer = merged_buffer.simplify(0.0001)
-            print("Simplified merged buffer")
+                # Simplify the merged buffer to reduce complexity
+                merged_buffer = merged_buffer.simplify(0.0001)
+                logger.debug("Simplified merged buffer")
             
-        except Exception as e:
-            print(f"Error merging buffers: {str(e)}")
-            print(traceback.format_exc())
-            return JsonResponse({
-                'error': f'Error merging buffers: {str(e)}'
-            }, status=500)
+            except Exception as e:
+                logger.exception("Error merging buffers: %s", e)
+                return JsonResponse({
+                    'error': f'Error merging buffers: {str(e)}'
+                }, status=500)
         
         # Get Kisumu boundary
-        try:
-            kisumu_boundary = get_kisumu_boundary()
-            print(f"Kisumu boundary type: {type(kisumu_boundary).__name__}")
-            
-            # Convert Django geometry to shapely geometry if needed
-            if hasattr(kisumu_boundary, 'geom_type'):
-                # Already a shapely geometry
-                pass
-            elif hasattr(kisumu_boundary, 'wkt'):
-                # Convert from Django geometry to shapely
-                from shapely import wkt
-                kisumu_boundary = wkt.loads(kisumu_boundary.wkt)
-            else:
-                print("Kisumu boundary is not in a usable format")
-                kisumu_boundary = None
+        with phase('clip'):
+            try:
+                kisumu_boundary = get_kisumu_boundary()
             
-            # Clip the buffer to Kisumu boundary if available
-            if kisumu_boundary:
-                print("Clipping buffer to Kisumu boundary")
-                try:
-                    # Ensure both geometries are valid
-                    kisumu_boundary = kisumu_boundary.buffer(0)
-                    merged_buffer = merged_buffer.buffer(0)
+                # Clip the buffer to Kisumu boundary if available
+                if kisumu_boundary:
+                    logger.debug("Clipping buffer to Kisumu boundary")
+                    try:
+                        # Ensure both geometries are valid
+                        kisumu_boundary = kisumu_boundary.buffer(0)
+                        merged_buffer = merged_buffer.buffer(0)
                     
-                    # Now perform the intersection
-                    merged_buffer = merged_buffer.intersection(kisumu_boundary)
-                    print(f"Successfully clipped buffer: {merged_buffer.geom_type}")
-                except Exception as e:
-                    print(f"Error clipping buffer to boundary: {str(e)}")
-                    print(traceback.format_exc())
-                    # Continue with the unclipped buffer
-                    print("Continuing with unclipped buffer")
-            else:
-                print("No valid Kisumu boundary available for clipping")
-        except Exception as e:
-            print(f"Error processing Kisumu boundary: {str(e)}")
-            print(traceback.format_exc())
-            # Continue with the unclipped buffer
+                        # Now perform the intersection
+                        merged_buffer = merged_buffer.intersection(kisumu_boundary)
+                        logger.debug("Successfully clipped buffer: %s", merged_buffer.geom_type)
+                    except Exception as e:
+                        logger.exception("Error clipping buffer to boundary: %s", e)
+                        # Continue with the unclipped buffer
+                        logger.debug("Continuing with unclipped buffer")
+                else:
+                    logger.debug("No valid Kisumu boundary available for clipping")
+            except Exception as e:
+                logger.exception("Error processing Kisumu boundary: %s", e)
+                # Continue with the unclipped buffer
         
         # Convert to GeoJSON
         from shapely.geometry import mapping
         try:
-            merged_geojson = mapping(merged_buffer)
-            print("Successfully converted to GeoJSON")
+            with phase('serialize'):
+                merged_geojson = mapping(merged_buffer)
+            logger.debug("Successfully converted to GeoJSON")
         except Exception as e:
-            print(f"Error converting to GeoJSON: {str(e)}")
+            logger.warning("Error converting to GeoJSON: %s", e)
             return JsonResponse({
                 'error': f'Error converting to GeoJSON: {str(e)}'
             }, status=500)
@@ -1402,27 +1260,655 @@ def merged_service_areas(request):
             'geometry': merged_geojson,
             'properties': {
                 'buffer_types': buffer_sizes,
-                'facility_count': selected_facilities.count()
+                'facility_count': len(selected_facilities)
             }
         })
     
-    except Exception as e:
-        print("Error generating merged service areas:", str(e))
-        print(traceback.format_exc())
+    except Exception:
+        return server_error("Error generating merged service areas")
+
+
+
+
+
+@offload
+@csrf_exempt
+def coverage_scenario(request):
+    """API endpoint to evaluate adding and removing facilities against current service area coverage"""
+    import rasterio.features
+    try:
+        if request.method != 'POST':
+            return JsonResponse({
+                'error': 'This endpoint requires a POST request with a JSON body',
+                'example': {
+                    'add': [{'lat': -0.1, 'lng': 34.75, 'facility_type': 'Sub-District Hospital'}],
+                    'remove': [12, 40]
+                }
+            }, status=400)
+        
+        try:
+            data = json.loads(request.body or b'{}')
+            added = [(float(point['lng']), float(point['lat']), point.get('facility_type'))
+                     for point in data.get('add', [])]
+            removed_ids = [int(facility_id) for facility_id in data.get('remove', [])]
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            return JsonResponse({'error': f'Invalid scenario: {str(e)}'}, status=400)
+        
+        with phase('db'):
+            selected_facilities = list(HealthCareFacility.objects.served())
+            population_dataset = select_dataset(request, data)
+            if not population_dataset:
+                return JsonResponse({'error': 'No population dataset available'}, status=404)
+            kisumu_wards = list(KenyaWard.objects.in_county('KISUMU'))
+            kisumu_boundary = get_kisumu_boundary()
+        
+        policy = categories.policy()
+        radii_km = policy.radii_km(selected_facilities)
+        raster_path = population_dataset.raster_file.path
+        
+        with phase('coverage'):
+            layer = coverage.get_layer('service-areas', raster_path, selected_facilities, radii_km,
+                                       kisumu_wards, kisumu_boundary)
+            footprints = coverage.get_footprints('service-areas', raster_path, selected_facilities, radii_km)
+            baseline = layer.summary(len(kisumu_wards))
+        
+        with phase('scenario'):
+            index_by_id = {facility.pk: i for i, facility in enumerate(selected_facilities)}
+            removed = {index_by_id[facility_id] for facility_id in removed_ids if facility_id in index_by_id}
+            unknown_ids = [facility_id for facility_id in removed_ids if facility_id not in index_by_id]
+            keep = [i for i in range(len(selected_facilities)) if i not in removed]
+        
+            added_buffers = geometry.metric_buffers(
+                [lng for lng, lat, facility_type in added],
+                [lat for lng, lat, facility_type in added],
+                [policy.radius_km(facility_type) for lng, lat, facility_type in added],
+            )
+            change = coverage.scenario_change(layer, footprints, keep, footprints.pack(added_buffers), len(kisumu_wards))
+            gained, lost = change['gained'], change['lost']
+        
+            # Ward changes in census population, split by the change in each ward's served share
+            ward_changes = []
+            served_population_change = 0
+            for i, ward in enumerate(kisumu_wards):
+                ward_grid_pop = baseline['ward_population'][i]
+                ward_area_km2 = baseline['ward_area_km2'][i]
+                grid_change = gained['ward_population'][i] - lost['ward_population'][i]
+                area_change = gained['ward_area_km2'][i] - lost['ward_area_km2'][i]
+                if grid_change == 0 and area_change == 0:
+                    continue
+                
+                served_before = baseline['ward_served_population'][i] / ward_grid_pop if ward_grid_pop > 0 else 0
+                served_after = (baseline['ward_served_population'][i] + grid_change) / ward_grid_pop if ward_grid_pop > 0 else 0
+                ward_population_change = int(round((ward.pop2019 or 0) * (served_after - served_before)))
+                served_population_change += ward_population_change
+                
+                covered_before = baseline['ward_covered_km2'][i] / ward_area_km2 * 100 if ward_area_km2 > 0 else 0
+                covered_after = (baseline['ward_covered_km2'][i] + area_change) / ward_area_km2 * 100 if ward_area_km2 > 0 else 0
+                ward_changes.append({
+                    'ward': ward.ward,
+                    'served_population_change': ward_population_change,
+                    'served_percent_before': round(float(served_before) * 100, 1),
+                    'served_percent_after': round(float(served_after) * 100, 1),
+                    'coverage_percent_before': round(float(covered_before), 1),
+                    'coverage_percent_after': round(float(covered_after), 1)
+                })
+            ward_changes.sort(key=lambda x: abs(x['served_population_change']), reverse=True)
+        
+        with phase('serialize'):
+            # Outline of the newly covered pixels for the map
+            newly_covered = [
+                shape(polygon) for polygon, value in rasterio.features.shapes(
+                    change['gained_mask'].astype('uint8'), mask=change['gained_mask'], transform=footprints.transform)
+            ]
+            newly_covered_geojson = mapping(geometry.union(newly_covered)) if newly_covered else None
+        
+        total_area_km2 = baseline['total_area_km2']
+        covered_after_km2 = baseline['covered_area_km2'] + gained['area_km2'] - lost['area_km2']
+        return JsonResponse({
+            'served_population_change': served_population_change,
+            'newly_covered_area_km2': round(gained['area_km2'], 2),
+            'no_longer_covered_area_km2': round(lost['area_km2'], 2),
+            'coverage_percent_before': round(baseline['covered_area_km2'] / total_area_km2 * 100, 1) if total_area_km2 > 0 else 0,
+            'coverage_percent_after': round(covered_after_km2 / total_area_km2 * 100, 1) if total_area_km2 > 0 else 0,
+            'ward_changes': ward_changes,
+            'newly_covered_area': {
+                'type': 'Feature',
+                'geometry': newly_covered_geojson
+            },
+            'added_facilities': len(added),
+            'removed_facilities': len(removed),
+            'unknown_facility_ids': unknown_ids
+        })
+    
+    except Exception:
+        return server_error("Error evaluating coverage scenario")
+
+
+def clip_to_bounds(request, values, transform):
+    """(values, transform) of the pixels within the optional ?bounds=, "south,west,north,east" as for the
+    population density; ValueError if the bounds are malformed"""
+    bounds_str = request.GET.get('bounds')
+    if not bounds_str:
+        return values, transform
+    south, west, north, east = map(float, bounds_str.split(','))
+    rows, cols = population.window(transform, values.shape, (west, south, east, north))
+    return values[rows, cols], transform * Affine.translation(cols.start, rows.start)
+
+
+def raster_points(values, transform):
+    """About 10,000 points at most, as [lat, lon, value] of the sampled pixels' corners, and the sampling step
+
+    Pixels that are 0 or NaN are left out.
+    """
+    downsample_factor = max(1, int(np.ceil(np.sqrt(values.size / 10000))))
+    sampled = values[::downsample_factor, ::downsample_factor]
+    sample_rows, sample_cols = np.nonzero(np.isfinite(sampled) & (sampled != 0))
+    lons, lats = transform * (sample_cols * downsample_factor, sample_rows * downsample_factor)
+    return np.column_stack([lats, lons, sampled[sample_rows, sample_cols]]).tolist(), downsample_factor
+
+
+@offload
+@csrf_exempt
+def population_change(request):
+    """API endpoint for population difference, growth and trend layers from the multi-year cube"""
+    try:
+        layer = request.GET.get('layer', 'difference')
+        if layer not in CHANGE_LAYERS:
+            return JsonResponse({'error': f'layer must be one of {", ".join(CHANGE_LAYERS)}'}, status=400)
+
+        with phase('raster'):
+            population_cube = cube.get()
+        if population_cube is None:
+            return JsonResponse({'error': 'No population dataset available'}, status=404)
+        years = [int(year) for year in population_cube.years]
+
+        try:
+            start = int(request.GET.get('start', years[0]))
+            end = int(request.GET.get('end', years[-1]))
+            population_cube.index(start)
+            population_cube.index(end)
+        except (ValueError, KeyError):
+            return JsonResponse({'error': f'start and end must be dataset years: {years}'}, status=400)
+
+        with phase('raster'):
+            if layer == 'difference':
+                values = population_cube.difference(start, end)
+            elif layer == 'growth':
+                values = population_cube.growth(start, end)
+            else:
+                values = population_cube.trend()
+
+            try:
+                values, transform = clip_to_bounds(request, values, population_cube.transform)
+            except ValueError:
+                return JsonResponse({'error': 'bounds must be "south,west,north,east"'}, status=400)
+
+        with phase('serialize'):
+            points, downsample_factor = raster_points(values, transform)
+
+        valid = values[np.isfinite(values)]
+        stats = {
+            'min': float(valid.min()) if valid.size else 0,
+            'max': float(valid.max()) if valid.size else 0,
+            'mean': float(valid.mean()) if valid.size else 0,
+        }
+        if layer != 'growth':
+            # Persons gained (difference) or persons per year (trend) over the whole window
+            stats['total'] = float(valid.sum())
+
         return JsonResponse({
-            'error': str(e),
-            'traceback': traceback.format_exc()
-        }, status=500)
+            'layer': layer,
+            'start': start if layer != 'trend' else years[0],
+            'end': end if layer != 'trend' else years[-1],
+            'years': years,
+            'units': {'difference': 'persons', 'growth': 'annual rate', 'trend': 'persons per year'}[layer],
+            'points': points,
+            'point_count': len(points),
+            'downsample_factor': downsample_factor,
+            **stats,
+        })
+
+    except Exception:
+        return server_error("Error computing population change")
+
+
+@offload
+@csrf_exempt
+def facility_density(request):
+    """API endpoint for kernel density surfaces of the facilities and of population per facility
+
+    ?layer= is facilities, population or ratio (population over facilities),
+    ?bandwidth= one of kde.BANDWIDTHS_KM and ?weight= count or capacity.
+    """
+    try:
+        layer = request.GET.get('layer', 'facilities')
+        if layer not in kde.LAYERS:
+            return JsonResponse({'error': f'layer must be one of {", ".join(kde.LAYERS)}'}, status=400)
+        weight = request.GET.get('weight', 'count')
+        if weight not in kde.WEIGHTS:
+            return JsonResponse({'error': f'weight must be one of {", ".join(kde.WEIGHTS)}'}, status=400)
+        try:
+            bandwidth_km = float(request.GET.get('bandwidth', kde.BANDWIDTHS_KM[1]))
+            if bandwidth_km not in kde.BANDWIDTHS_KM:
+                raise ValueError
+        except ValueError:
+            return JsonResponse({'error': 'bandwidth must be one of the bandwidths (km)',
+                                 'bandwidths_km': list(kde.BANDWIDTHS_KM)}, status=400)
+
+        with phase('db'):
+            dataset = select_dataset(request)
+            if not dataset:
+                return JsonResponse({'error': 'No population dataset available'}, status=404)
+            facilities = list(HealthCareFacility.objects.served())
+
+        with phase('raster'):
+            raster_path = dataset.raster_file.path
+            surfaces = kde.get(raster_path, facilities)
+            etag = f'"{surfaces.version}.{layer}.{weight}.{bandwidth_km:g}.{request.GET.get("bounds", "")}"'
+            if etag in parse_etags(request.headers.get('If-None-Match', '')):
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+                return response
+            try:
+                values, transform = clip_to_bounds(request, surfaces.layer(layer, bandwidth_km, weight),
+                                                   population.get(raster_path).transform)
+            except ValueError:
+                return JsonResponse({'error': 'bounds must be "south,west,north,east"'}, status=400)
+
+        with phase('serialize'):
+            points, downsample_factor = raster_points(values, transform)
+            valid = values[np.isfinite(values)]
+            response = JsonResponse({
+                'name': dataset.name,
+                'year': dataset.year,
+                'layer': layer,
+                'weight': weight,
+                'bandwidth_km': bandwidth_km,
+                'bandwidths_km': list(kde.BANDWIDTHS_KM),
+                'units': kde.UNITS[layer, weight],
+                'points': points,
+                'point_count': len(points),
+                'downsample_factor': downsample_factor,
+                'min': float(valid.min()) if valid.size else 0,
+                'max': float(valid.max()) if valid.size else 0,
+                'mean': float(valid.mean()) if valid.size else 0,
+            })
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    except Exception:
+        return server_error("Error building facility density")
+
+
+def _distance_surfaces(request):
+    """(dataset, facilities, wards, distance surfaces) of a request, or a JsonResponse if it can't have them"""
+    with phase('db'):
+        dataset = select_dataset(request)
+        if not dataset:
+            return JsonResponse({'error': 'No population dataset available'}, status=404)
+        facilities = list(HealthCareFacility.objects.served())
+        wards = list(KenyaWard.objects.in_county('KISUMU'))
+        boundary = get_kisumu_boundary()
+    if boundary is None:
+        return JsonResponse({'error': 'Kisumu County boundary not found'}, status=404)
 
+    with phase('distance'):
+        surfaces = distance.get(dataset.raster_file.path, facilities, wards, boundary)
+    facility_type = request.GET.get('type', distance.ALL_TYPES)
+    if facility_type not in surfaces.types:
+        return JsonResponse({'error': 'type must be a facility type with facilities on the grid (or empty for all)',
+                             'types': [name for name in surfaces.types if name]}, status=400)
+    return dataset, facilities, wards, surfaces
 
 
+@offload
+@csrf_exempt
+def facility_distance(request):
+    """API endpoint for the distance surface to the nearest facility, of all facilities or of ?type="""
+    try:
+        result = _distance_surfaces(request)
+        if isinstance(result, JsonResponse):
+            return result
+        dataset, facilities, wards, surfaces = result
+        facility_type = request.GET.get('type', distance.ALL_TYPES)
+
+        etag = f'"{surfaces.version}.{facility_type}.{request.GET.get("bounds", "")}"'
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        with phase('raster'):
+            try:
+                values, transform = clip_to_bounds(request, surfaces.layer(facility_type) / 1000,
+                                                   population.get(dataset.raster_file.path).transform)
+            except ValueError:
+                return JsonResponse({'error': 'bounds must be "south,west,north,east"'}, status=400)
+
+        with phase('serialize'):
+            points, downsample_factor = raster_points(values, transform)
+            response = JsonResponse({
+                'name': dataset.name,
+                'year': dataset.year,
+                'type': facility_type or None,
+                'units': 'km',
+                'points': points,
+                'point_count': len(points),
+                'downsample_factor': downsample_factor,
+                'min': float(values.min()) if values.size else 0,
+                'max': float(values.max()) if values.size else 0,
+                'mean': float(values.mean()) if values.size else 0,
+            })
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    except Exception:
+        return server_error("Error computing facility distance")
+
+
+@offload
+@csrf_exempt
+def distance_coverage(request):
+    """API endpoint for population within a radius of a facility, per ward and county, and by distance
+
+    ?type= limits the facilities to one type (all by default); ?radius_km=
+    defaults to the type's service radius. The curves give the population
+    within every ?step_km= up to ?max_km=.
+    """
+    try:
+        result = _distance_surfaces(request)
+        if isinstance(result, JsonResponse):
+            return result
+        dataset, facilities, wards, surfaces = result
+        facility_type = request.GET.get('type', distance.ALL_TYPES)
+
+        policy = categories.policy()
+        try:
+            radius_km = float(request.GET.get('radius_km') or (
+                policy.radius_km(facility_type) if facility_type else categories.DEFAULT_RADIUS_KM))
+            step_km = float(request.GET.get('step_km', 0.5))
+            max_km = float(request.GET.get('max_km', 20))
+            if not (radius_km >= 0 and step_km > 0 and 0 < max_km <= 200 * step_km):
+                raise ValueError
+        except ValueError:
+            return JsonResponse({'error': 'radius_km, step_km and max_km must be positive numbers, '
+                                          'with at most 200 steps'}, status=400)
+
+        with phase('distance'):
+            distances_km = np.arange(1, int(np.floor(max_km / step_km + 1e-9)) + 1) * step_km
+            within = surfaces.within(facility_type, np.concatenate([[radius_km], distances_km]) * 1000)
+            ward_population = surfaces.population()
+            covered, curves = within[0], within[1:]
+            catchments = surfaces.catchments(facility_type)
+
+        def share(part, whole):
+            return round(float(part / whole), 4) if whole > 0 else 0
+
+        county_population = float(ward_population.sum())
+        county_covered = float(covered.sum())
+        return JsonResponse({
+            'name': dataset.name,
+            'year': dataset.year,
+            'type': facility_type or None,
+            'radius_km': radius_km,
+            'county': {
+                'population': round(county_population, 1),
+                'covered_population': round(county_covered, 1),
+                'coverage_share': share(county_covered, county_population),
+            },
+            'wards': [{
+                'ward': ward.ward,
+                'subcounty': ward.subcounty,
+                'population': round(float(ward_population[i + 1]), 1),
+                'covered_population': round(float(covered[i + 1]), 1),
+                'coverage_share': share(covered[i + 1], ward_population[i + 1]),
+            } for i, ward in enumerate(wards)],
+            'curves': {
+                'distance_km': np.round(distances_km, 6).tolist(),
+                'county': np.round(curves.sum(axis=1), 1).tolist(),
+                'wards': np.round(curves[:, 1:].T, 1).tolist(),
+            },
+            'facilities': [{
+                'id': facility.pk,
+                'name': facility.name,
+                'facility_type': facility.facility_type,
+                'catchment_population': round(float(catchments[i]), 1),
+            } for i, facility in enumerate(facilities)
+                if not facility_type or facility.facility_type == facility_type],
+        })
+
+    except Exception:
+        return server_error("Error computing distance coverage")
+
+
+@csrf_exempt
+def nearest_facilities(request):
+    """API endpoint for the k nearest facilities to one or many points, with distances in metres
+
+    GET ?lat=&lng= for one point, or POST {"points": [{"lat": .., "lng": ..}, ...]}
+    for many, answered in one query. ?k= and ?type= (or "k" and "type" in the
+    body) apply to every point. Results are columns per point, nearest first:
+    facility ids and distances, with the facilities they mention described once.
+    """
+    try:
+        try:
+            if request.method == 'POST':
+                data = json.loads(request.body or b'{}')
+                points = [(float(point['lng']), float(point['lat'])) for point in data.get('points', [])]
+            else:
+                data = {}
+                points = [(float(request.GET['lng']), float(request.GET['lat']))]
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            return JsonResponse({'error': f'Invalid points: {str(e)}'}, status=400)
+        if not 0 < len(points) <= NEAREST_MAX_POINTS:
+            return JsonResponse({'error': f'Between 1 and {NEAREST_MAX_POINTS} points are required'}, status=400)
+        lons, lats = np.array(points, dtype=float).T
+        if not (np.isfinite(lons).all() and np.isfinite(lats).all()):
+            return JsonResponse({'error': 'Point coordinates must be finite'}, status=400)
+        try:
+            k = int(data.get('k', request.GET.get('k', 1)))
+            if not 1 <= k <= NEAREST_MAX_K:
+                raise ValueError
+        except (ValueError, TypeError):
+            return JsonResponse({'error': f'k must be an integer from 1 to {NEAREST_MAX_K}'}, status=400)
+        facility_type = data.get('type', request.GET.get('type')) or None
+
+        with phase('nearest'):
+            index = nearest.get()
+            if facility_type is not None and facility_type not in index.trees:
+                return JsonResponse({'error': 'type must be a type of the served facilities',
+                                     'types': index.types}, status=400)
+            distances_m, positions = index.query(lons, lats, k, facility_type)
+
+        with phase('serialize'):
+            mentioned = {}
+            for position in np.unique(positions).tolist():
+                facility = index.facilities[position]
+                lon, lat = facility.location.coords
+                mentioned[facility.pk] = {'name': facility.name, 'facility_type': facility.facility_type,
+                                          'lat': lat, 'lng': lon}
+            return JsonResponse({
+                'k': positions.shape[1],
+                'type': facility_type,
+                'point_count': len(points),
+                'ids': index.ids[positions].tolist(),
+                'distances_m': np.round(distances_m, 1).tolist(),
+                'facilities': mentioned,
+            })
+
+    except Exception:
+        return server_error("Error finding nearest facilities")
+
+
+@offload
+@csrf_exempt
+def ward_population_series(request):
+    """API endpoint for the gridded population of every Kisumu ward in every dataset year"""
+    try:
+        with phase('db'):
+            kisumu_wards = list(KenyaWard.objects.in_county('KISUMU'))
+
+        with phase('raster'):
+            population_cube = cube.get()
+            if population_cube is None:
+                return JsonResponse({'error': 'No population dataset available'}, status=404)
+            series = population_cube.ward_series(kisumu_wards)
+        years = [int(year) for year in population_cube.years]
+        span = years[-1] - years[0]
+
+        def annual_growth(values):
+            if span <= 0 or values[0] <= 0 or values[-1] <= 0:
+                return None
+            return round(((values[-1] / values[0]) ** (1 / span) - 1) * 100, 2)
+
+        wards = []
+        for ward, values in zip(kisumu_wards, series):
+            wards.append({
+                'ward': ward.ward,
+                'subcounty': ward.subcounty,
+                'census_2009': ward.pop2009,
+                'census_2019': ward.pop2019,
+                'population': [int(round(value)) for value in values],
+                'change': int(round(values[-1] - values[0])),
+                'annual_growth_percent': annual_growth(values),
+            })
+
+        totals = series.sum(axis=0)
+        return JsonResponse({
+            'years': years,
+            'dataset_ids': population_cube.dataset_ids,
+            'county': {
+                'population': [int(round(value)) for value in totals],
+                'change': int(round(totals[-1] - totals[0])),
+                'annual_growth_percent': annual_growth(totals),
+            },
+            'wards': wards,
+        })
+
+    except Exception:
+        return server_error("Error building ward population series")
+
+
+async def map_layer(request, name):
+    """Serve a GeoJSON map layer from its precompressed artifact
+
+    The URL carries the layer version (?v=), so a matching response can be cached
+    indefinitely; the ETag lets clients revalidate a bare URL cheaply.
+    """
+    if name not in layers.LAYERS:
+        return JsonResponse({'error': f'Unknown layer: {name}'}, status=404)
+
+    try:
+        # Builds the artifact (a database query) only if it doesn't exist yet
+        version = await sync_to_async(layers.artifact_version)(name)
+        path, encoding = layers.artifact_file(name, version, request.headers.get('Accept-Encoding', ''))
+        etag = f'"{version}.{encoding}"'
+
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            # Read on the analysis pool in chunks, so a large layer doesn't block the event loop
+            file = open(path, 'rb')
+            response = StreamingHttpResponse(offload_iterate(exports.file_chunks(file)),
+                                             content_type='application/geo+json')
+            response['Content-Length'] = str(os.fstat(file.fileno()).st_size)
+            if encoding != 'identity':
+                response['Content-Encoding'] = encoding
+
+        response['ETag'] = etag
+        response['Vary'] = 'Accept-Encoding'
+        if request.GET.get('v') == version:
+            response['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            response['Cache-Control'] = 'no-cache'
+        return response
+
+    except Exception:
+        return server_error("Error serving layer %s", name)
 
 
 def get_kisumu_boundary():
-    """Helper function to get Kisumu County boundary as a shapely geometry"""
+    """Helper function to get Kisumu County boundary as a shapely geometry (cached per process)"""
+    return boundaries.county('KISUMU')
+
+@offload
+@csrf_exempt
+def export_results(request, name):
+    """Stream an export of maps.exports as CSV, newline-delimited GeoJSON or GeoPackage
+
+    ?format= is csv (default), ndjson or gpkg; the suitability candidates take
+    ?facility_type= as the analysis does.
+    """
+    if name not in exports.EXPORTS:
+        return JsonResponse({'error': f'Unknown export: {name}', 'exports': list(exports.EXPORTS)}, status=404)
+    output_format = request.GET.get('format', 'csv')
+    if output_format not in exports.FORMATS:
+        return JsonResponse({'error': f'format must be one of {", ".join(exports.FORMATS)}'}, status=400)
+
     try:
-        kisumu_county = KenyaCounty.objects.get(county__iexact='KISUMU')
-        return kisumu_county.geom
-    except Exception as e:
-        print(f"Error getting Kisumu boundary: {str(e)}")
-        return None
\ No newline at end of file
+        with phase('db'):
+            dataset = select_dataset(request)
+            if not dataset and name != 'facilities':
+                return JsonResponse({'error': 'No population dataset available'}, status=404)
+            export = exports.create(name, dataset, request.GET.get('facility_type', 'Health Centre'))
+
+        size = None
+        if output_format == 'gpkg':
+            with phase('export'):
+                file = exports.geopackage_file(export)
+            size = os.fstat(file.fileno()).st_size
+            chunks = exports.file_chunks(file)
+        elif output_format == 'ndjson':
+            chunks = exports.ndjson_chunks(export)
+        else:
+            chunks = exports.csv_chunks(export)
+
+        content_type, extension = exports.FORMATS[output_format]
+        response = StreamingHttpResponse(
+            offload_iterate(chunks) if isinstance(request, ASGIRequest) else chunks, content_type=content_type,
+        )
+        response['Content-Disposition'] = f'attachment; filename="{name}.{extension}"'
+        if size is not None:
+            response['Content-Length'] = str(size)
+        return response
+
+    except Exception:
+        return server_error("Error exporting %s", name)
+
+
+def snapshot_index(request):
+    """API endpoint listing the current GeoParquet snapshots and their download URLs"""
+    current = snapshots.manifest()
+    for name, entry in current.items():
+        entry['url'] = reverse('snapshot_file', args=[name]) + f'?v={entry["version"]}'
+    return JsonResponse({'available': snapshots.available(), 'snapshots': current})
+
+
+async def snapshot_file(request, name):
+    """Serve the current GeoParquet snapshot of `name`
+
+    Like the map layers, a URL carrying the snapshot version (?v=) can be
+    cached indefinitely and the ETag revalidates a bare one.
+    """
+    entry = snapshots.manifest().get(name)
+    path = snapshots.current_path(name)
+    if name not in snapshots.SNAPSHOTS or path is None:
+        return JsonResponse({'error': f'No snapshot of {name}'}, status=404)
+
+    etag = f'"{entry["version"]}"'
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        response = HttpResponseNotModified()
+    else:
+        file = open(path, 'rb')
+        response = StreamingHttpResponse(offload_iterate(exports.file_chunks(file)),
+                                         content_type='application/vnd.apache.parquet')
+        response['Content-Length'] = str(os.fstat(file.fileno()).st_size)
+        response['Content-Disposition'] = f'attachment; filename="{entry["file"]}"'
+    response['ETag'] = etag
+    if request.GET.get('v') == entry['version']:
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response['Cache-Control'] = 'no-cache'
+    return response
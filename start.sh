@@ -13,8 +13,14 @@ else
     python manage.py migrate --fake --noinput  
 fi
 
-# Start server
+# Rebuild the stale derived artifacts: precompressed map layers served by
+# /maps/api/layers/<name>/, coverage layers and footprints
+python manage.py build_artifacts
+
+# Start server; preload warms the read-only caches once, before the workers fork
+export GUNICORN_PRELOAD=${GUNICORN_PRELOAD:-1}
 exec gunicorn \
+    --config gunicorn.conf.py \
     --bind 0.0.0.0:$PORT \
     --timeout 120 \
-    HealthMapper.wsgi:application
\ No newline at end of file
+    HealthMapper.asgi:application
\ No newline at end of file
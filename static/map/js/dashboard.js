@@ -9,6 +9,27 @@ document.addEventListener('DOMContentLoaded', function() {
         return;
     }
     
+    // Fetch the GeoJSON layers from their versioned (cacheable) URLs
+    const layers = {countyData: 'county', wardsData: 'wards', facilitiesData: 'facilities'};
+    Promise.all(Object.entries(layers).map(([name, layer]) =>
+        fetch(window.layerUrls[layer])
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`Failed to load ${layer} layer: ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(data => { window[name] = data; })
+    ))
+        .then(initializeDashboard)
+        .catch(error => {
+            console.error('Error loading map layers:', error);
+            showErrorMessage('Map data could not be loaded. Please try refreshing the page.');
+        });
+});
+
+// Initialize the dashboard once the layers are loaded
+function initializeDashboard() {
     if (!window.facilitiesData) {
         console.error('Facilities data not available');
         showErrorMessage('Facilities data is missing. Please try refreshing the page.');
@@ -40,7 +61,7 @@ document.addEventListener('DOMContentLoaded', function() {
     document.getElementById('returnToMapBtn').addEventListener('click', function() {
         window.location.href = '/maps/';
     });
-});
+}
 
 // Helper function to show error messages
 function showErrorMessage(message) {
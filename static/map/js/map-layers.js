@@ -1,12 +1,12 @@
 // Create layers
-const countyLayer = L.geoJSON(countyData, {
+const countyLayer = L.geoJSON(null, {
     style: styles.county,
     onEachFeature: (feature, layer) => {
         layer.bindPopup(`<h3>${feature.properties.county}</h3>`);
     }
 }).addTo(map);
 
-const constituencyLayer = L.geoJSON(constituenciesData, {
+const constituencyLayer = L.geoJSON(null, {
     style: styles.constituency,
     onEachFeature: (feature, layer) => {
         layer.bindPopup(`
@@ -16,7 +16,7 @@ const constituencyLayer = L.geoJSON(constituenciesData, {
     }
 }).addTo(map);
 
-const wardLayer = L.geoJSON(wardsData, {
+const wardLayer = L.geoJSON(null, {
     style: styles.ward,
     onEachFeature: (feature, layer) => {
         layer.bindPopup(`
@@ -35,7 +35,7 @@ const facilityIcon = L.icon({
     popupAnchor: [0, -32]
 });
 
-const facilitiesLayer = L.geoJSON(facilitiesData, {
+const facilitiesLayer = L.geoJSON(null, {
     pointToLayer: (feature, latlng) => {
         return L.marker(latlng, {icon: facilityIcon});
     },
@@ -155,5 +155,26 @@ legend.innerHTML = `
     </div>
 `;
 
-// Fit map to county bounds
-map.fitBounds(countyLayer.getBounds());
+// Load the layers from their versioned (cacheable) URLs
+function loadLayer(layer, url) {
+    return fetch(url)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`Failed to load ${url}: ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(data => layer.addData(data));
+}
+
+Promise.all([
+    loadLayer(countyLayer, layerUrls.county),
+    loadLayer(constituencyLayer, layerUrls.constituencies),
+    loadLayer(wardLayer, layerUrls.wards),
+    loadLayer(facilitiesLayer, layerUrls.facilities)
+])
+    .then(() => {
+        // Fit map to county bounds
+        map.fitBounds(countyLayer.getBounds());
+    })
+    .catch(error => console.error('Error loading map layers:', error));
@@ -70,7 +70,7 @@ async function loadPopulationData() {
         const datasetId = datasetSelect ? datasetSelect.value : '';
         
         // Fetch population density data
-        const response = await fetch(`/maps/api/population-density/`);
+        const response = await fetch(`/maps/api/population-density/?dataset=${encodeURIComponent(datasetId)}`);
         
         if (!response.ok) {
             throw new Error('Network response was not ok');